@@ -0,0 +1,151 @@
+"""
+Брокер в памяти процесса вместо RabbitMQ для нагрузочных прогонов.
+
+Повторяет ту часть API aio_pika, которой пользуются producer, consumer
+и воркер доставки: соединение -> канал -> default_exchange.publish,
+declare_queue (в том числе с x-message-ttl, dead-letter маршрутизацией
+и x-max-priority),
+set_qos и queue.consume. Для каждой очереди запоминается время ожидания
+сообщений и время их обработки.
+"""
+import asyncio
+import itertools
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import aio_pika
+
+
+class InMemoryIncomingMessage:
+    """Доставленное сообщение с телом, заголовками, message_id и process() как у aio_pika."""
+
+    def __init__(self, queue: "InMemoryQueue", message: aio_pika.Message):
+        self.queue = queue
+        self.body = message.body
+        self.message_id = message.message_id
+        self.headers = dict(message.headers or {})
+        self.message = message
+        self.enqueued_at = time.perf_counter()
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False, **_):
+        try:
+            yield self
+        except Exception:
+            if requeue:
+                self.queue.put(self.message)
+            raise
+
+
+class InMemoryQueue:
+    def __init__(self, broker: "InMemoryBroker", name: str, arguments: dict | None = None):
+        self.broker = broker
+        self.name = name
+        self.arguments = arguments or {}
+        # (-приоритет, номер, сообщение): среди равных приоритетов — FIFO
+        self._messages: asyncio.PriorityQueue[tuple[int, int, InMemoryIncomingMessage]] = asyncio.PriorityQueue()
+        self._published = itertools.count()
+        self._consumers: list[asyncio.Task] = []
+
+    def put(self, message: aio_pika.Message) -> None:
+        ttl = self.arguments.get("x-message-ttl")
+        if ttl is not None and not self._consumers:
+            target = self.arguments.get("x-dead-letter-routing-key", self.name)
+            asyncio.get_running_loop().call_later(ttl / 1000, self.broker.route, message, target)
+            return
+        priority = min(message.priority or 0, self.arguments.get("x-max-priority", 0))
+        self._messages.put_nowait((-priority, next(self._published), InMemoryIncomingMessage(self, message)))
+
+    async def consume(self, callback, channel: "InMemoryChannel") -> None:
+        self._consumers.append(asyncio.create_task(self._dispatch(callback, channel)))
+
+    async def _dispatch(self, callback, channel: "InMemoryChannel") -> None:
+        in_flight: set[asyncio.Task] = set()
+        while True:
+            *_, incoming = await self._messages.get()
+            while len(in_flight) >= channel.prefetch_count > 0:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            self.broker.queue_wait[self.name].append(time.perf_counter() - incoming.enqueued_at)
+            task = asyncio.create_task(self._handle(callback, incoming))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+    async def _handle(self, callback, incoming: InMemoryIncomingMessage) -> None:
+        started = time.perf_counter()
+        try:
+            await callback(incoming)
+        except Exception:
+            self.broker.errors[self.name] += 1
+        finally:
+            self.broker.handling[self.name].append(time.perf_counter() - started)
+
+    async def close(self) -> None:
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+
+
+class InMemoryExchange:
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+
+    async def publish(self, message: aio_pika.Message, routing_key: str, **_) -> None:
+        self.broker.route(message, routing_key)
+
+
+class InMemoryChannel:
+    is_closed = False
+
+    def __init__(self, broker: "InMemoryBroker"):
+        self.broker = broker
+        self.default_exchange = InMemoryExchange(broker)
+        self.prefetch_count = 0
+
+    async def declare_queue(self, name: str, durable: bool = False, arguments: dict | None = None, **_):
+        return _BoundQueue(self.broker.declare(name, arguments), self)
+
+    async def set_qos(self, prefetch_count: int = 0, **_) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def close(self) -> None:
+        pass
+
+
+class _BoundQueue:
+    """Очередь, объявленная через канал: consume учитывает prefetch этого канала."""
+
+    def __init__(self, queue: InMemoryQueue, channel: InMemoryChannel):
+        self.queue = queue
+        self.channel = channel
+        self.name = queue.name
+
+    async def consume(self, callback, **_) -> None:
+        await self.queue.consume(callback, self.channel)
+
+
+class InMemoryBroker:
+    """Соединение с брокером в памяти (аналог aio_pika.RobustConnection)."""
+
+    is_closed = False
+
+    def __init__(self):
+        self.queues: dict[str, InMemoryQueue] = {}
+        self.queue_wait: defaultdict[str, list[float]] = defaultdict(list)
+        self.handling: defaultdict[str, list[float]] = defaultdict(list)
+        self.errors: defaultdict[str, int] = defaultdict(int)
+
+    def declare(self, name: str, arguments: dict | None = None) -> InMemoryQueue:
+        if name not in self.queues:
+            self.queues[name] = InMemoryQueue(self, name, arguments)
+        return self.queues[name]
+
+    def route(self, message: aio_pika.Message, routing_key: str) -> None:
+        self.declare(routing_key).put(message)
+
+    async def channel(self, **_) -> InMemoryChannel:
+        return InMemoryChannel(self)
+
+    async def close(self) -> None:
+        for queue in self.queues.values():
+            await queue.close()
@@ -0,0 +1,106 @@
+"""
+Заглушка OpenAI-совместимого API для нагрузочных прогонов.
+
+Отвечает на POST /v1/chat/completions (обычный и потоковый режим) с заданной
+задержкой до первого токена и скоростью генерации токенов. Ответ — это
+completion_tokens одинаковых слов, поле usage заполняется.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency: float, token_rate: float, completion_tokens: int) -> FastAPI:
+    """
+    Args:
+        latency (float): Задержка до первого токена, в секундах.
+        token_rate (float): Скорость генерации, токенов в секунду (0 — мгновенно).
+        completion_tokens (int): Число токенов в ответе.
+    """
+    app = FastAPI()
+    token_delay = 1 / token_rate if token_rate > 0 else 0.0
+
+    def usage(messages: list[dict]) -> dict:
+        prompt_tokens = sum(len(str(message.get("content", ""))) // 4 + 4 for message in messages)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def chunk(completion_id: str, model: str, delta: dict, finish_reason: str | None = None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        messages = body.get("messages", [])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if body.get("stream"):
+            async def events():
+                await asyncio.sleep(latency)
+                yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+                for _ in range(completion_tokens):
+                    await asyncio.sleep(token_delay)
+                    yield chunk(completion_id, model, {"content": "tok "})
+                yield chunk(completion_id, model, {}, "stop")
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    payload = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [],
+                        "usage": usage(messages),
+                    }
+                    yield f"data: {json.dumps(payload)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + token_delay * completion_tokens)
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "tok " * completion_tokens},
+                "finish_reason": "stop",
+            }],
+            "usage": usage(messages),
+        })
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого API")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка до первого токена, с")
+    parser.add_argument("--token-rate", type=float, default=100, help="токенов в секунду")
+    parser.add_argument("--completion-tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(args.latency, args.token_rate, args.completion_tokens),
+        host=args.host, port=args.port, log_level="warning",
+    )
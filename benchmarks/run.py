@@ -0,0 +1,330 @@
+"""
+Сквозной нагрузочный прогон конвейера /webhook -> очередь -> process_message
+-> очередь доставки -> send_answer -> callback_url.
+
+Всё работает в одном процессе на локальных заменах внешних сервисов:
+заглушка OpenAI (benchmarks/fake_openai.py), брокер в памяти
+(benchmarks/broker.py), SQLite (или локальный Postgres через --database-url)
+и приёмник ответов (benchmarks/sink.py). Код producer, consumer и воркера
+доставки используется настоящий.
+
+Результат — пропускная способность (сообщений в секунду) и p50/p95/p99
+по этапам; он печатается и сохраняется в JSON, который можно сравнить
+с прогоном на другом коммите через --compare.
+
+Пример:
+    python -m benchmarks.run --messages 500 --concurrency 50 --compare benchmarks/results/old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон onAI на локальных заменах сервисов")
+    parser.add_argument("--messages", type=int, default=300, help="сколько сообщений отправить")
+    parser.add_argument("--concurrency", type=int, default=30, help="одновременных запросов к /webhook")
+    parser.add_argument("--conversations", type=int, default=30, help="между сколькими диалогами делить сообщения")
+    parser.add_argument("--message-chars", type=int, default=200, help="длина входящего сообщения")
+    parser.add_argument("--stream", action="store_true", help="запрашивать потоковые ответы")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="задержка заглушки до первого токена, с")
+    parser.add_argument("--token-rate", type=float, default=200, help="скорость заглушки, токенов в секунду")
+    parser.add_argument("--completion-tokens", type=int, default=50, help="длина ответа заглушки в токенах")
+    parser.add_argument("--openai-base-url", help="внешний OpenAI-совместимый сервер вместо встроенной заглушки")
+    parser.add_argument("--database-url", help="БД для прогона (по умолчанию — временная SQLite)")
+    parser.add_argument("--timeout", type=float, default=300, help="сколько ждать доставки всех ответов, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="куда сохранить результат (JSON)")
+    parser.add_argument("--compare", type=Path, help="результат прошлого прогона для сравнения")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль q (0..1) методом ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(q * len(ordered) + 0.5) - 1))]
+
+
+def summarize(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values),
+    }
+
+
+def summarize_histogram(histogram, **labels) -> dict:
+    """Перцентили по корзинам гистограммы из src.metrics (приближённо)."""
+    count = histogram.count(**labels)
+    if not count:
+        return {"count": 0}
+    return {
+        "count": count,
+        "p50": histogram.quantile(0.5, **labels),
+        "p95": histogram.quantile(0.95, **labels),
+        "p99": histogram.quantile(0.99, **labels),
+        "approximate": True,
+    }
+
+
+def configure_environment(args: argparse.Namespace, workdir: str) -> None:
+    """
+    Настраивает окружение до импорта src: конфиг читается при импорте модулей.
+    Явно заданные переменные окружения не перезаписываются.
+    """
+    os.environ.setdefault("DATABASE_URL", args.database_url or f"sqlite+aiosqlite:///{workdir}/bench.db")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("LOGGING_LEVEL", "ERROR")
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("DELIVERY_RETRY_DELAYS", "1,2")
+
+
+async def serve(app, port: int):
+    """Запускает ASGI-приложение под uvicorn в текущем цикле событий."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_lowercase + " ") for _ in range(length))
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from fastapi_limiter.depends import RateLimiter
+    from httpx import ASGITransport, AsyncClient
+
+    from benchmarks.broker import InMemoryBroker
+    from benchmarks.fake_openai import create_app as create_fake_openai
+    from benchmarks.sink import CallbackSink
+    from src import consumer, delivery, metrics
+    from src.callback_client import callback_client
+    from src.config import QUEUE_NAME, CONVERSATION_SHARDS, DELIVERY_PREFETCH
+    from src.database import create_tables, engine
+    from src.openai_service import client as openai_client
+    from src.ordering import declare_conversation_queues
+    from src.producer import app
+    from src.rabbit import rabbitmq_service
+    from src.redis_client import close_redis
+
+    servers = []
+    if args.openai_base_url:
+        openai_client.base_url = args.openai_base_url
+    else:
+        port = free_port()
+        fake = create_fake_openai(args.llm_latency, args.token_rate, args.completion_tokens)
+        servers.append(await serve(fake, port))
+        openai_client.base_url = f"http://127.0.0.1:{port}/v1"
+
+    sink = CallbackSink()
+    sink_port = free_port()
+    servers.append(await serve(sink.app, sink_port))
+
+    # Лимит частоты запросов к /webhook хранится в Redis и в прогоне не нужен
+    for route in app.routes:
+        for dependency in getattr(route, "dependencies", []):
+            if isinstance(dependency.dependency, RateLimiter):
+                app.dependency_overrides[dependency.dependency] = lambda: None
+
+    await create_tables()
+    broker = InMemoryBroker()
+    # Producer публикует через брокер в памяти вместо подключения к RabbitMQ
+    rabbitmq_service._connection = broker
+    rabbitmq_service._channel = await broker.channel()
+
+    callback_client.start()
+    consumer.register_gauges()
+    await delivery.delivery_publisher.setup(broker)
+
+    consumer_channel = await broker.channel()
+    prefetch_task = asyncio.create_task(consumer.adjust_prefetch(consumer_channel))
+    input_queues = await declare_conversation_queues(consumer_channel, QUEUE_NAME, CONVERSATION_SHARDS)
+    for queue in input_queues:
+        await queue.consume(consumer.callback)
+    input_queue_names = [queue.name for queue in input_queues]
+
+    delivery_channel = await broker.channel()
+    await delivery_channel.set_qos(prefetch_count=DELIVERY_PREFETCH)
+    await (await delivery.declare_delivery_queues(delivery_channel)).consume(delivery.deliver)
+
+    rng = random.Random(args.seed)
+    payloads = [
+        {
+            "message": random_text(rng, args.message_chars),
+            "callback_url": f"http://127.0.0.1:{sink_port}/callback?id={index}",
+            "conversation_id": f"bench-{index % args.conversations}",
+            "stream": args.stream,
+        }
+        for index in range(args.messages)
+    ]
+    sent_at: dict[str, float] = {}
+    webhook_latency: list[float] = []
+    webhook_errors = 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def send(http: AsyncClient, index: int, payload: dict) -> None:
+        nonlocal webhook_errors
+        async with slots:
+            started = time.perf_counter()
+            sent_at[str(index)] = started
+            response = await http.post("/webhook", json=payload)
+            webhook_latency.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                webhook_errors += 1
+
+    started = time.perf_counter()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as http:
+        await asyncio.gather(*(send(http, index, payload) for index, payload in enumerate(payloads)))
+    accepted_at = time.perf_counter()
+
+    deadline = started + args.timeout
+    expected = args.messages - webhook_errors
+    while len(sink.final_arrivals) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    finished = time.perf_counter()
+    await asyncio.gather(*consumer.compaction_tasks.values(), return_exceptions=True)
+
+    prefetch_task.cancel()
+    await broker.close()
+    await consumer.message_writer.close()
+    await callback_client.close()
+    await close_redis()
+    await rabbitmq_service.close_connection()
+    for server, task in servers:
+        server.should_exit = True
+        await task
+    await engine.dispose()
+
+    delivered = len(sink.final_arrivals)
+    end_to_end = [sink.final_arrivals[key] - sent_at[key] for key in sink.final_arrivals if key in sent_at]
+    stages = {
+        "webhook": summarize(webhook_latency),
+        "queue_wait": summarize([value for name in input_queue_names for value in broker.queue_wait[name]]),
+        "process": summarize([value for name in input_queue_names for value in broker.handling[name]]),
+        "db_read": summarize_histogram(metrics.DB_LATENCY, operation="read"),
+        "db_write": summarize_histogram(metrics.DB_LATENCY, operation="write"),
+        "llm": summarize_histogram(metrics.LLM_LATENCY, status="ok"),
+        "delivery_queue_wait": summarize(broker.queue_wait[delivery.DELIVERY_QUEUE_NAME]),
+        "send_answer": summarize(broker.handling[delivery.DELIVERY_QUEUE_NAME]),
+        "end_to_end": summarize(end_to_end),
+    }
+    if args.stream:
+        stages["first_frame"] = summarize([
+            sink.first_arrivals[key] - sent_at[key] for key in sink.first_arrivals if key in sent_at
+        ])
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        },
+        "throughput": {
+            "accepted_per_second": args.messages / (accepted_at - started),
+            "delivered_per_second": delivered / (finished - started),
+        },
+        "totals": {
+            "sent": args.messages,
+            "webhook_errors": webhook_errors,
+            "delivered": delivered,
+            "callback_frames": sink.frames,
+            "consumer_errors": sum(broker.errors[name] for name in input_queue_names),
+            "delivery_errors": broker.errors[delivery.DELIVERY_QUEUE_NAME],
+            "timed_out": delivered < expected,
+        },
+        "stages": stages,
+    }
+
+
+def format_seconds(value) -> str:
+    return "-" if value is None else f"{value * 1000:9.1f}ms"
+
+
+def print_report(result: dict, previous: dict | None) -> None:
+    meta, totals = result["meta"], result["totals"]
+    print(f"onAI benchmark @ {meta['commit']} ({meta['timestamp']})")
+    print(
+        f"sent {totals['sent']}, delivered {totals['delivered']}, "
+        f"webhook errors {totals['webhook_errors']}, consumer errors {totals['consumer_errors']}"
+        + (" — TIMED OUT" if totals["timed_out"] else "")
+    )
+    for name, value in result["throughput"].items():
+        line = f"{name:>22}: {value:9.1f} msg/s"
+        if previous and name in previous.get("throughput", {}):
+            old = previous["throughput"][name]
+            line += f"   (was {old:9.1f}, {(value - old) / old * 100 if old else 0:+.1f}%)"
+        print(line)
+
+    print(f"\n{'stage':>20} {'count':>7} {'p50':>11} {'p95':>11} {'p99':>11}")
+    for name, stats in result["stages"].items():
+        line = f"{name:>20} {stats['count']:>7}"
+        for key in ("p50", "p95", "p99"):
+            line += f" {format_seconds(stats.get(key))}"
+        old = (previous or {}).get("stages", {}).get(name, {})
+        if old.get("p95") and stats.get("p95") is not None:
+            line += f"   p95 {(stats['p95'] - old['p95']) / old['p95'] * 100:+.1f}%"
+        if stats.get("approximate"):
+            line += "   ~"
+        print(line)
+    print("\n~ — оценка по корзинам гистограммы src.metrics")
+
+
+def main() -> None:
+    args = parse_args()
+    previous = json.loads(args.compare.read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, workdir)
+        result = asyncio.run(run(args))
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{result['meta']['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+    print_report(result, previous)
+    print(f"\nРезультат сохранён в {output}")
+
+
+if __name__ == "__main__":
+    main()
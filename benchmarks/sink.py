@@ -0,0 +1,37 @@
+"""
+Приёмник ответов для нагрузочных прогонов — аналог get_callback.py,
+который запоминает время прихода каждого кадра.
+
+Сообщения различаются по параметру id в callback_url. Для потоковых ответов
+запоминается время первого кадра и время финального (done или без seq).
+"""
+import time
+
+from fastapi import FastAPI, Request
+
+
+class CallbackSink:
+    """Время прихода первого и финального ответа по id сообщения."""
+
+    def __init__(self):
+        self.first_arrivals: dict[str, float] = {}
+        self.final_arrivals: dict[str, float] = {}
+        self.frames = 0
+        self.app = FastAPI()
+        self.app.post("/callback")(self.receive)
+
+    async def receive(self, request: Request):
+        arrived_at = time.perf_counter()
+        message_id = request.query_params.get("id", "")
+        payload = await request.json()
+        self.frames += 1
+        self.first_arrivals.setdefault(message_id, arrived_at)
+        if payload.get("seq") is None or payload.get("done"):
+            self.final_arrivals.setdefault(message_id, arrived_at)
+        return {"status": "ok"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(CallbackSink().app, host="localhost", port=8080, log_level="warning")
@@ -0,0 +1,73 @@
+"""Таблица messages в том виде, в каком её создавал create_all
+
+Уже существующая таблица (в том числе из самой первой версии без
+conversation_id, tokens, compacted и роли system) доводится до этой схемы.
+
+Revision ID: 0001_initial
+Revises:
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from src.config import DEFAULT_CONVERSATION_ID
+
+revision = "0001_initial"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "ix_messages_conversation_id_created_at"
+
+
+def upgrade_existing() -> None:
+    """
+    Доводит до текущей схемы таблицу, созданную до миграций через create_all:
+    в самой первой версии в ней были только id, created_at, content и role
+    (user, assistant). Недостающие колонки добавляются с серверными значениями
+    по умолчанию: диалог DEFAULT_CONVERSATION_ID, несвёрнутые сообщения,
+    число токенов — грубая оценка по длине текста (4 символа на токен).
+    """
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("messages")}
+
+    if "conversation_id" not in columns:
+        op.add_column("messages", sa.Column(
+            "conversation_id", sa.String(64), nullable=False, server_default=DEFAULT_CONVERSATION_ID,
+        ))
+    if "tokens" not in columns:
+        op.add_column("messages", sa.Column("tokens", sa.Integer, nullable=False, server_default="0"))
+        op.execute("UPDATE messages SET tokens = (length(content) + 3) / 4")
+    if "compacted" not in columns:
+        op.add_column("messages", sa.Column("compacted", sa.Boolean, nullable=False, server_default=sa.false()))
+    if INDEX_NAME not in {index["name"] for index in inspector.get_indexes("messages")}:
+        op.create_index(INDEX_NAME, "messages", ["conversation_id", "created_at"])
+
+    if bind.dialect.name == "postgresql":
+        # Новое значение enum нельзя использовать в той же транзакции, поэтому отдельно
+        with op.get_context().autocommit_block():
+            op.execute("ALTER TYPE role ADD VALUE IF NOT EXISTS 'system'")
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("messages"):
+        upgrade_existing()
+        return
+    op.create_table(
+        "messages",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+        sa.Column("conversation_id", sa.String(64), nullable=False),
+        sa.Column("content", sa.String, nullable=False),
+        sa.Column("role", sa.Enum("user", "assistant", "system", name="role"), nullable=False),
+        sa.Column("tokens", sa.Integer, nullable=False),
+        sa.Column("compacted", sa.Boolean, nullable=False),
+    )
+    op.create_index(INDEX_NAME, "messages", ["conversation_id", "created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX_NAME, table_name="messages")
+    op.drop_table("messages")
+    sa.Enum(name="role").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,93 @@
+"""Помесячное партиционирование messages по created_at (только PostgreSQL)
+
+Существующая таблица не копируется: она переименовывается в messages_legacy
+и подключается к новой партиционированной таблице как партиция
+(MINVALUE .. начало следующего месяца). Диапазон заранее подтверждается
+CHECK-ограничением, поэтому ATTACH не сканирует таблицу повторно.
+Дальше строки пишутся в помесячные партиции messages_pYYYYMM.
+
+Revision ID: 0002_partition_messages
+Revises: 0001_initial
+Create Date: 2026-10-16
+"""
+from datetime import datetime
+
+from alembic import op
+
+from src.config import MESSAGES_PARTITIONS_AHEAD
+from src.database import month_start, partition_name
+
+revision = "0002_partition_messages"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+COLUMNS = """
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    conversation_id VARCHAR(64) NOT NULL,
+    content VARCHAR NOT NULL,
+    role role NOT NULL,
+    tokens INTEGER NOT NULL,
+    compacted BOOLEAN NOT NULL"""
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    boundary = month_start(datetime.now(), 1)
+
+    op.execute("ALTER TABLE messages RENAME TO messages_legacy")
+    op.execute("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey")
+    op.execute(
+        "ALTER INDEX ix_messages_conversation_id_created_at "
+        "RENAME TO ix_messages_legacy_conversation_id_created_at"
+    )
+    op.execute("ALTER TABLE messages_legacy ALTER COLUMN id DROP DEFAULT")
+
+    op.execute(f"""
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),{COLUMNS},
+            CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("CREATE INDEX ix_messages_conversation_id_created_at ON messages (conversation_id, created_at)")
+
+    op.execute(f"""
+        ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_created_at_check
+        CHECK (created_at < '{boundary.isoformat()}') NOT VALID
+    """)
+    op.execute("ALTER TABLE messages_legacy VALIDATE CONSTRAINT messages_legacy_created_at_check")
+    op.execute(f"""
+        ALTER TABLE messages ATTACH PARTITION messages_legacy
+        FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')
+    """)
+    op.execute("ALTER TABLE messages_legacy DROP CONSTRAINT messages_legacy_created_at_check")
+
+    for offset in range(MESSAGES_PARTITIONS_AHEAD + 1):
+        start, end = month_start(boundary, offset), month_start(boundary, offset + 1)
+        op.execute(f"""
+            CREATE TABLE {partition_name(start)} PARTITION OF messages
+            FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+        """)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey")
+    op.execute(
+        "ALTER INDEX ix_messages_conversation_id_created_at "
+        "RENAME TO ix_messages_partitioned_conversation_id_created_at"
+    )
+    op.execute(f"""
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),{COLUMNS},
+            CONSTRAINT messages_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("INSERT INTO messages SELECT * FROM messages_partitioned")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("DROP TABLE messages_partitioned")
+    op.execute("CREATE INDEX ix_messages_conversation_id_created_at ON messages (conversation_id, created_at)")
@@ -0,0 +1,82 @@
+import asyncio
+import importlib.util
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+
+from src.config import (
+    logger,
+    CALLBACK_HTTP2,
+    CALLBACK_TIMEOUT,
+    CALLBACK_CONNECT_TIMEOUT,
+    CALLBACK_MAX_CONNECTIONS,
+    CALLBACK_MAX_KEEPALIVE,
+    CALLBACK_KEEPALIVE_EXPIRY,
+    CALLBACK_MAX_PER_HOST,
+)
+
+
+class CallbackClient:
+    """
+    Долгоживущий HTTP-клиент для отправки ответов на callback_url.
+    Держит пул keep-alive соединений (при наличии h2 — по HTTP/2),
+    ограничивает число одновременных запросов к одному хосту
+    и задаёт явные таймауты.
+    """
+
+    def __init__(
+            self,
+            http2: bool,
+            timeout: float,
+            connect_timeout: float,
+            max_connections: int,
+            max_keepalive: int,
+            keepalive_expiry: float,
+            max_per_host: int,
+    ):
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logger.warning("⚠ Пакет h2 не установлен, callback отправляются по HTTP/1.1")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_per_host = max_per_host
+        self._client: httpx.AsyncClient | None = None
+        self._host_slots: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.max_per_host)
+        )
+
+    def start(self) -> httpx.AsyncClient:
+        """Создаёт (если ещё не создан) и возвращает общий httpx-клиент."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(http2=self.http2, timeout=self.timeout, limits=self.limits)
+            logger.info("✅ HTTP-клиент для callback создан")
+        return self._client
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """POST-запрос через общий пул с ограничением на число запросов к хосту."""
+        client = self.start()
+        async with self._host_slots[urlsplit(url).netloc]:
+            return await client.post(url, **kwargs)
+
+    async def close(self) -> None:
+        """Закрывает пул соединений, дожидаясь завершения активных запросов."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("✅ HTTP-клиент для callback закрыт")
+        self._client = None
+
+
+callback_client = CallbackClient(
+    http2=CALLBACK_HTTP2,
+    timeout=CALLBACK_TIMEOUT,
+    connect_timeout=CALLBACK_CONNECT_TIMEOUT,
+    max_connections=CALLBACK_MAX_CONNECTIONS,
+    max_keepalive=CALLBACK_MAX_KEEPALIVE,
+    keepalive_expiry=CALLBACK_KEEPALIVE_EXPIRY,
+    max_per_host=CALLBACK_MAX_PER_HOST,
+)
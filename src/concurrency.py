@@ -0,0 +1,100 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from src.config import (
+    logger,
+    CONCURRENCY_MIN,
+    CONCURRENCY_MAX,
+    CONCURRENCY_INITIAL,
+    CONCURRENCY_TARGET_LATENCY,
+    CONCURRENCY_BACKOFF,
+)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD-ограничитель числа одновременно обрабатываемых сообщений.
+    Каждое быстрое (не дольше target_latency) сообщение увеличивает лимит
+    на 1/limit, то есть примерно на единицу за «окно» сообщений.
+    Медленное сообщение или перегрузка LLM (429/5xx) уменьшает лимит
+    в backoff раз, но не чаще раза в target_latency секунд,
+    чтобы одна вспышка ошибок не обрушила лимит до минимума.
+    """
+
+    def __init__(
+            self,
+            min_limit: int,
+            max_limit: int,
+            initial_limit: int,
+            target_latency: float,
+            backoff: float,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Текущий лимит одновременно обрабатываемых сообщений."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """Сколько сообщений обрабатывается прямо сейчас."""
+        return self._in_flight
+
+    def on_success(self, latency: float) -> None:
+        """Учитывает время обработки сообщения."""
+        if latency > self.target_latency:
+            self._decrease("latency")
+        else:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def on_overload(self) -> None:
+        """Учитывает ответ 429/5xx или таймаут от LLM."""
+        self._decrease("overload")
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.target_latency:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        logger.warning(f"📉 Лимит параллельности снижен {previous} → {self.limit} ({reason})")
+
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Занимает слот обработки (ждёт, пока in_flight < limit),
+        а по завершении учитывает время обработки.
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self.on_success(time.monotonic() - started)
+            await self._notify()
+
+
+consumer_limiter = AdaptiveLimiter(
+    min_limit=CONCURRENCY_MIN,
+    max_limit=CONCURRENCY_MAX,
+    initial_limit=CONCURRENCY_INITIAL,
+    target_latency=CONCURRENCY_TARGET_LATENCY,
+    backoff=CONCURRENCY_BACKOFF,
+)
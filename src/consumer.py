@@ -1,21 +1,76 @@
+import argparse
 import asyncio
+import functools
+import signal
+import time
 
 import aio_pika
 import httpx
-from pydantic import HttpUrl
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.config import logger, RABBITMQ_URL, QUEUE_NAME
+from src.config import (
+    logger,
+    log_payload,
+    RABBITMQ_URL,
+    QUEUE_NAME,
+    CONVERSATION_SHARDS,
+    HISTORY_TOKENS_BUDGET,
+    COMPACTION_THRESHOLD,
+    COMPACTION_KEEP_RECENT,
+    CONCURRENCY_ADJUST_INTERVAL,
+    WRITE_BATCH_ENABLED,
+    STREAM_CHUNK_CHARS,
+    STREAM_CHUNK_INTERVAL,
+    STREAM_FRAME_BACKLOG,
+    METRICS_HOST,
+    METRICS_PORT,
+    CONSUMER_WORKERS,
+    DRAIN_TIMEOUT,
+)
+from src.callback_client import callback_client
+from src.concurrency import consumer_limiter
 from src.database import (
     get_async_session,
-    insert_message,
+    get_read_session,
+    insert_messages,
+    message_writer,
     Role,
-    get_all_messages,
+    get_history_window,
+    get_dialog_summary,
+    count_uncompacted_messages,
+    get_compaction_candidates,
+    save_dialog_summary,
     DBMessage,
     create_tables,
+    engine,
+)
+from src.delivery import delivery_publisher
+from src.history_cache import history_cache
+from src.idempotency import idempotency_store
+from src.metrics import (
+    PUBLISHED_AT_HEADER,
+    QUEUE_WAIT,
+    DB_LATENCY,
+    IN_FLIGHT,
+    CONCURRENCY_LIMIT,
+    DB_POOL_CHECKED_OUT,
+    start_metrics_server,
 )
-from src.models import InputMessage
-from src.openai_service import get_answer
+from src.models import InputMessage, AnswerMessage
+from src.openai_service import get_answer, get_summary, stream_answer
+from src.ordering import compaction_leases, conversation_locks, declare_conversation_queues, worker_shards
+from src.rate_scheduler import rate_scheduler
+from src.redis_client import close_redis
+from src.response_cache import response_cache
+from src.supervisor import Supervisor
+from src.tokenizer import count_tokens
+
+# Фоновые задачи сжатия, по одной на диалог
+compaction_tasks: dict[str, asyncio.Task] = {}
+# Колбэки, обрабатывающие сообщения прямо сейчас: их дожидается остановка
+in_flight_callbacks: set[asyncio.Task] = set()
+# Фоновые отправители промежуточных кадров потоковых ответов
+stream_senders: set[asyncio.Task] = set()
 
 
 def get_messages_list_as_json(messages: list[DBMessage]) -> list[dict]:
@@ -32,86 +87,384 @@ def get_messages_list_as_json(messages: list[DBMessage]) -> list[dict]:
     ]
 
 
-async def process_message(session: AsyncSession, input_message: InputMessage) -> str:
+async def get_history(
+        session: AsyncSession,
+        conversation_id: str,
+        token_budget: int = HISTORY_TOKENS_BUDGET,
+) -> list[dict]:
     """
-    Сохраняет входящее сообщение в БД, получает всю историю сообщений
-    и запрашивает ответ у AI-модели. Затем сохраняет ответ в БД и возвращает его.
+    Возвращает краткое содержание и окно истории диалога в пределах token_budget
+    в формате OpenAI API. Сначала читает кэш в Redis, при промахе — берёт их из БД
+    (с реплики, если она настроена). Кэш заполняется только прочитанным с основной
+    БД: отставание реплики проверка поколения не замечает, и пропущенная реплика
+    осталась бы в кэше на HISTORY_CACHE_TTL.
     """
-    await insert_message(session, input_message.message, Role.user)
+    history = await history_cache.get_window(conversation_id, token_budget)
+    if history is not None:
+        return history
 
-    all_msgs = await get_all_messages(session)
-    all_msgs_json = get_messages_list_as_json(all_msgs)
-    logger.debug(f"🔹 Текущая история диалога: {all_msgs_json}")
+    generation = await history_cache.generation(conversation_id)
+    with DB_LATENCY.time(operation="read"):
+        async with get_read_session(conversation_id, session) as read_session:
+            summary = await get_dialog_summary(read_session, conversation_id)
+            token_budget -= summary.tokens if summary else 0
+            messages = await get_history_window(read_session, conversation_id, token_budget)
+            # get_read_session отдаёт переданную сессию, если читает с основной БД
+            from_primary = read_session is session
+    if from_primary:
+        await history_cache.rebuild(conversation_id, messages, summary, generation)
+    if summary is not None:
+        messages = [summary, *messages]
+    return get_messages_list_as_json(messages)
 
-    answer = await get_answer(all_msgs_json)
-    logger.info("✅ Ответ от AI получен")
-    logger.debug(f"📜 Ответ: {answer}")
 
-    await insert_message(session, answer, Role.assistant)
+async def compact_dialog(conversation_id: str) -> None:
+    """
+    Сворачивает старые реплики диалога в краткое содержание, если несвёрнутых
+    реплик больше COMPACTION_THRESHOLD. Сжатие инкрементальное: в модель уходят
+    предыдущее краткое содержание и только реплики, добавленные после него,
+    кроме COMPACTION_KEEP_RECENT самых свежих. Диалог сжимает только один
+    процесс: остальные пропускают его, пока держится блокировка в Redis.
+    """
+    try:
+        async with compaction_leases.hold(conversation_id) as acquired:
+            if not acquired:
+                logger.debug("🔹 Диалог %s уже сжимает другой процесс", conversation_id)
+                return
+            async with get_async_session() as session:
+                if await count_uncompacted_messages(session, conversation_id) <= COMPACTION_THRESHOLD:
+                    return
+
+                candidates = await get_compaction_candidates(session, conversation_id, COMPACTION_KEEP_RECENT)
+                if not candidates:
+                    return
+                previous = await get_dialog_summary(session, conversation_id)
+
+                summary = await get_summary(
+                    previous.content if previous else None,
+                    get_messages_list_as_json(candidates),
+                )
+                if not summary:
+                    logger.warning(f"⚠ Диалог {conversation_id} не сжат: нет краткого содержания")
+                    return
+
+                await save_dialog_summary(session, conversation_id, summary, [m.id for m in candidates])
+    except Exception as exc:
+        logger.exception(f"❌ Ошибка при сжатии диалога {conversation_id}:", exc_info=exc)
+
+
+def needs_compaction(history: list[dict]) -> bool:
+    """
+    Дешёвая проверка после хода, без обращений к Redis и БД: сжатие имеет смысл,
+    только если в окне истории (с новым ходом) больше COMPACTION_THRESHOLD реплик
+    или окно заняло бюджет HISTORY_TOKENS_BUDGET так, что следующая реплика
+    среднего размера в него уже не вошла бы, — тогда старые реплики могли
+    остаться за окном. Точное число несвёрнутых реплик считает compact_dialog.
+    """
+    replies = [message for message in history if message["role"] != Role.system]
+    if len(replies) + 1 > COMPACTION_THRESHOLD:
+        return True
+    used_tokens = sum(count_tokens(message["content"]) for message in history)
+    return used_tokens + used_tokens / len(history) > HISTORY_TOKENS_BUDGET
+
 
-    return answer
+def schedule_compaction(conversation_id: str) -> None:
+    """Запускает фоновое сжатие диалога, если оно ещё не идёт."""
+    if conversation_id in compaction_tasks:
+        return
+    task = asyncio.create_task(compact_dialog(conversation_id))
+    compaction_tasks[conversation_id] = task
+    task.add_done_callback(lambda _: compaction_tasks.pop(conversation_id, None))
 
 
-async def send_answer(callback_url: HttpUrl, answer: str) -> None:
+async def save_turn(session: AsyncSession, conversation_id: str, messages: list[tuple[Role, str]]) -> None:
     """
-    Отправляет ответ (answer) по указанному callback_url,
-    логируя результат и обрабатывая возможные ошибки.
+    Сохраняет реплики хода диалога одной вставкой: напрямую в сессии
+    или, если включено WRITE_BATCH_ENABLED, через общий пакетный message_writer.
     """
+    with DB_LATENCY.time(operation="write"):
+        if WRITE_BATCH_ENABLED:
+            await message_writer.write(conversation_id, messages)
+        else:
+            await insert_messages(session, conversation_id, messages)
+
+
+async def send_stream_frame(callback_url: str, frame: dict) -> None:
+    """Отправляет кадр потокового ответа; ошибки только логируются."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(str(callback_url), json={"message": answer})
-            logger.info(f"📨 Ответ отправлен, статус-код: {response.status_code}")
+        await callback_client.post(callback_url, json=frame)
     except httpx.HTTPError as exc:
-        logger.error(f"❌ Ошибка при отправке ответа: {exc}")
+        logger.warning(f"⚠ Не удалось отправить кадр {frame['seq']} потокового ответа: {exc}")
+
+
+async def send_stream_frames(callback_url: str, frames: asyncio.Queue) -> None:
+    """Отправляет кадры из очереди по порядку, пока не встретит None."""
+    while (frame := await frames.get()) is not None:
+        await send_stream_frame(callback_url, frame)
+
+
+async def stream_to_callback(input_message: InputMessage, history_json: list[dict]) -> tuple[str, int]:
+    """
+    Получает ответ модели потоком и отправляет его на callback_url кадрами
+    с возрастающим seq: кадр уходит, когда накоплено STREAM_CHUNK_CHARS символов
+    или прошло STREAM_CHUNK_INTERVAL секунд с предыдущего кадра.
+    Кадры отправляет фоновая задача, поэтому медленный получатель не задерживает
+    генерацию: если отправки ждут STREAM_FRAME_BACKLOG кадров, текст копится
+    до освобождения места. Финальный кадр (через очередь доставки) содержит
+    весь ответ, поэтому может прийти раньше последних промежуточных.
+    При ошибке модели получатель получает завершающий кадр с error.
+    Возвращает собранный ответ и номер для финального кадра.
+    """
+    callback_url = str(input_message.callback_url)
+    frames: asyncio.Queue = asyncio.Queue()
+    sender = asyncio.create_task(send_stream_frames(callback_url, frames))
+    stream_senders.add(sender)
+    sender.add_done_callback(stream_senders.discard)
+
+    parts: list[str] = []
+    buffer: list[str] = []
+    buffered_chars = 0
+    seq = 0
+    last_sent = time.monotonic()
+
+    def enqueue(chunk: str, force: bool = False) -> bool:
+        nonlocal seq
+        if frames.qsize() >= STREAM_FRAME_BACKLOG and not force:
+            return False
+        frames.put_nowait({"message": chunk, "seq": seq, "done": False})
+        seq += 1
+        return True
+
+    try:
+        async for delta in stream_answer(history_json):
+            parts.append(delta)
+            buffer.append(delta)
+            buffered_chars += len(delta)
+            if buffered_chars >= STREAM_CHUNK_CHARS or time.monotonic() - last_sent >= STREAM_CHUNK_INTERVAL:
+                if enqueue("".join(buffer)):
+                    buffer, buffered_chars = [], 0
+                    last_sent = time.monotonic()
+        if buffer:
+            enqueue("".join(buffer), force=True)
+    except Exception:
+        frames.put_nowait({"message": "", "seq": seq, "done": True, "error": "Ошибка генерации ответа"})
+        raise
+    finally:
+        frames.put_nowait(None)
+    return "".join(parts), seq
+
+
+async def process_message(session: AsyncSession, input_message: InputMessage) -> AnswerMessage:
+    """
+    Получает окно истории диалога (в пределах HISTORY_TOKENS_BUDGET вместе
+    с входящим сообщением), запрашивает ответ у AI-модели (потоком, если
+    клиент запросил stream), затем сохраняет входящее сообщение и ответ в БД
+    одной транзакцией, при необходимости запускает фоновое сжатие диалога
+    и возвращает ответ, готовый к доставке. Ответ на сообщение с message_id
+    запоминается для повторных доставок.
+    """
+    conversation_id = input_message.conversation_id
+    user_message = {"role": Role.user, "content": input_message.message}
+
+    token_budget = HISTORY_TOKENS_BUDGET - count_tokens(input_message.message)
+    history_json = [*await get_history(session, conversation_id, token_budget), user_message]
+    log_payload("🔹 Текущая история диалога", history_json)
+
+    seq = None
+    if input_message.stream:
+        answer, seq = await stream_to_callback(input_message, history_json)
+    else:
+        answer = await get_answer(history_json)
+    logger.info("✅ Ответ от AI получен")
+    log_payload("📜 Ответ", answer)
+
+    await save_turn(session, conversation_id, [
+        (Role.user, input_message.message),
+        (Role.assistant, answer),
+    ])
+    if needs_compaction(history_json):
+        schedule_compaction(conversation_id)
+
+    answer_message = AnswerMessage(
+        message=answer,
+        callback_url=input_message.callback_url,
+        conversation_id=conversation_id,
+        seq=seq,
+    )
+    await idempotency_store.save_answer(input_message, answer_message)
+    return answer_message
+
+
+def observe_queue_wait(message: aio_pika.IncomingMessage) -> None:
+    """Учитывает время ожидания сообщения в очереди по заголовку публикации."""
+    published_at = (message.headers or {}).get(PUBLISHED_AT_HEADER)
+    if isinstance(published_at, (int, float)):
+        QUEUE_WAIT.observe(max(time.time() - published_at, 0.0))
+
+
+def register_gauges() -> None:
+    """Привязывает gauge-метрики к текущему состоянию consumer и пула БД."""
+    IN_FLIGHT.set_function(lambda: consumer_limiter.in_flight)
+    CONCURRENCY_LIMIT.set_function(lambda: consumer_limiter.limit)
+    # У NullPool (DB_POOL_SIZE=0) нет checkedout; пул берётся при каждом чтении,
+    # так как engine.dispose() заменяет его новым
+    if hasattr(engine.pool, "checkedout"):
+        DB_POOL_CHECKED_OUT.set_function(lambda: engine.pool.checkedout())
 
 
 async def callback(message: aio_pika.IncomingMessage) -> None:
     """
     Колбэк, вызываемый при получении сообщения из очереди.
     Обрабатывает входящее сообщение (InputMessage), формирует ответ от AI
-    и отправляет его на callback_url.
+    и публикует его (для стриминга — финальный кадр) в очередь доставки. Сообщение подтверждается сразу после
+    публикации, не дожидаясь ответа callback_url.
+    Сообщения одного диалога обрабатываются по одному в порядке получения,
+    разных диалогов — параллельно; общее число ограничивает consumer_limiter.
+    На повторно доставленное сообщение публикуется сохранённый ответ без
+    нового запроса к модели. Ключ — клиентский message_id, а без него —
+    AMQP message_id, который producer ставит каждому сообщению.
     """
     logger.info("📩 Получено новое сообщение от RabbitMQ")
+    observe_queue_wait(message)
 
     input_message = InputMessage.model_validate_json(message.body.decode())
+    if input_message.message_id is None and message.message_id:
+        input_message = input_message.model_copy(update={"message_id": message.message_id})
 
-    async with message.process():
-        async with get_async_session() as session:
-            answer = await process_message(session, input_message)
-            await send_answer(input_message.callback_url, answer)
+    task = asyncio.current_task()
+    in_flight_callbacks.add(task)
+    try:
+        # Блокировка берётся до первого await, чтобы сохранить порядок доставки
+        async with conversation_locks.hold(input_message.conversation_id), message.process():
+            stored_answer = await idempotency_store.get_answer(input_message)
+            if stored_answer is not None:
+                logger.info(f"♻ Сообщение {input_message.message_id} уже обработано, отправляем сохранённый ответ")
+                answer = stored_answer
+            else:
+                async with consumer_limiter.slot(), get_async_session() as session:
+                    answer = await process_message(session, input_message)
+            await delivery_publisher.publish(answer)
+    finally:
+        in_flight_callbacks.discard(task)
 
 
-async def consume() -> None:
+async def adjust_prefetch(channel: aio_pika.abc.AbstractChannel) -> None:
     """
-    Слушает сообщения в очереди RabbitMQ в бесконечном цикле
-    (пока не будет прервано приложение).
+    Раз в CONCURRENCY_ADJUST_INTERVAL секунд приводит prefetch канала
+    к текущему лимиту consumer_limiter. Prefetch общий для канала (global),
+    поэтому изменение сразу действует на уже подписанных потребителей.
+    """
+    prefetch = consumer_limiter.limit
+    await channel.set_qos(prefetch_count=prefetch, global_=True)
+    while True:
+        await asyncio.sleep(CONCURRENCY_ADJUST_INTERVAL)
+        if consumer_limiter.limit != prefetch:
+            prefetch = consumer_limiter.limit
+            await channel.set_qos(prefetch_count=prefetch, global_=True)
+            logger.info(f"⚙ Prefetch изменён: {prefetch} (в обработке {consumer_limiter.in_flight})")
+
+
+async def drain(timeout: float = DRAIN_TIMEOUT) -> None:
+    """
+    Ждёт завершения колбэков, уже взявших сообщения в обработку, но не дольше
+    timeout секунд. Неподтверждённые сообщения брокер вернёт в очередь
+    при закрытии соединения.
+    """
+    if not in_flight_callbacks:
+        return
+    logger.info(f"⏳ Дообработка {len(in_flight_callbacks)} сообщений перед остановкой")
+    _, pending = await asyncio.wait(set(in_flight_callbacks), timeout=timeout)
+    if pending:
+        logger.warning(f"⚠ Не дождались {len(pending)} сообщений за {timeout:.0f} с, они вернутся в очередь")
+
+
+async def consume(metrics_port: int = METRICS_PORT, worker: int = 0, workers: int = 1) -> None:
+    """
+    Слушает сообщения в очередях-шардах RabbitMQ, пока процесс не получит
+    SIGTERM или SIGINT. Воркер номер worker из workers читает только свои
+    шарды (index % workers == worker), иначе single-active-consumer отдал бы
+    все шарды первому подписавшемуся воркеру. Старая общая очередь QUEUE_NAME
+    читается всеми воркерами, чтобы дообработать сообщения, опубликованные до шардирования.
+    При остановке новые сообщения больше не принимаются, а уже полученные
+    дообрабатываются (не дольше DRAIN_TIMEOUT).
     """
     await create_tables()
 
     connection = await aio_pika.connect_robust(RABBITMQ_URL)
-    async with connection:
-        channel = await connection.channel()
-        await channel.set_qos(prefetch_count=5)
-        queue = await channel.declare_queue(QUEUE_NAME, durable=True)
+    callback_client.start()
+    register_gauges()
+    metrics_server = await start_metrics_server(METRICS_HOST, metrics_port)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        async with connection:
+            await delivery_publisher.setup(connection)
+            channel = await connection.channel()
+            prefetch_task = asyncio.create_task(adjust_prefetch(channel))
+            shard_queues = await declare_conversation_queues(channel, QUEUE_NAME, CONVERSATION_SHARDS)
+            queues = [shard_queues[index] for index in worker_shards(CONVERSATION_SHARDS, workers, worker)]
+            if not queues:
+                logger.warning(f"⚠ Воркеру {worker} не досталось шардов: CONVERSATION_SHARDS меньше числа воркеров")
+            queues.append(await channel.declare_queue(QUEUE_NAME, durable=True))
 
-        logger.info("🔄 Ожидание сообщений от RabbitMQ...")
-        await queue.consume(callback)
+            logger.info("🔄 Ожидание сообщений от RabbitMQ...")
+            consumer_tags = [(queue, await queue.consume(callback)) for queue in queues]
 
-        await asyncio.Future()
+            try:
+                await stop.wait()
+                logger.info("🛑 Остановка: новые сообщения не принимаются")
+                for queue, consumer_tag in consumer_tags:
+                    await queue.cancel(consumer_tag)
+                await drain()
+            finally:
+                prefetch_task.cancel()
+    finally:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signum)
+        if metrics_server is not None:
+            metrics_server.close()
+        await message_writer.close()
+        if compaction_tasks:
+            await asyncio.gather(*compaction_tasks.values(), return_exceptions=True)
+        if stream_senders:
+            await asyncio.gather(*stream_senders, return_exceptions=True)
+        if response_cache.enabled:
+            logger.info(f"📊 Кэш ответов LLM: {response_cache.stats()}")
+        await callback_client.close()
+        await close_redis()
 
 
-async def main() -> None:
+async def main(metrics_port: int = METRICS_PORT, worker: int = 0, workers: int = 1) -> None:
     """
     Точка входа в приложение: запускает прослушивание очереди,
     обрабатывает возможные исключения, связанные с RabbitMQ и БД.
     """
     try:
-        await consume()
+        await consume(metrics_port, worker, workers)
     except (aio_pika.exceptions.AMQPError, ConnectionError) as exc:
         logger.exception("❌ Ошибка соединения с RabbitMQ:", exc_info=exc)
     except Exception as exc:
         logger.exception("❌ Непредвиденная ошибка:", exc_info=exc)
 
 
+def run_worker(index: int, workers: int = CONSUMER_WORKERS) -> None:
+    """
+    Точка входа процесса-воркера под супервизором. Каждый воркер читает
+    свою долю шардов и отдаёт метрики на своём порту: METRICS_PORT + index.
+    """
+    asyncio.run(main(METRICS_PORT + index if METRICS_PORT else 0, index, workers))
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Consumer входящих сообщений onAI")
+    parser.add_argument(
+        "--workers", type=int, default=CONSUMER_WORKERS,
+        help="число процессов consumer (по умолчанию CONSUMER_WORKERS)",
+    )
+    args = parser.parse_args()
+    if args.workers > 1:
+        Supervisor(functools.partial(run_worker, workers=args.workers), args.workers, "consumer").run()
+    else:
+        asyncio.run(main())
\ No newline at end of file
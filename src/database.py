@@ -1,33 +1,134 @@
+import asyncio
+import re
+import time
+import uuid
 from contextlib import asynccontextmanager
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Enum as EnumSQL, select, delete
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import Enum as EnumSQL, Index, String, select, insert, delete, update, func, or_, text, tuple_
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from src.config import logger, DATABASE_URL
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncConnection
+from src.config import (
+    logger,
+    DATABASE_URL,
+    DATABASE_REPLICA_URL,
+    DB_REPLICA_MAX_LAG,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_PGBOUNCER,
+    DEFAULT_CONVERSATION_ID,
+    WRITE_BATCH_MAX_SIZE,
+    WRITE_BATCH_FLUSH_INTERVAL,
+    MESSAGES_PARTITIONS_AHEAD,
+    EXPORT_FETCH_SIZE,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_PAUSE,
+)
+from src.history_cache import history_cache
+from src.tokenizer import count_tokens
+
+
+def check_pool_settings(
+        pool_size: int = DB_POOL_SIZE,
+        max_overflow: int = DB_MAX_OVERFLOW,
+        pool_timeout: float = DB_POOL_TIMEOUT,
+        pool_recycle: int = DB_POOL_RECYCLE,
+) -> None:
+    """Проверяет настройки пула при старте процесса; ошибка — ValueError с описанием."""
+    errors = []
+    if pool_size < 0:
+        errors.append(f"DB_POOL_SIZE={pool_size} (должно быть >= 0)")
+    if max_overflow < 0:
+        errors.append(f"DB_MAX_OVERFLOW={max_overflow} (должно быть >= 0)")
+    if pool_timeout <= 0:
+        errors.append(f"DB_POOL_TIMEOUT={pool_timeout} (должно быть > 0)")
+    if pool_recycle == 0 or pool_recycle < -1:
+        errors.append(f"DB_POOL_RECYCLE={pool_recycle} (должно быть > 0 или -1)")
+    if errors:
+        raise ValueError(f"Некорректные настройки пула БД: {', '.join(errors)}")
 
 
-engine = create_async_engine(DATABASE_URL)
+def engine_options(url: str, pgbouncer: bool = DB_PGBOUNCER) -> dict:
+    """
+    Параметры create_async_engine для PostgreSQL из настроек DB_POOL_*
+    (у SQLite в тестах свой пул, параметры ему не передаются).
+    С pgbouncer asyncpg не кэширует подготовленные выражения и даёт им
+    уникальные имена: в режиме transaction pooling следующий запрос может
+    попасть в другое серверное соединение, где такого выражения нет.
+    """
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+    check_pool_settings()
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if DB_POOL_SIZE == 0:
+        options["poolclass"] = NullPool
+    else:
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    if pgbouncer:
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return options
+
+
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 async_session = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Движок реплики для чтения истории; без DATABASE_REPLICA_URL чтение идёт через engine
+reader_engine = (
+    create_async_engine(DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL))
+    if DATABASE_REPLICA_URL else engine
+)
+read_session = async_sessionmaker(autocommit=False, autoflush=False, bind=reader_engine)
 
 Base = declarative_base()
 
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+# Ключ advisory-блокировки: миграции применяет только один процесс за раз
+MIGRATIONS_LOCK_KEY = 7_240_001
+
 
 class Role(str, Enum):
     """Роли в базе данных"""
     user = "user"
     assistant = "assistant"
+    # Краткое содержание свёрнутой части диалога
+    system = "system"
 
 
 class DBMessage(Base):
-    """Таблица сообщений"""
+    """
+    Таблица сообщений. В PostgreSQL она партиционирована по месяцам created_at
+    (миграция 0002), и первичный ключ там — (id, created_at); id по-прежнему
+    уникален, так как берётся из одной последовательности.
+    """
     __tablename__ = "messages"
+    __table_args__ = (
+        # История читается только в рамках одного диалога и в порядке создания
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now())
+    created_at: Mapped[datetime] = mapped_column(default=datetime.now)
+    conversation_id: Mapped[str] = mapped_column(String(64), default=DEFAULT_CONVERSATION_ID)
 
     content: Mapped[str]
     role: Mapped[Role] = mapped_column(EnumSQL(Role), nullable=False)
+    # Считается один раз при вставке, используется для окна истории
+    tokens: Mapped[int] = mapped_column(default=0)
+    # Сообщение уже свёрнуто в краткое содержание и в историю не попадает
+    compacted: Mapped[bool] = mapped_column(default=False)
 
 
 @asynccontextmanager
@@ -37,41 +138,409 @@ async def get_async_session() -> AsyncSession:
         yield session
 
 
-async def insert_message(session: AsyncSession, content: str, role: Role):
-    """Вставляет новое сообщение в базу данных"""
+class ReadRouter:
+    """
+    Запоминает, когда процесс последний раз писал в каждый диалог. Пока с записи
+    не прошло max_lag секунд, реплика может её ещё не содержать, и диалог
+    читается с основной БД. Сообщения диалога обрабатывает один consumer
+    (очереди-шарды), поэтому локальной памяти процесса для этого достаточно.
+
+    Гарантия «читаю свои записи» действует только в пределах процесса:
+    о записях других процессов роутер не знает. Producer (GET /dialogs/.../messages
+    и выгрузка) и другие воркеры могут в течение max_lag видеть на реплике
+    историю без последних сообщений.
+    """
+
+    def __init__(self, max_lag: float):
+        self.max_lag = max_lag
+        self._written: dict[str, float] = {}
+
+    def mark_written(self, conversation_ids) -> None:
+        now = time.monotonic()
+        for conversation_id in conversation_ids:
+            self._written[conversation_id] = now
+        if len(self._written) > 10000:
+            self._written = {key: at for key, at in self._written.items() if now - at < self.max_lag}
+
+    def recently_written(self, conversation_id: str | None) -> bool:
+        written_at = self._written.get(conversation_id)
+        return written_at is not None and time.monotonic() - written_at < self.max_lag
+
+
+read_router = ReadRouter(DB_REPLICA_MAX_LAG)
+
+
+@asynccontextmanager
+async def get_read_session(conversation_id: str | None = None, primary: AsyncSession | None = None) -> AsyncSession:
+    """
+    Сессия для чтения истории: с реплики, если она настроена и в диалог
+    недавно не писали; иначе — переданная сессия основной БД primary
+    или новая сессия основной БД.
+    """
+    if reader_engine is not engine and not read_router.recently_written(conversation_id):
+        async with read_session() as session:
+            yield session
+    elif primary is not None:
+        yield primary
+    else:
+        async with async_session() as session:
+            yield session
+
+
+def build_message_row(conversation_id: str, role: Role, content: str) -> dict:
+    """Готовит строку для вставки в messages; токены считаются здесь один раз."""
+    return {
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "tokens": count_tokens(content),
+        "created_at": datetime.now(),
+        "compacted": False,
+    }
+
+
+async def insert_rows(session: AsyncSession, rows: list[dict]) -> list[DBMessage]:
+    """
+    Вставляет строки одним INSERT ... RETURNING (без commit и refresh)
+    и возвращает их как DBMessage с id и created_at из БД, в порядке rows.
+    Возвращённые объекты не привязаны к сессии и не истекают после commit.
+    """
+    query = insert(DBMessage).returning(DBMessage.id, DBMessage.created_at, sort_by_parameter_order=True)
+    result = await session.execute(query, rows)
+    read_router.mark_written({row["conversation_id"] for row in rows})
+    return [
+        DBMessage(**{**row, "id": returned.id, "created_at": returned.created_at})
+        for row, returned in zip(rows, result.all())
+    ]
+
+
+async def cache_inserted(messages: list[DBMessage]) -> None:
+    """Дописывает вставленные сообщения в кэш истории их диалогов."""
+    by_conversation: dict[str, list[DBMessage]] = {}
+    for message in messages:
+        by_conversation.setdefault(message.conversation_id, []).append(message)
+    for conversation_id, conversation_messages in by_conversation.items():
+        await history_cache.append(conversation_id, conversation_messages)
+
+
+async def insert_messages(
+        session: AsyncSession,
+        conversation_id: str,
+        messages: list[tuple[Role, str]],
+) -> list[DBMessage]:
+    """
+    Вставляет несколько сообщений диалога одним запросом в одной транзакции:
+    один INSERT ... RETURNING и один commit.
+    """
     try:
-        new_message = DBMessage(content=content, role=role)
-        session.add(new_message)
+        rows = [build_message_row(conversation_id, role, content) for role, content in messages]
+        inserted = await insert_rows(session, rows)
         await session.commit()
-        await session.refresh(new_message)
-        logger.info(f"✅ Добавлено сообщение ID={new_message.id} ({role})")
-        return new_message
+        logger.info(
+            f"✅ Добавлены сообщения ID={[message.id for message in inserted]} в диалог {conversation_id}"
+        )
+        await cache_inserted(inserted)
+        return inserted
     except Exception as e:
-        logger.exception("❌ Ошибка при вставке сообщения:", exc_info=e)
+        logger.exception("❌ Ошибка при вставке сообщений:", exc_info=e)
         await session.rollback()
-        return None
+        return []
+
+
+async def insert_message(
+        session: AsyncSession,
+        content: str,
+        role: Role,
+        conversation_id: str = DEFAULT_CONVERSATION_ID,
+):
+    """Вставляет новое сообщение в диалог conversation_id"""
+    inserted = await insert_messages(session, conversation_id, [(role, content)])
+    return inserted[0] if inserted else None
+
+
+class MessageWriter:
+    """
+    Пакетная запись сообщений: вставки из параллельных задач consumer
+    копятся и записываются одним многострочным INSERT ... RETURNING
+    в одной транзакции — как только набралось max_batch строк
+    или прошло flush_interval секунд с первой ожидающей вставки.
+    """
+
+    def __init__(self, max_batch: int, flush_interval: float):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending: list[tuple[list[dict], asyncio.Future]] = []
+        self._pending_rows = 0
+        self._timer: asyncio.Task | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def write(self, conversation_id: str, messages: list[tuple[Role, str]]) -> list[DBMessage]:
+        """Ставит сообщения в очередь на запись и ждёт, пока пакет будет записан."""
+        rows = [build_message_row(conversation_id, role, content) for role, content in messages]
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((rows, future))
+        self._pending_rows += len(rows)
+
+        if self._pending_rows >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_rows = self._pending, [], 0
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[list[dict], asyncio.Future]]) -> None:
+        rows = [row for pending_rows, _ in batch for row in pending_rows]
+        try:
+            async with get_async_session() as session:
+                inserted = await insert_rows(session, rows)
+                await session.commit()
+            logger.info(f"✅ Пакетно добавлено {len(inserted)} сообщений")
+            await cache_inserted(inserted)
+        except Exception as e:
+            logger.exception("❌ Ошибка при пакетной вставке сообщений:", exc_info=e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_result([])
+            return
 
+        offset = 0
+        for pending_rows, future in batch:
+            if not future.done():
+                future.set_result(inserted[offset:offset + len(pending_rows)])
+            offset += len(pending_rows)
 
-async def get_all_messages(session: AsyncSession):
-    """Извлекает все сообщения из базы"""
+    async def close(self) -> None:
+        """Записывает всё, что ещё ожидает записи."""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+message_writer = MessageWriter(WRITE_BATCH_MAX_SIZE, WRITE_BATCH_FLUSH_INTERVAL)
+
+
+async def get_all_messages(session: AsyncSession | None = None, conversation_id: str | None = None):
+    """
+    Извлекает сообщения из базы в порядке создания.
+    Если передан conversation_id — только сообщения этого диалога
+    (запрос идёт по индексу (conversation_id, created_at)).
+    Без session чтение идёт с реплики (см. get_read_session).
+    """
     try:
-        query = select(DBMessage).order_by(DBMessage.created_at.asc())
+        query = select(DBMessage)
+        if conversation_id is not None:
+            query = query.where(DBMessage.conversation_id == conversation_id)
+        query = query.order_by(DBMessage.created_at.asc(), DBMessage.id.asc())
+        if session is None:
+            async with get_read_session(conversation_id) as read:
+                result = await read.execute(query)
+                messages = result.scalars().all()
+        else:
+            result = await session.execute(query)
+            messages = result.scalars().all()
+        logger.debug("🔹 Загружено %d сообщений из БД", len(messages))
+        return messages
+    except Exception as e:
+        logger.exception("❌ Ошибка при получении всех сообщений:", exc_info=e)
+        return []
+
+
+def dialog_messages_query(conversation_id: str):
+    """Реплики диалога (без кратких содержаний) в порядке (created_at, id)."""
+    return (
+        select(DBMessage)
+        .where(DBMessage.conversation_id == conversation_id, DBMessage.role != Role.system)
+        .order_by(DBMessage.created_at.asc(), DBMessage.id.asc())
+    )
+
+
+async def get_messages_page(
+        session: AsyncSession,
+        conversation_id: str,
+        limit: int,
+        after: tuple[datetime, int] | None = None,
+) -> list[DBMessage]:
+    """
+    Страница реплик диалога: не больше limit строк, идущих строго после
+    ключа after = (created_at, id) последней строки предыдущей страницы.
+    Keyset-пагинация читает по индексу ровно limit строк,
+    как бы далеко от начала диалога ни была страница.
+    """
+    query = dialog_messages_query(conversation_id).limit(limit)
+    if after is not None:
+        query = query.where(tuple_(DBMessage.created_at, DBMessage.id) > tuple_(*after))
+    result = await session.execute(query)
+    return list(result.scalars().all())
+
+
+async def stream_dialog_messages(
+        conversation_id: str,
+        fetch_size: int = EXPORT_FETCH_SIZE,
+) -> AsyncIterator[DBMessage]:
+    """
+    Отдаёт все реплики диалога по одной через серверный курсор
+    (stream_scalars): в памяти процесса и БД одновременно не больше
+    fetch_size строк, сколько бы их ни было в диалоге.
+    """
+    async with get_read_session(conversation_id) as session:
+        query = dialog_messages_query(conversation_id).execution_options(yield_per=fetch_size)
+        result = await session.stream_scalars(query)
+        async for message in result:
+            yield message
+
+
+async def get_history_window(session: AsyncSession, conversation_id: str, token_budget: int):
+    """
+    Извлекает самые свежие сообщения диалога, суммарно укладывающиеся в token_budget,
+    и возвращает их в хронологическом порядке. Свёрнутые сообщения
+    и краткое содержание диалога в окно не входят.
+    Накопленная сумма токенов считается в БД (от новых к старым), поэтому
+    из базы поднимаются только строки, попадающие в окно. Последнее сообщение
+    возвращается всегда, даже если оно одно превышает бюджет.
+    """
+    try:
+        newest_first = (DBMessage.created_at.desc(), DBMessage.id.desc())
+        window = (
+            select(
+                DBMessage.id,
+                func.sum(DBMessage.tokens).over(order_by=newest_first).label("running_tokens"),
+                func.row_number().over(order_by=newest_first).label("position"),
+            )
+            .where(
+                DBMessage.conversation_id == conversation_id,
+                DBMessage.compacted.is_(False),
+                DBMessage.role != Role.system,
+            )
+            .subquery()
+        )
+        query = (
+            select(DBMessage)
+            .join(window, DBMessage.id == window.c.id)
+            .where(or_(window.c.running_tokens <= token_budget, window.c.position == 1))
+            .order_by(DBMessage.created_at.asc(), DBMessage.id.asc())
+        )
         result = await session.execute(query)
         messages = result.scalars().all()
-        logger.debug(f"🔹 Загружено {len(messages)} сообщений из БД")
+        logger.debug("🔹 Загружено %d сообщений окна истории диалога %s", len(messages), conversation_id)
         return messages
     except Exception as e:
-        logger.exception("❌ Ошибка при получении всех сообщений:", exc_info=e)
+        logger.exception("❌ Ошибка при получении окна истории:", exc_info=e)
         return []
 
 
+async def get_dialog_summary(session: AsyncSession, conversation_id: str) -> DBMessage | None:
+    """Возвращает актуальное краткое содержание диалога, если оно есть."""
+    try:
+        query = (
+            select(DBMessage)
+            .where(
+                DBMessage.conversation_id == conversation_id,
+                DBMessage.role == Role.system,
+                DBMessage.compacted.is_(False),
+            )
+            .order_by(DBMessage.created_at.desc(), DBMessage.id.desc())
+            .limit(1)
+        )
+        result = await session.execute(query)
+        return result.scalar_one_or_none()
+    except Exception as e:
+        logger.exception("❌ Ошибка при получении краткого содержания диалога:", exc_info=e)
+        return None
+
+
+async def count_uncompacted_messages(session: AsyncSession, conversation_id: str) -> int:
+    """Считает реплики диалога, ещё не свёрнутые в краткое содержание."""
+    query = select(func.count()).select_from(DBMessage).where(
+        DBMessage.conversation_id == conversation_id,
+        DBMessage.compacted.is_(False),
+        DBMessage.role != Role.system,
+    )
+    result = await session.execute(query)
+    return result.scalar_one()
+
+
+async def get_compaction_candidates(session: AsyncSession, conversation_id: str, keep_recent: int):
+    """
+    Возвращает несвёрнутые реплики диалога, кроме keep_recent самых свежих,
+    в хронологическом порядке — то, что нужно добавить в краткое содержание.
+    """
+    recent = (
+        select(DBMessage.id)
+        .where(
+            DBMessage.conversation_id == conversation_id,
+            DBMessage.compacted.is_(False),
+            DBMessage.role != Role.system,
+        )
+        .order_by(DBMessage.created_at.desc(), DBMessage.id.desc())
+        .limit(keep_recent)
+    )
+    query = (
+        select(DBMessage)
+        .where(
+            DBMessage.conversation_id == conversation_id,
+            DBMessage.compacted.is_(False),
+            DBMessage.role != Role.system,
+            DBMessage.id.not_in(recent.scalar_subquery()),
+        )
+        .order_by(DBMessage.created_at.asc(), DBMessage.id.asc())
+    )
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def save_dialog_summary(
+        session: AsyncSession,
+        conversation_id: str,
+        content: str,
+        compacted_ids: list[int],
+):
+    """
+    В одной транзакции сохраняет новое краткое содержание диалога
+    и помечает свёрнутыми вошедшие в него реплики и предыдущее краткое содержание.
+    """
+    try:
+        await session.execute(
+            update(DBMessage)
+            .where(
+                DBMessage.conversation_id == conversation_id,
+                or_(DBMessage.id.in_(compacted_ids), DBMessage.role == Role.system),
+            )
+            .values(compacted=True)
+        )
+        [summary] = await insert_rows(session, [build_message_row(conversation_id, Role.system, content)])
+        await session.commit()
+        await history_cache.invalidate(conversation_id)
+        logger.info(f"🗜 Диалог {conversation_id}: свёрнуто {len(compacted_ids)} сообщений")
+        return summary
+    except Exception as e:
+        logger.exception("❌ Ошибка при сохранении краткого содержания диалога:", exc_info=e)
+        await session.rollback()
+        return None
+
+
 async def delete_message_by_id(session: AsyncSession, message_id: int):
     """Удаляет сообщение из базы по его ID, в текущей версии не используется"""
     try:
-        query = delete(DBMessage).where(DBMessage.id == message_id)
+        query = delete(DBMessage).where(DBMessage.id == message_id).returning(DBMessage.conversation_id)
         result = await session.execute(query)
+        conversation_id = result.scalar_one_or_none()
         await session.commit()
-        if result.rowcount:
+        if conversation_id is not None:
+            await history_cache.invalidate(conversation_id)
             logger.info(f"🗑 Удалено сообщение ID={message_id}")
         else:
             logger.warning(f"⚠ Сообщение ID={message_id} не найдено")
@@ -80,20 +549,139 @@ async def delete_message_by_id(session: AsyncSession, message_id: int):
         await session.rollback()
 
 
+async def delete_messages_batch(session: AsyncSession, *criteria, limit: int) -> int:
+    """
+    Удаляет не больше limit сообщений, подходящих под criteria, в отдельной
+    короткой транзакции и возвращает число удалённых строк. Условия повторяются
+    во внешнем DELETE, чтобы PostgreSQL отсёк лишние партиции.
+    """
+    batch = select(DBMessage.id).where(*criteria).limit(limit).scalar_subquery()
+    result = await session.execute(delete(DBMessage).where(DBMessage.id.in_(batch), *criteria))
+    await session.commit()
+    return result.rowcount
+
+
+async def delete_in_batches(
+        *criteria,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        pause: float = RETENTION_BATCH_PAUSE,
+        on_batch: Callable[[int], Awaitable[None]] | None = None,
+) -> int:
+    """
+    Удаляет сообщения, подходящие под criteria, пачками по batch_size строк,
+    каждая в своей транзакции, с паузой pause между пачками, чтобы не держать
+    долгих блокировок и не мешать записи. После каждой пачки вызывает
+    on_batch с числом удалённых к этому моменту строк. Возвращает это число.
+    """
+    total = 0
+    while True:
+        async with get_async_session() as session:
+            deleted = await delete_messages_batch(session, *criteria, limit=batch_size)
+        total += deleted
+        if on_batch is not None:
+            await on_batch(total)
+        if deleted < batch_size:
+            return total
+        await asyncio.sleep(pause)
+
+
 async def delete_all_messages(session: AsyncSession):
-    """Полностью очищает таблицу"""
+    """
+    Полностью очищает таблицу. В PostgreSQL — через TRUNCATE (вместе со всеми
+    партициями): мгновенно и без построчного удаления и раздувания таблицы.
+    """
     try:
-        query = delete(DBMessage)
-        await session.execute(query)
+        if session.bind.dialect.name == "postgresql":
+            await session.execute(text("TRUNCATE messages"))
+        else:
+            await session.execute(delete(DBMessage))
         await session.commit()
+        await history_cache.invalidate()
         logger.info("🗑 Все сообщения удалены из БД")
     except Exception as e:
         logger.exception("❌ Ошибка при очистке всех сообщений из БД:", exc_info=e)
+        await session.rollback()
+        raise
+
+
+def month_start(moment: datetime, offset: int = 0) -> datetime:
+    """Начало месяца moment, сдвинутого на offset месяцев."""
+    index = moment.year * 12 + moment.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    """Имя помесячной партиции messages, начинающейся в start."""
+    return f"messages_p{start:%Y%m}"
+
+
+def partition_upper_bound(bound: str) -> datetime | None:
+    """Верхняя граница партиции из pg_get_expr(relpartbound) или None (DEFAULT, MAXVALUE)."""
+    match = re.search(r"TO \('([^']+)'\)", bound)
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+async def list_partitions(conn: AsyncConnection) -> list[tuple[str, datetime | None]]:
+    """
+    Партиции messages с верхними границами диапазонов. Пустой список,
+    если таблица не партиционирована или БД не PostgreSQL.
+    """
+    if conn.dialect.name != "postgresql":
+        return []
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass('messages')"
+    ))
+    return [(name, partition_upper_bound(bound)) for name, bound in result.all()]
+
+
+async def ensure_partitions(
+        conn: AsyncConnection,
+        months_ahead: int = MESSAGES_PARTITIONS_AHEAD,
+        now: datetime | None = None,
+) -> list[str]:
+    """
+    Создаёт помесячные партиции messages от конца последней существующей
+    до months_ahead месяцев вперёд и возвращает имена созданных.
+    Для непартиционированной таблицы ничего не делает.
+    """
+    partitions = await list_partitions(conn)
+    if not partitions:
+        return []
+    now = now or datetime.now()
+    start = max([upper for _, upper in partitions if upper is not None], default=month_start(now))
+    created = []
+    while start < month_start(now, months_ahead + 1):
+        end = month_start(start, 1)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF messages "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+        created.append(partition_name(start))
+        start = end
+    if created:
+        logger.info(f"🛠 Созданы партиции messages: {', '.join(created)}")
+    return created
+
+
+def run_migrations(connection) -> None:
+    """Применяет миграции Alembic на переданном синхронном соединении."""
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    config.attributes["connection"] = connection
+    command.upgrade(config, "head")
 
 
 async def create_tables():
-    """Создание таблиц в БД, если их нет"""
+    """
+    Приводит схему БД к последней миграции Alembic (для баз, созданных
+    раньше через create_all, первая миграция пропускается) и создаёт
+    партиции messages наперёд.
+    """
     async with engine.begin() as conn:
-        logger.info("🛠 Создание таблиц в БД...")
-        await conn.run_sync(Base.metadata.create_all)
-        logger.info("✅ Таблицы успешно созданы.")
+        logger.info("🛠 Применение миграций БД...")
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        await conn.run_sync(run_migrations)
+        await ensure_partitions(conn)
+        logger.info("✅ Схема БД актуальна.")
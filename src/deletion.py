@@ -0,0 +1,153 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+import redis.asyncio as redis
+
+from src.config import (
+    logger,
+    DELETION_BATCH_SIZE,
+    DELETION_BATCH_PAUSE,
+    DELETION_JOB_TTL,
+)
+from src.database import DBMessage, delete_all_messages, delete_in_batches, get_async_session
+from src.history_cache import history_cache
+from src.redis_client import RedisStore
+
+
+class DeletionJobs(RedisStore):
+    """
+    Фоновые задачи удаления данных диалогов. Задача по диалогу удаляет его
+    сообщения пачками по batch_size строк с паузой pause между ними,
+    задача без диалога очищает таблицу целиком (TRUNCATE).
+
+    Producer только регистрирует задачу: статус (хранится в Redis ttl секунд)
+    и идентификатор в очереди queue_key. Выполняет задачи serve() в фоновом
+    процессе очистки (python -m src.retention), поэтому они переживают
+    перезапуск producer. Взятая задача лежит в processing_key, пока не
+    завершится; прерванные задачи при следующем запуске serve() возвращаются
+    в очередь и выполняются заново — удаление по условию можно повторять.
+    Рассчитано на один процесс очистки.
+    """
+
+    key_prefix = "deletion:job:"
+    queue_key = "deletion:queue"
+    processing_key = "deletion:processing"
+    # Сколько секунд ждать новую задачу за одно обращение к Redis
+    poll_timeout = 5
+
+    def __init__(
+            self,
+            batch_size: int = DELETION_BATCH_SIZE,
+            pause: float = DELETION_BATCH_PAUSE,
+            ttl: int = DELETION_JOB_TTL,
+            client: redis.Redis | None = None,
+    ):
+        super().__init__(client)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.ttl = ttl
+
+    def key(self, job_id: str) -> str:
+        return f"{self.key_prefix}{job_id}"
+
+    async def _update(self, job_id: str, **fields) -> None:
+        client = self.connect()
+        await client.hset(self.key(job_id), mapping={name: str(value) for name, value in fields.items()})
+        await client.expire(self.key(job_id), self.ttl)
+
+    async def start(self, conversation_id: str | None) -> str:
+        """
+        Регистрирует задачу удаления диалога conversation_id (None — всех
+        сообщений), ставит её в очередь и возвращает её идентификатор.
+        """
+        job_id = uuid.uuid4().hex
+        await self._update(
+            job_id,
+            conversation_id=conversation_id or "",
+            status="pending",
+            # Для очистки всей таблицы число строк не считается
+            deleted=0 if conversation_id is not None else "",
+            created_at=datetime.now(timezone.utc).isoformat(),
+        )
+        await self.connect().rpush(self.queue_key, job_id)
+        return job_id
+
+    async def run(self, job_id: str, conversation_id: str | None) -> None:
+        """Выполняет задачу, отмечая прогресс после каждой пачки."""
+        try:
+            await self._update(job_id, status="running")
+            if conversation_id is None:
+                async with get_async_session() as session:
+                    await delete_all_messages(session)
+                deleted = "все сообщения"
+            else:
+                deleted = await delete_in_batches(
+                    DBMessage.conversation_id == conversation_id,
+                    batch_size=self.batch_size,
+                    pause=self.pause,
+                    on_batch=lambda total: self._update(job_id, deleted=total),
+                )
+                await history_cache.invalidate(conversation_id)
+        except asyncio.CancelledError:
+            await self._update(job_id, status="interrupted")
+            raise
+        except Exception as exc:
+            logger.exception(f"❌ Ошибка задачи удаления {job_id}:", exc_info=exc)
+            await self._update(job_id, status="failed", error=str(exc))
+            return
+        await self._update(job_id, status="done", finished_at=datetime.now(timezone.utc).isoformat())
+        logger.info(f"🗑 Задача удаления {job_id} завершена, удалено: {deleted}")
+
+    async def recover(self) -> int:
+        """Возвращает в очередь задачи, прерванные остановкой процесса. Возвращает их число."""
+        client = self.connect()
+        recovered = 0
+        while await client.lmove(self.processing_key, self.queue_key, "RIGHT", "LEFT"):
+            recovered += 1
+        if recovered:
+            logger.info(f"🔁 Возвращено в очередь прерванных задач удаления: {recovered}")
+        return recovered
+
+    async def run_next(self) -> bool:
+        """
+        Берёт из очереди и выполняет одну задачу. False — если за poll_timeout
+        задач не появилось.
+        """
+        client = self.connect()
+        job_id = await client.blmove(self.queue_key, self.processing_key, self.poll_timeout, "LEFT", "RIGHT")
+        if job_id is None:
+            return False
+        job = await client.hgetall(self.key(job_id))
+        if job:
+            await self.run(job_id, job.get("conversation_id") or None)
+        else:
+            logger.warning(f"⚠ Задача удаления {job_id} не найдена (истёк срок хранения), пропускаем")
+        await client.lrem(self.processing_key, 1, job_id)
+        return True
+
+    async def serve(self) -> None:
+        """Выполняет задачи из очереди по одной, пока процесс не остановят."""
+        logger.info("🔄 Ожидание задач удаления...")
+        recovered = False
+        while True:
+            try:
+                if not recovered:
+                    await self.recover()
+                    recovered = True
+                await self.run_next()
+            except Exception as exc:
+                logger.exception("❌ Ошибка очереди задач удаления:", exc_info=exc)
+                await asyncio.sleep(self.poll_timeout)
+
+    async def get(self, job_id: str) -> dict | None:
+        """Статус задачи или None, если она не найдена (или истёк срок хранения статуса)."""
+        job = await self.connect().hgetall(self.key(job_id))
+        if not job:
+            return None
+        job["deleted"] = int(job["deleted"]) if job.get("deleted", "").isdigit() else None
+        job["conversation_id"] = job.get("conversation_id") or None
+        return {"job_id": job_id, **job}
+
+
+deletion_jobs = DeletionJobs()
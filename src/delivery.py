@@ -0,0 +1,178 @@
+import asyncio
+import time
+
+import aio_pika
+import httpx
+from pydantic import HttpUrl, ValidationError
+
+from src.callback_client import callback_client
+from src.config import (
+    logger,
+    RABBITMQ_URL,
+    DELIVERY_QUEUE_NAME,
+    DELIVERY_RETRY_DELAYS,
+    DELIVERY_PREFETCH,
+    METRICS_HOST,
+    METRICS_PORT,
+)
+from src.metrics import CALLBACK_LATENCY, start_metrics_server
+from src.models import AnswerMessage
+
+ATTEMPT_HEADER = "x-delivery-attempt"
+DEAD_QUEUE_NAME = f"{DELIVERY_QUEUE_NAME}.dead"
+
+
+def retry_queue_name(attempt: int) -> str:
+    """Имя очереди задержки перед попыткой attempt (начиная с 1)."""
+    return f"{DELIVERY_QUEUE_NAME}.retry.{attempt}"
+
+
+async def declare_delivery_queues(channel: aio_pika.abc.AbstractChannel) -> aio_pika.abc.AbstractQueue:
+    """
+    Объявляет очередь доставки, очереди задержки и очередь недоставленных ответов.
+    Очереди задержки не читаются: по истечении TTL сообщение через
+    dead-letter exchange возвращается в очередь доставки.
+    """
+    queue = await channel.declare_queue(DELIVERY_QUEUE_NAME, durable=True)
+    for attempt, delay in enumerate(DELIVERY_RETRY_DELAYS, start=1):
+        await channel.declare_queue(
+            retry_queue_name(attempt),
+            durable=True,
+            arguments={
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": DELIVERY_QUEUE_NAME,
+            },
+        )
+    await channel.declare_queue(DEAD_QUEUE_NAME, durable=True)
+    return queue
+
+
+class DeliveryPublisher:
+    """
+    Публикует ответы в очередь доставки (и её очереди задержки)
+    по отдельному каналу с подтверждениями публикации.
+    """
+
+    def __init__(self):
+        self._channel: aio_pika.abc.AbstractChannel | None = None
+
+    async def setup(self, connection: aio_pika.abc.AbstractConnection) -> None:
+        """Открывает канал публикации и объявляет очереди доставки."""
+        self._channel = await connection.channel(publisher_confirms=True)
+        await declare_delivery_queues(self._channel)
+
+    async def publish(self, answer: AnswerMessage, attempt: int = 0, queue_name: str = DELIVERY_QUEUE_NAME) -> None:
+        """Публикует ответ и дожидается подтверждения от брокера."""
+        await self.publish_body(answer.model_dump_json().encode(), attempt, queue_name)
+
+    async def publish_body(self, body: bytes, attempt: int, queue_name: str) -> None:
+        """Публикует тело сообщения как есть (в том числе некорректное — в очередь недоставленных)."""
+        if self._channel is None:
+            raise RuntimeError("DeliveryPublisher не инициализирован")
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                body=body,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                headers={ATTEMPT_HEADER: attempt},
+            ),
+            routing_key=queue_name,
+        )
+
+
+delivery_publisher = DeliveryPublisher()
+
+
+async def send_answer(callback_url: HttpUrl, answer: str, seq: int | None = None) -> bool:
+    """
+    Отправляет ответ (answer) по указанному callback_url через общий пул
+    соединений. Для потоковых ответов seq — номер финального кадра,
+    кадр помечается done. Возвращает True, если получатель принял ответ.
+    """
+    payload = {"message": answer}
+    if seq is not None:
+        payload.update(seq=seq, done=True)
+    started = time.perf_counter()
+    try:
+        response = await callback_client.post(str(callback_url), json=payload)
+        CALLBACK_LATENCY.observe(time.perf_counter() - started, status=response.status_code)
+        logger.info(f"📨 Ответ отправлен, статус-код: {response.status_code}")
+        return response.is_success
+    except httpx.HTTPError as exc:
+        CALLBACK_LATENCY.observe(time.perf_counter() - started, status="error")
+        logger.error(f"❌ Ошибка при отправке ответа: {exc}")
+        return False
+
+
+async def deliver(message: aio_pika.IncomingMessage) -> None:
+    """
+    Колбэк очереди доставки: отправляет ответ на callback_url.
+    При неудаче переносит ответ в очередь задержки следующей попытки,
+    а после последней попытки — в очередь недоставленных ответов.
+    Если переложить ответ не удалось, сообщение возвращается в очередь.
+    Некорректное сообщение сразу переносится в очередь недоставленных,
+    а не возвращается в очередь доставки раз за разом.
+    """
+    attempt = int((message.headers or {}).get(ATTEMPT_HEADER, 0))
+    try:
+        answer = AnswerMessage.model_validate_json(message.body)
+    except ValidationError as exc:
+        logger.error(f"☠ Некорректный ответ в очереди доставки, переносим в {DEAD_QUEUE_NAME}: {exc}")
+        async with message.process(requeue=True):
+            await delivery_publisher.publish_body(message.body, attempt, DEAD_QUEUE_NAME)
+        return
+
+    async with message.process(requeue=True):
+
+        if await send_answer(answer.callback_url, answer.message, answer.seq):
+            return
+
+        if attempt < len(DELIVERY_RETRY_DELAYS):
+            next_attempt = attempt + 1
+            logger.warning(
+                f"🔁 Повторная доставка через {DELIVERY_RETRY_DELAYS[attempt]} с "
+                f"(попытка {next_attempt}), диалог {answer.conversation_id}"
+            )
+            await delivery_publisher.publish(answer, next_attempt, retry_queue_name(next_attempt))
+        else:
+            logger.error(f"☠ Ответ не доставлен после {attempt + 1} попыток, диалог {answer.conversation_id}")
+            await delivery_publisher.publish(answer, attempt, DEAD_QUEUE_NAME)
+
+
+async def consume_deliveries() -> None:
+    """
+    Читает очередь доставки в бесконечном цикле, одновременно обрабатывая
+    до DELIVERY_PREFETCH ответов.
+    """
+    connection = await aio_pika.connect_robust(RABBITMQ_URL)
+    callback_client.start()
+    metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    try:
+        async with connection:
+            await delivery_publisher.setup(connection)
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=DELIVERY_PREFETCH)
+            queue = await declare_delivery_queues(channel)
+
+            logger.info("🔄 Ожидание ответов для доставки...")
+            await queue.consume(deliver)
+
+            await asyncio.Future()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        await callback_client.close()
+
+
+async def main() -> None:
+    """Точка входа воркера доставки."""
+    try:
+        await consume_deliveries()
+    except (aio_pika.exceptions.AMQPError, ConnectionError) as exc:
+        logger.exception("❌ Ошибка соединения с RabbitMQ:", exc_info=exc)
+    except Exception as exc:
+        logger.exception("❌ Непредвиденная ошибка:", exc_info=exc)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+import json
+
+import redis.asyncio as redis
+
+from src.config import HISTORY_CACHE_SIZE, HISTORY_CACHE_TTL, logger
+from src.redis_client import RedisStore
+
+
+class HistoryCache(RedisStore):
+    """
+    Write-through кэш истории диалогов в Redis.
+    Для каждого диалога хранится ограниченный список последних сообщений
+    (не более size) и отдельным ключом — краткое содержание свёрнутой части.
+    Ключи живут ttl секунд с момента последнего обращения.
+    Каждое изменение диалога увеличивает его поколение (отдельный счётчик):
+    пересборка из снимка БД записывается, только если поколение не изменилось
+    с момента снимка, и не затирает более свежую запись.
+    """
+
+    key_prefix = "history:"
+
+    def __init__(self, size: int, ttl: int, client: redis.Redis | None = None):
+        super().__init__(client)
+        self.size = size
+        self.ttl = ttl
+
+    def key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}"
+
+    def summary_key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}:summary"
+
+    def generation_key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}:generation"
+
+    @staticmethod
+    def _dump(role: str, content: str, tokens: int) -> str:
+        return json.dumps({"role": role, "content": content, "tokens": tokens}, ensure_ascii=False)
+
+    async def append(self, conversation_id: str, messages: list) -> None:
+        """
+        Дописывает сообщения (DBMessage) в кэш диалога, если он уже закэширован.
+        Холодный диалог не создаётся частично — он будет собран из БД при чтении.
+        """
+        try:
+            key = self.key(conversation_id)
+            async with self.connect().pipeline(transaction=True) as pipe:
+                pipe.rpushx(key, *(
+                    self._dump(message.role, message.content, message.tokens) for message in messages
+                ))
+                pipe.ltrim(key, -self.size, -1)
+                pipe.expire(key, self.ttl)
+                pipe.incr(self.generation_key(conversation_id))
+                pipe.expire(self.generation_key(conversation_id), self.ttl)
+                await pipe.execute()
+        except Exception as exc:
+            logger.warning(f"⚠ Не удалось обновить кэш истории диалога {conversation_id}: {exc}")
+
+    async def get_window(self, conversation_id: str, token_budget: int) -> list[dict] | None:
+        """
+        Возвращает краткое содержание диалога (если есть) и самые свежие сообщения,
+        вместе укладывающиеся в token_budget, в формате OpenAI API.
+        None — если диалога нет в кэше (или Redis недоступен).
+        """
+        try:
+            key, summary_key = self.key(conversation_id), self.summary_key(conversation_id)
+            async with self.connect().pipeline(transaction=True) as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.get(summary_key)
+                pipe.expire(key, self.ttl)
+                pipe.expire(summary_key, self.ttl)
+                entries, summary_entry, _, _ = await pipe.execute()
+        except Exception as exc:
+            logger.warning(f"⚠ Кэш истории недоступен, чтение из БД: {exc}")
+            return None
+
+        if not entries:
+            return None
+
+        summary = json.loads(summary_entry) if summary_entry else None
+        window = []
+        used_tokens = summary["tokens"] if summary else 0
+        for entry in reversed(entries):
+            message = json.loads(entry)
+            used_tokens += message["tokens"]
+            if window and used_tokens > token_budget:
+                break
+            window.append({"role": message["role"], "content": message["content"]})
+        if summary:
+            window.append({"role": summary["role"], "content": summary["content"]})
+        window.reverse()
+        logger.debug("🔹 Окно истории диалога %s получено из кэша (%d сообщений)", conversation_id, len(window))
+        return window
+
+    async def generation(self, conversation_id: str) -> str | None:
+        """
+        Текущее поколение диалога. Его нужно прочитать до снимка БД
+        и передать в rebuild.
+        """
+        try:
+            return await self.connect().get(self.generation_key(conversation_id))
+        except Exception as exc:
+            logger.warning(f"⚠ Кэш истории недоступен: {exc}")
+            return None
+
+    async def rebuild(self, conversation_id: str, messages: list, summary=None, generation: str | None = None) -> None:
+        """
+        Заново заполняет кэш диалога сообщениями и кратким содержанием из БД (DBMessage).
+        Если с момента снимка (поколение generation) диалог изменился, кэш
+        не трогается — его соберёт следующее чтение.
+        """
+        if not messages:
+            return
+        try:
+            key, summary_key = self.key(conversation_id), self.summary_key(conversation_id)
+            generation_key = self.generation_key(conversation_id)
+            async with self.connect().pipeline(transaction=True) as pipe:
+                await pipe.watch(generation_key)
+                if await pipe.get(generation_key) != generation:
+                    logger.debug("🔹 Диалог %s изменился во время чтения из БД, кэш не пересобирается", conversation_id)
+                    return
+                pipe.multi()
+                pipe.delete(key, summary_key)
+                pipe.rpush(key, *(
+                    self._dump(message.role, message.content, message.tokens)
+                    for message in messages[-self.size:]
+                ))
+                pipe.expire(key, self.ttl)
+                if summary is not None:
+                    pipe.set(summary_key, self._dump(summary.role, summary.content, summary.tokens), ex=self.ttl)
+                await pipe.execute()
+        except redis.WatchError:
+            logger.debug("🔹 Диалог %s изменился во время пересборки кэша", conversation_id)
+        except Exception as exc:
+            logger.warning(f"⚠ Не удалось пересобрать кэш истории диалога {conversation_id}: {exc}")
+
+    async def invalidate(self, conversation_id: str | None = None) -> None:
+        """Сбрасывает кэш одного диалога или, без conversation_id, всех диалогов."""
+        try:
+            client = self.connect()
+            if conversation_id is not None:
+                async with client.pipeline(transaction=True) as pipe:
+                    pipe.delete(self.key(conversation_id), self.summary_key(conversation_id))
+                    pipe.incr(self.generation_key(conversation_id))
+                    pipe.expire(self.generation_key(conversation_id), self.ttl)
+                    await pipe.execute()
+                return
+            async for key in client.scan_iter(match=f"{self.key_prefix}*", count=500):
+                await client.delete(key)
+        except Exception as exc:
+            logger.warning(f"⚠ Не удалось сбросить кэш истории: {exc}")
+
+
+history_cache = HistoryCache(HISTORY_CACHE_SIZE, HISTORY_CACHE_TTL)
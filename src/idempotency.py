@@ -0,0 +1,91 @@
+import redis.asyncio as redis
+
+from src.config import IDEMPOTENCY_TTL, logger
+from src.models import InputMessage, AnswerMessage
+from src.redis_client import RedisStore
+
+
+class IdempotencyStore(RedisStore):
+    """
+    Защита от повторной обработки сообщений с клиентским идентификатором
+    (InputMessage.message_id или заголовок Idempotency-Key).
+    Producer занимает идентификатор через SET NX: повтор запроса клиента
+    в течение ttl секунд не публикуется в очередь второй раз.
+    Consumer после сохранения ответа записывает его под тем же идентификатором:
+    повторно доставленное брокером сообщение получает сохранённый ответ
+    без второго запроса к модели и без второй пары строк в истории.
+    Сообщения без клиентского идентификатора consumer записывает
+    под AMQP message_id, который producer ставит каждому сообщению.
+    Идентификаторы действуют в пределах диалога. Если Redis недоступен,
+    сообщения обрабатываются как новые.
+    """
+
+    key_prefix = "idempotency:"
+
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL, client: redis.Redis | None = None):
+        super().__init__(client)
+        self.ttl = ttl
+
+    def claim_key(self, message: InputMessage) -> str:
+        return f"{self.key_prefix}claim:{message.conversation_id}:{message.message_id}"
+
+    def answer_key(self, message: InputMessage) -> str:
+        return f"{self.key_prefix}answer:{message.conversation_id}:{message.message_id}"
+
+    async def claim(self, message: InputMessage) -> bool:
+        """
+        Занимает идентификатор сообщения. False — сообщение с таким
+        идентификатором уже принято и публиковать его повторно не нужно.
+        """
+        return (await self.claim_many([message]))[0]
+
+    async def claim_many(self, messages: list[InputMessage]) -> list[bool]:
+        """
+        Занимает идентификаторы пакета сообщений одним обращением к Redis.
+        Сообщения без идентификатора всегда считаются новыми.
+        """
+        keyed = [message for message in messages if message.message_id is not None]
+        if not keyed:
+            return [True] * len(messages)
+        try:
+            async with self.connect().pipeline(transaction=False) as pipe:
+                for message in keyed:
+                    pipe.set(self.claim_key(message), 1, nx=True, ex=self.ttl)
+                claimed = iter(await pipe.execute())
+        except Exception as exc:
+            logger.warning(f"⚠ Хранилище идемпотентности недоступно, повторы не отсеиваются: {exc}")
+            return [True] * len(messages)
+        return [bool(next(claimed)) if message.message_id is not None else True for message in messages]
+
+    async def release(self, *messages: InputMessage) -> None:
+        """Освобождает идентификаторы сообщений, которые не удалось опубликовать."""
+        keys = [self.claim_key(message) for message in messages if message.message_id is not None]
+        if not keys:
+            return
+        try:
+            await self.connect().delete(*keys)
+        except Exception as exc:
+            logger.warning(f"⚠ Не удалось освободить ключи идемпотентности: {exc}")
+
+    async def get_answer(self, message: InputMessage) -> AnswerMessage | None:
+        """Сохранённый ответ на сообщение или None, если сообщение ещё не обработано."""
+        if message.message_id is None:
+            return None
+        try:
+            stored = await self.connect().get(self.answer_key(message))
+        except Exception as exc:
+            logger.warning(f"⚠ Хранилище идемпотентности недоступно: {exc}")
+            return None
+        return AnswerMessage.model_validate_json(stored) if stored else None
+
+    async def save_answer(self, message: InputMessage, answer: AnswerMessage) -> None:
+        """Запоминает ответ на обработанное сообщение на ttl секунд."""
+        if message.message_id is None:
+            return
+        try:
+            await self.connect().set(self.answer_key(message), answer.model_dump_json(), ex=self.ttl)
+        except Exception as exc:
+            logger.warning(f"⚠ Не удалось сохранить ответ для идемпотентности: {exc}")
+
+
+idempotency_store = IdempotencyStore()
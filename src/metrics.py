@@ -0,0 +1,273 @@
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from src.config import logger
+
+# Заголовок AMQP-сообщения с временем публикации (unix time, секунды)
+PUBLISHED_AT_HEADER = "x-published-at"
+
+# Границы корзин гистограмм задержек, в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Базовая метрика: имя, описание и значения по наборам меток."""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_name}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение; может вычисляться функцией в момент выгрузки."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def samples(self) -> list[str]:
+        if self._function is not None:
+            try:
+                self._values[()] = float(self._function())
+            except Exception as exc:
+                logger.warning(f"⚠ Не удалось вычислить метрику {self.name}: {exc}")
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами, суммой и количеством наблюдений."""
+
+    type_name = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labels: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * len(self.buckets))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время выполнения блока."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """
+        Оценивает квантиль q по корзинам, как histogram_quantile в Prometheus:
+        линейной интерполяцией внутри корзины. Складывает все ряды,
+        метки которых совпадают с переданными. None — если наблюдений нет.
+        """
+        totals = [0] * len(self.buckets)
+        for counts in self._matching(labels):
+            totals = [total + count for total, count in zip(totals, counts)]
+        if not totals[-1]:
+            return None
+
+        rank = q * totals[-1]
+        lower_bound, lower_count = 0.0, 0
+        for bound, count in zip(self.buckets, totals):
+            if count >= rank:
+                if math.isinf(bound):
+                    return lower_bound
+                return lower_bound + (bound - lower_bound) * (rank - lower_count) / ((count - lower_count) or 1)
+            lower_bound, lower_count = bound, count
+        return lower_bound
+
+    def count(self, **labels) -> int:
+        """Число наблюдений во всех рядах с совпадающими метками."""
+        return sum(counts[-1] for counts in self._matching(labels))
+
+    def _matching(self, labels: dict):
+        for key, counts in self._counts.items():
+            series = dict(zip(self.label_names, key))
+            if all(series.get(name) == str(value) for name, value in labels.items()):
+                yield counts
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса, выгружаемый в текстовом формате Prometheus."""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+# Producer
+HTTP_LATENCY = registry.register(Histogram(
+    "onai_http_request_seconds", "Время обработки HTTP-запросов producer", ("path", "status"),
+))
+PUBLISHED_MESSAGES = registry.register(Counter(
+    "onai_published_messages_total", "Сообщения, опубликованные в очередь", ("result",),
+))
+
+# Consumer
+QUEUE_WAIT = registry.register(Histogram(
+    "onai_queue_wait_seconds", "Время от публикации сообщения до начала обработки",
+))
+DB_LATENCY = registry.register(Histogram(
+    "onai_db_seconds", "Время операций с БД", ("operation",),
+))
+LLM_LATENCY = registry.register(Histogram(
+    "onai_llm_seconds", "Время запроса к LLM", ("model", "status"),
+))
+LLM_TOKENS = registry.register(Counter(
+    "onai_llm_tokens_total", "Токены, израсходованные LLM", ("model", "kind"),
+))
+LLM_RATE_WAIT = registry.register(Histogram(
+    "onai_llm_rate_wait_seconds", "Ожидание бюджета RPM/TPM перед запросом к LLM", ("backend",),
+))
+HEDGED_REQUESTS = registry.register(Counter(
+    "onai_llm_hedged_requests_total", "Запросы к LLM с хедж-запросом, по победителю", ("winner",),
+))
+LLM_CACHE_HITS = registry.register(Counter(
+    "onai_llm_cache_hits_total", "Ответы LLM, взятые из кэша",
+))
+LLM_CACHE_MISSES = registry.register(Counter(
+    "onai_llm_cache_misses_total", "Промахи кэша ответов LLM (запрос ушёл в модель)",
+))
+LLM_CACHE_COALESCED = registry.register(Counter(
+    "onai_llm_cache_coalesced_total", "Запросы к LLM, объединённые с таким же идущим запросом",
+))
+IN_FLIGHT = registry.register(Gauge(
+    "onai_in_flight_messages", "Сообщения в обработке",
+))
+CONCURRENCY_LIMIT = registry.register(Gauge(
+    "onai_concurrency_limit", "Текущий лимит параллельности consumer",
+))
+DB_POOL_CHECKED_OUT = registry.register(Gauge(
+    "onai_db_pool_checked_out", "Соединения пула БД, занятые в данный момент",
+))
+
+# Доставка
+CALLBACK_LATENCY = registry.register(Histogram(
+    "onai_callback_seconds", "Время отправки ответа на callback_url", ("status",),
+))
+
+
+async def _handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, content_type, body = "200 OK", registry.content_type, registry.render().encode()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as exc:
+        logger.warning(f"⚠ Ошибка при выдаче метрик: {exc}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.Server | None:
+    """
+    Запускает минимальный HTTP-сервер, отдающий GET /metrics.
+    Порт 0 или ошибка запуска отключают сервер, не мешая основной работе.
+    """
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle_metrics_request, host, port)
+        logger.info(f"📊 Метрики доступны на http://{host}:{port}/metrics")
+        return server
+    except OSError as exc:
+        logger.warning(f"⚠ Не удалось запустить сервер метрик: {exc}")
+        return None
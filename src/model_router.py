@@ -0,0 +1,284 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Callable
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from src.config import (
+    logger,
+    ROUTER_EWMA_ALPHA,
+    ROUTER_ERROR_THRESHOLD,
+    ROUTER_COOLDOWN,
+    HEDGE_ENABLED,
+    HEDGE_QUANTILE,
+    HEDGE_MIN_DELAY,
+    HEDGE_MIN_SAMPLES,
+    LLM_RPM_LIMIT,
+    LLM_TPM_LIMIT,
+    LLM_COMPLETION_TOKENS_ESTIMATE,
+)
+from src.metrics import LLM_LATENCY, LLM_TOKENS, HEDGED_REQUESTS
+from src.rate_scheduler import rate_scheduler
+from src.tokenizer import count_tokens
+
+
+def record_usage(model: str, usage) -> None:
+    """Учитывает токены запроса и ответа из поля usage ответа OpenAI."""
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if isinstance(tokens, int):
+            LLM_TOKENS.inc(tokens, model=model, kind=kind)
+
+
+def estimate_tokens(json_messages: list[dict], model: str) -> int:
+    """Оценка токенов, которые запрос спишет из TPM: история плюс ожидаемый ответ."""
+    history = sum(count_tokens(str(message["content"]), model) for message in json_messages)
+    return history + LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+def create_client(name: str, rpm: int = LLM_RPM_LIMIT, tpm: int = LLM_TPM_LIMIT, **kwargs) -> AsyncOpenAI:
+    """
+    Создаёт клиента OpenAI, каждый ответ которого обновляет общие лимиты
+    бэкенда name по заголовкам x-ratelimit-remaining-*.
+    """
+    return AsyncOpenAI(
+        http_client=DefaultAsyncHttpxClient(
+            event_hooks={"response": [rate_scheduler.response_hook(name, rpm, tpm)]},
+        ),
+        **kwargs,
+    )
+
+
+class Backend:
+    """
+    OpenAI-совместимый эндпоинт с моделью, лимитами RPM/TPM и скользящей
+    статистикой: EWMA времени ответа и EWMA доли ошибок, а также последние
+    задержки для оценки перцентиля.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            client: AsyncOpenAI,
+            model: str,
+            alpha: float = ROUTER_EWMA_ALPHA,
+            rpm: int = LLM_RPM_LIMIT,
+            tpm: int = LLM_TPM_LIMIT,
+    ):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.alpha = alpha
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency_ewma: float | None = None
+        self.error_ewma = 0.0
+        self.last_failure = 0.0
+        self.latencies: deque[float] = deque(maxlen=200)
+
+    def record_success(self, latency: float) -> None:
+        self.latency_ewma = latency if self.latency_ewma is None else (
+            self.alpha * latency + (1 - self.alpha) * self.latency_ewma
+        )
+        self.error_ewma *= 1 - self.alpha
+        self.latencies.append(latency)
+
+    def record_failure(self) -> None:
+        self.error_ewma = self.alpha + (1 - self.alpha) * self.error_ewma
+        self.last_failure = time.monotonic()
+
+    def healthy(self, error_threshold: float, cooldown: float) -> bool:
+        """
+        Бэкенд здоров, пока доля ошибок ниже порога. Нездоровый бэкенд
+        снова получает запрос через cooldown секунд после последней ошибки.
+        """
+        return self.error_ewma < error_threshold or time.monotonic() - self.last_failure >= cooldown
+
+    def latency_quantile(self, q: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def build_backends(config: list[dict], default_client: AsyncOpenAI, default_model: str) -> list[Backend]:
+    """
+    Создаёт бэкенды из конфигурации LLM_BACKENDS. Ключ берётся из поля api_key
+    или из переменной окружения api_key_env, лимиты — из полей rpm и tpm.
+    Без конфигурации — один бэкенд "default" с клиентом и моделью по умолчанию.
+    """
+    if not config:
+        return [Backend("default", default_client, default_model)]
+    backends = []
+    for entry in config:
+        name = entry.get("name", entry["model"])
+        rpm, tpm = int(entry.get("rpm", LLM_RPM_LIMIT)), int(entry.get("tpm", LLM_TPM_LIMIT))
+        client = create_client(
+            name, rpm, tpm,
+            base_url=entry.get("base_url"),
+            api_key=entry.get("api_key") or os.getenv(entry.get("api_key_env", "OPENAI_API_KEY")),
+        )
+        backends.append(Backend(name, client, entry["model"], rpm=rpm, tpm=tpm))
+    return backends
+
+
+class ModelRouter:
+    """
+    Направляет запросы к самому быстрому здоровому бэкенду (по EWMA задержки;
+    бэкенды без статистики пробуются первыми). При ошибке запрос
+    переходит к следующему бэкенду. Перед вызовом запрос ждёт бюджета
+    RPM/TPM бэкенда в rate_scheduler; время ожидания в задержку не входит.
+
+    С включённым хеджированием, если ответ не пришёл за p95 задержки
+    выбранного бэкенда (но не раньше hedge_min_delay), отправляется второй
+    запрос к следующему бэкенду; берётся первый успешный ответ, второй отменяется.
+    Отменённый запрос в статистику бэкенда не попадает.
+
+    on_error вызывается с ошибкой каждой неудачной попытки, в том числе
+    той, после которой запрос успешно перешёл на другой бэкенд.
+    """
+
+    def __init__(
+            self,
+            backends: list[Backend],
+            error_threshold: float = ROUTER_ERROR_THRESHOLD,
+            cooldown: float = ROUTER_COOLDOWN,
+            hedge: bool = HEDGE_ENABLED,
+            hedge_quantile: float = HEDGE_QUANTILE,
+            hedge_min_delay: float = HEDGE_MIN_DELAY,
+            hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+            on_error: Callable[[Exception], None] | None = None,
+    ):
+        self.backends = backends
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.on_error = on_error
+
+    @property
+    def models(self) -> str:
+        """
+        Модели всех бэкендов: ответ может прийти от любого из них,
+        поэтому кэш ответов различает запросы по всему набору.
+        """
+        return ",".join(sorted({backend.model for backend in self.backends}))
+
+    def _failed(self, backend: Backend, started: float, exc: Exception) -> None:
+        backend.record_failure()
+        LLM_LATENCY.observe(time.perf_counter() - started, model=backend.model, status="error")
+        if self.on_error is not None:
+            self.on_error(exc)
+
+    def ranked(self) -> list[Backend]:
+        """Здоровые бэкенды по возрастанию задержки, за ними — нездоровые по доле ошибок."""
+        healthy = [b for b in self.backends if b.healthy(self.error_threshold, self.cooldown)]
+        unhealthy = [b for b in self.backends if b not in healthy]
+        healthy.sort(key=lambda b: b.latency_ewma or 0.0)
+        unhealthy.sort(key=lambda b: b.error_ewma)
+        return healthy + unhealthy
+
+    def hedge_delay(self, backend: Backend) -> float | None:
+        """Задержка перед хедж-запросом или None, если хеджировать нельзя."""
+        if not self.hedge or len(backend.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, backend.latency_quantile(self.hedge_quantile))
+
+    async def _request(self, backend: Backend, json_messages: list[dict], **params):
+        await rate_scheduler.acquire(
+            backend.name, backend.rpm, backend.tpm, estimate_tokens(json_messages, backend.model)
+        )
+        started = time.perf_counter()
+        try:
+            response = await backend.client.chat.completions.create(
+                model=backend.model,
+                messages=json_messages,
+                **params,
+            )
+        except Exception as exc:
+            self._failed(backend, started, exc)
+            raise
+        latency = time.perf_counter() - started
+        backend.record_success(latency)
+        LLM_LATENCY.observe(latency, model=backend.model, status="ok")
+        record_usage(backend.model, getattr(response, "usage", None))
+        return response
+
+    async def complete(self, json_messages: list[dict], **params):
+        """
+        Возвращает ответ chat.completions первого успешно ответившего бэкенда.
+        Если не ответил ни один, пробрасывается последняя ошибка.
+        """
+        candidates = self.ranked()
+        last_error: Exception | None = None
+        while candidates:
+            primary = candidates.pop(0)
+            tasks = {asyncio.create_task(self._request(primary, json_messages, **params)): primary}
+            delay = self.hedge_delay(primary)
+            hedged = False
+            try:
+                if delay is not None and candidates:
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done:
+                        secondary = candidates.pop(0)
+                        logger.info(f"🔀 Хедж-запрос к {secondary.name}: {primary.name} не ответил за {delay:.2f} с")
+                        tasks[asyncio.create_task(self._request(secondary, json_messages, **params))] = secondary
+                        hedged = True
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        backend = tasks.pop(task)
+                        if task.exception() is None:
+                            if hedged:
+                                HEDGED_REQUESTS.inc(winner="primary" if backend is primary else "hedge")
+                            return task.result()
+                        last_error = task.exception()
+                        logger.warning(f"⚠ Бэкенд {backend.name} не ответил: {last_error}")
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        raise last_error or RuntimeError("Нет доступных бэкендов LLM")
+
+    async def stream(self, json_messages: list[dict]) -> AsyncIterator[str]:
+        """
+        Отдаёт ответ по частям от самого быстрого здорового бэкенда.
+        До первого фрагмента ошибка переводит запрос на следующий бэкенд,
+        после — пробрасывается (часть ответа уже отправлена клиенту).
+        """
+        last_error: Exception | None = None
+        for backend in self.ranked():
+            await rate_scheduler.acquire(
+                backend.name, backend.rpm, backend.tpm, estimate_tokens(json_messages, backend.model)
+            )
+            started = time.perf_counter()
+            produced = False
+            try:
+                stream = await backend.client.chat.completions.create(
+                    model=backend.model,
+                    messages=json_messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        record_usage(backend.model, chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        produced = True
+                        yield chunk.choices[0].delta.content
+            except Exception as exc:
+                self._failed(backend, started, exc)
+                if produced:
+                    raise
+                last_error = exc
+                logger.warning(f"⚠ Бэкенд {backend.name} не начал поток: {exc}")
+                continue
+            latency = time.perf_counter() - started
+            backend.record_success(latency)
+            LLM_LATENCY.observe(latency, model=backend.model, status="ok")
+            return
+        raise last_error or RuntimeError("Нет доступных бэкендов LLM")
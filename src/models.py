@@ -1,8 +1,16 @@
+from datetime import datetime
+from enum import Enum
 from typing import Annotated
 
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, ConfigDict, Field, HttpUrl
 
-from src.config import MODEL_TOKENS_LIMIT
+from src.config import MODEL_TOKENS_LIMIT, DEFAULT_CONVERSATION_ID
+
+
+class Priority(str, Enum):
+    """Полоса обработки: interactive-сообщения обгоняют ждущие в очереди bulk"""
+    interactive = "interactive"
+    bulk = "bulk"
 
 
 class InputMessage(BaseModel):
@@ -12,6 +20,11 @@ class InputMessage(BaseModel):
     Атрибуты:
     message: Текст сообщения пользователя, максимальная длина зависит от GPT модели
     callback_url: URL для отправки ответа
+    conversation_id: Идентификатор диалога, история хранится и читается в его рамках
+    stream: Отправлять ответ на callback_url по частям по мере генерации
+    priority: Полоса обработки (interactive — пользователь ждёт ответа, bulk — фоновая загрузка);
+        порядок сообщений диалога сохраняется только внутри одной полосы
+    message_id: Клиентский идентификатор сообщения: повторы с тем же идентификатором не обрабатываются заново
     """
     message: Annotated[
         str,
@@ -21,3 +34,82 @@ class InputMessage(BaseModel):
         HttpUrl,
         Field(title="URL", description="URL для отправки ответа")
     ]
+    conversation_id: Annotated[
+        str,
+        Field(
+            title="Диалог",
+            description="Идентификатор диалога (или арендатора)",
+            min_length=1,
+            max_length=64,
+        )
+    ] = DEFAULT_CONVERSATION_ID
+    stream: Annotated[
+        bool,
+        Field(title="Стриминг", description="Отправлять ответ частями по мере генерации")
+    ] = False
+    priority: Annotated[
+        Priority,
+        Field(
+            title="Приоритет",
+            description=(
+                "interactive или bulk (фоновые загрузки). interactive-сообщение обгоняет ждущие "
+                "bulk-сообщения того же диалога: чтобы сохранить порядок ходов, "
+                "отправляйте весь диалог в одной полосе"
+            ),
+        )
+    ] = Priority.interactive
+    message_id: Annotated[
+        str | None,
+        Field(
+            title="Идентификатор сообщения",
+            description="Ключ идемпотентности (заголовок Idempotency-Key имеет приоритет)",
+            min_length=1,
+            max_length=128,
+        )
+    ] = None
+
+
+class AnswerMessage(BaseModel):
+    """
+    Ответ модели, ожидающий доставки на callback_url (очередь доставки)
+
+    Атрибуты:
+    message: Текст ответа
+    callback_url: URL для отправки ответа
+    conversation_id: Идентификатор диалога
+    seq: Номер финального кадра при потоковой отправке, None — ответ без стриминга
+    """
+    message: str
+    callback_url: HttpUrl
+    conversation_id: str = DEFAULT_CONVERSATION_ID
+    seq: int | None = None
+
+
+class DialogMessage(BaseModel):
+    """
+    Реплика диалога при чтении истории по API
+
+    Атрибуты:
+    id: Идентификатор сообщения
+    created_at: Время создания
+    role: Автор (user или assistant)
+    content: Текст
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    created_at: datetime
+    role: str
+    content: str
+
+
+class DialogMessagesPage(BaseModel):
+    """
+    Страница истории диалога
+
+    Атрибуты:
+    messages: Реплики в порядке создания
+    next_cursor: Курсор следующей страницы, None — страница последняя
+    """
+    messages: list[DialogMessage]
+    next_cursor: str | None = None
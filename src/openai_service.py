@@ -1,12 +1,56 @@
-from openai import AsyncOpenAI
-from src.config import MODEL, OPENAI_API_KEY, logger
+import time
+from typing import AsyncIterator
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+from openai import APIStatusError, APITimeoutError
+from src.concurrency import consumer_limiter
+from src.config import MODEL, SUMMARY_MODEL, OPENAI_API_KEY, LLM_BACKENDS, logger, log_payload
+from src.metrics import LLM_LATENCY
+from src.model_router import ModelRouter, build_backends, create_client, record_usage
+from src.response_cache import response_cache
+
+SUMMARY_PROMPT = (
+    "Ты сжимаешь историю диалога пользователя с ассистентом. "
+    "Составь краткое содержание, сохранив факты, договорённости, имена и открытые вопросы, "
+    "нужные для продолжения разговора. Если дано предыдущее краткое содержание, "
+    "дополни его новыми репликами, а не пересказывай заново. Ответь только текстом содержания."
+)
+
+
+def is_overload(exc: Exception) -> bool:
+    """429, 5xx и таймауты от OpenAI означают перегрузку и снижают параллельность consumer."""
+    if isinstance(exc, APITimeoutError):
+        return True
+    return isinstance(exc, APIStatusError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+
+def report_overload(exc: Exception) -> None:
+    """Снижает параллельность consumer при перегрузке любого из бэкендов."""
+    if is_overload(exc):
+        consumer_limiter.on_overload()
+
+
+client = create_client("default", api_key=OPENAI_API_KEY)
+router = ModelRouter(build_backends(LLM_BACKENDS, client, MODEL), on_error=report_overload)
+
+
+async def request_answer(json_messages: list[dict]) -> str:
+    """
+    Запрашивает ответ через маршрутизатор бэкендов; если не ответил
+    ни один бэкенд, ошибка пробрасывается вызывающему.
+    """
+    logger.info("🔄 Отправка запроса в OpenAI...")
+    response = await router.complete(json_messages)
+    answer: str = response.choices[0].message.content
+    logger.info("✅ Ответ от OpenAI получен")
+    return answer
 
 
 async def get_answer(json_messages: list[dict]) -> str:
     """
     Получает ответ на последнее сообщение из OpenAI.
+    Если включён кэш ответов, одинаковые запросы берутся из кэша
+    или объединяются с уже идущим запросом. Перегрузку бэкендов
+    учитывает маршрутизатор (report_overload) на каждой попытке.
 
     Args:
         json_messages (list[dict]): История сообщений в формате OpenAI API.
@@ -15,15 +59,70 @@ async def get_answer(json_messages: list[dict]) -> str:
         str: Ответ модели.
     """
     try:
-        logger.info("🔄 Отправка запроса в OpenAI...")
-        response = await client.chat.completions.create(
-            model=MODEL,
-            messages=json_messages,
+        answer = await response_cache.get_or_create(
+            router.models, json_messages, {}, lambda: request_answer(json_messages)
         )
-        answer: str = response.choices[0].message.content
-        logger.info("✅ Ответ от OpenAI получен")
-        logger.debug(f"📜 Ответ: {answer}")
+        log_payload("📜 Ответ", answer)
         return answer
     except Exception as e:
         logger.exception("❌ Ошибка запроса к OpenAI:", exc_info=e)
         return "Ошибка при обработке запроса к OpenAI."
+
+
+async def stream_answer(json_messages: list[dict]) -> AsyncIterator[str]:
+    """
+    Получает ответ по частям (stream=True) через маршрутизатор бэкендов.
+
+    Args:
+        json_messages (list[dict]): История сообщений в формате OpenAI API.
+
+    Yields:
+        str: Очередной фрагмент ответа модели. Если ошибка случилась
+        до первого фрагмента, возвращается текст ошибки, а оборвавшийся
+        после него поток пробрасывает ошибку, чтобы не выдать часть ответа за весь.
+    """
+    started = False
+    try:
+        logger.info("🔄 Отправка потокового запроса в OpenAI...")
+        async for delta in router.stream(json_messages):
+            started = True
+            yield delta
+        logger.info("✅ Потоковый ответ от OpenAI получен")
+    except Exception as e:
+        logger.exception("❌ Ошибка потокового запроса к OpenAI:", exc_info=e)
+        if started:
+            raise
+        yield "Ошибка при обработке запроса к OpenAI."
+
+
+async def get_summary(previous_summary: str | None, json_messages: list[dict]) -> str | None:
+    """
+    Сворачивает реплики диалога в краткое содержание моделью SUMMARY_MODEL.
+
+    Args:
+        previous_summary (str | None): Предыдущее краткое содержание диалога.
+        json_messages (list[dict]): Новые реплики в формате OpenAI API.
+
+    Returns:
+        str | None: Новое краткое содержание или None при ошибке.
+    """
+    dialog = "\n".join(f"{message['role']}: {message['content']}" for message in json_messages)
+    if previous_summary:
+        dialog = f"Предыдущее краткое содержание:\n{previous_summary}\n\nНовые реплики:\n{dialog}"
+    started = time.perf_counter()
+    try:
+        logger.info("🔄 Запрос краткого содержания диалога в OpenAI...")
+        response = await client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": dialog},
+            ],
+        )
+        LLM_LATENCY.observe(time.perf_counter() - started, model=SUMMARY_MODEL, status="ok")
+        record_usage(SUMMARY_MODEL, getattr(response, "usage", None))
+        return response.choices[0].message.content
+    except Exception as e:
+        LLM_LATENCY.observe(time.perf_counter() - started, model=SUMMARY_MODEL, status="error")
+        logger.exception("❌ Ошибка запроса краткого содержания к OpenAI:", exc_info=e)
+        return None
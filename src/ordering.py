@@ -0,0 +1,138 @@
+import asyncio
+import zlib
+from contextlib import asynccontextmanager
+
+import aio_pika
+import redis.asyncio as redis
+
+from src.config import QUEUE_MAX_PRIORITY, COMPACTION_LOCK_TTL, logger
+from src.models import Priority
+from src.redis_client import RedisStore
+
+
+def shard_index(conversation_id: str, shards: int) -> int:
+    """Номер очереди-шарда диалога: одинаковый у всех producer и при перезапусках."""
+    return zlib.crc32(conversation_id.encode()) % shards
+
+
+def shard_queue_name(queue_name: str, index: int) -> str:
+    return f"{queue_name}.{index}"
+
+
+def conversation_queue_name(queue_name: str, conversation_id: str, shards: int) -> str:
+    """Очередь, в которую публикуются все сообщения диалога conversation_id."""
+    return shard_queue_name(queue_name, shard_index(conversation_id, shards))
+
+
+def worker_shards(shards: int, workers: int, worker: int) -> list[int]:
+    """
+    Шарды, которые читает воркер номер worker из workers: index % workers == worker.
+    Каждый шард достаётся ровно одному воркеру процесса, поэтому при
+    CONVERSATION_SHARDS >= workers заняты все воркеры.
+    """
+    return [index for index in range(shards) if index % workers == worker]
+
+
+def message_priority(priority: Priority, max_priority: int = QUEUE_MAX_PRIORITY) -> int:
+    """AMQP-приоритет сообщения полосы priority."""
+    return max_priority if priority is Priority.interactive else 0
+
+
+async def declare_conversation_queues(
+        channel: aio_pika.abc.AbstractChannel,
+        queue_name: str,
+        shards: int,
+        max_priority: int = QUEUE_MAX_PRIORITY,
+) -> list[aio_pika.abc.AbstractQueue]:
+    """
+    Объявляет очереди-шарды входящих сообщений. У каждой очереди
+    x-single-active-consumer: сколько бы реплик consumer ни подписалось,
+    сообщения шарда читает только одна из них, по порядку публикации.
+    Внутри одного процесса consumer шарды делятся между воркерами (worker_shards).
+    С max_priority > 0 очередь приоритетная: ждущие interactive-сообщения
+    выдаются раньше bulk. Порядок сохраняется только среди сообщений одного
+    приоритета: interactive обгоняет ждущие bulk-сообщения того же диалога.
+    """
+    arguments = {"x-single-active-consumer": True}
+    if max_priority > 0:
+        arguments["x-max-priority"] = max_priority
+    return [
+        await channel.declare_queue(
+            shard_queue_name(queue_name, index),
+            durable=True,
+            arguments=arguments,
+        )
+        for index in range(shards)
+    ]
+
+
+class ConversationLocks:
+    """
+    Блокировки по conversation_id внутри процесса: сообщения одного диалога
+    обрабатываются строго по одному и в порядке поступления (asyncio.Lock
+    пропускает ожидающих по очереди), разные диалоги — параллельно.
+    Блокировка удаляется, когда её больше никто не ждёт.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._holders: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, conversation_id: str):
+        lock = self._locks.setdefault(conversation_id, asyncio.Lock())
+        self._holders[conversation_id] = self._holders.get(conversation_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[conversation_id] -= 1
+            if not self._holders[conversation_id]:
+                del self._holders[conversation_id]
+                del self._locks[conversation_id]
+
+
+class DialogLeases(RedisStore):
+    """
+    Блокировки по conversation_id между процессами и репликами (Redis, SET NX
+    с истечением через ttl секунд): работу над диалогом выполняет только
+    тот, кто взял блокировку, остальные её пропускают. Если Redis недоступен,
+    работа выполняется без блокировки.
+    """
+
+    def __init__(self, key_prefix: str, ttl: int, client: redis.Redis | None = None):
+        super().__init__(client)
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+
+    def key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}"
+
+    @asynccontextmanager
+    async def hold(self, conversation_id: str):
+        """Отдаёт True, если блокировка взята, и False, если её держит другой процесс."""
+        lock = self.connect().lock(self.key(conversation_id), timeout=self.ttl, blocking=False)
+        try:
+            acquired = await lock.acquire()
+        except Exception as exc:
+            logger.warning(f"⚠ Блокировка диалога {conversation_id} недоступна: {exc}")
+            lock, acquired = None, True
+        if not acquired:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            try:
+                if lock is not None:
+                    await lock.release()
+            except Exception as exc:
+                # Блокировка могла истечь, пока шла работа
+                logger.warning(f"⚠ Не удалось снять блокировку диалога {conversation_id}: {exc}")
+
+
+conversation_locks = ConversationLocks()
+compaction_leases = DialogLeases("compaction:lock:", COMPACTION_LOCK_TTL)
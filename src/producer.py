@@ -1,15 +1,37 @@
-import redis.asyncio as redis
+import base64
+import binascii
+import json
+import time
+from datetime import datetime
+from typing import Annotated
+
 from contextlib import asynccontextmanager
 
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi_limiter import FastAPILimiter
 from fastapi_limiter.depends import RateLimiter
-from starlette.responses import JSONResponse
+from pydantic import ValidationError
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
-from src.config import TIMES_TO_LIMIT, SECONDS_TO_LIMIT, REDIS_URL, logger, APP_PORT, APP_HOST
+from src.config import (
+    TIMES_TO_LIMIT,
+    SECONDS_TO_LIMIT,
+    BATCH_MAX_SIZE,
+    BATCH_MESSAGES_LIMIT,
+    logger,
+    log_payload,
+    APP_PORT,
+    APP_HOST,
+    HISTORY_PAGE_SIZE,
+    HISTORY_PAGE_MAX_SIZE,
+)
+from src.metrics import HTTP_LATENCY, registry
 from src.rabbit import rabbitmq_service
-from src.models import InputMessage
-from src.database import delete_all_messages, get_async_session
+from src.models import InputMessage, DialogMessage, DialogMessagesPage, Priority
+from src.database import get_read_session, get_messages_page, stream_dialog_messages
+from src.deletion import deletion_jobs
+from src.idempotency import idempotency_store
+from src.redis_client import get_redis, close_redis
 
 
 @asynccontextmanager
@@ -20,12 +42,7 @@ async def lifespan(_: FastAPI):
     """
     try:
         logger.info("🔄 Подключение к Redis...")
-        redis_connection = redis.from_url(
-            REDIS_URL,
-            encoding="utf8",
-            decode_responses=True
-        )
-        await FastAPILimiter.init(redis_connection)
+        await FastAPILimiter.init(get_redis())
         logger.info("✅ Успешное подключение к Redis")
     except Exception as exc:
         logger.exception("❌ Ошибка при инициализации Redis:", exc_info=exc)
@@ -36,7 +53,7 @@ async def lifespan(_: FastAPI):
     logger.info("🔄 Закрытие соединений...")
     # Закрытие Redis и RabbitMQ
     try:
-        await FastAPILimiter.close()
+        await close_redis()
         logger.info("✅ Соединение с Redis закрыто")
     except Exception as exc:
         logger.exception("❌ Ошибка при закрытии соединения с Redis:", exc_info=exc)
@@ -51,35 +68,260 @@ async def lifespan(_: FastAPI):
 app = FastAPI(lifespan=lifespan)
 
 
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    """Учитывает время обработки запроса по шаблону пути и статусу ответа."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_LATENCY.observe(
+            time.perf_counter() - started,
+            path=route.path if route else "unmatched",
+            status=status,
+        )
+
+
+# Взвешенный вариант скрипта fastapi-limiter: пакет списывает weight единиц за раз
+WEIGHTED_LIMIT_SCRIPT = """local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local weight = tonumber(ARGV[2])
+local expire_time = ARGV[3]
+
+local current = tonumber(redis.call('get', key) or "0")
+if current + weight > limit then
+    local pttl = redis.call("PTTL", key)
+    if pttl < 0 then
+        return tonumber(expire_time)
+    end
+    return pttl
+end
+if current > 0 then
+    redis.call("INCRBY", key, weight)
+else
+    redis.call("SET", key, weight, "px", expire_time)
+end
+return 0"""
+
+
+async def charge_rate_limit(request: Request, weight: int) -> None:
+    """
+    Списывает weight единиц из лимита BATCH_MESSAGES_LIMIT за SECONDS_TO_LIMIT
+    одним обращением к Redis. При превышении — HTTP 429 с Retry-After.
+    """
+    identifier = await FastAPILimiter.identifier(request)
+    key = f"{FastAPILimiter.prefix}:batch:{identifier}"
+    pexpire = await FastAPILimiter.redis.eval(
+        WEIGHTED_LIMIT_SCRIPT, 1, key, BATCH_MESSAGES_LIMIT, weight, SECONDS_TO_LIMIT * 1000
+    )
+    if pexpire:
+        raise HTTPException(
+            status_code=429,
+            detail="Слишком много сообщений",
+            headers={"Retry-After": str(-(-int(pexpire) // 1000))},
+        )
+
+
+def parse_batch_body(body: bytes, content_type: str) -> list:
+    """
+    Разбирает тело пакетного запроса: JSON-массив или NDJSON
+    (по одному JSON-объекту в строке).
+    """
+    try:
+        if content_type.startswith("application/x-ndjson"):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный JSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Ожидается массив сообщений")
+    return items
+
+
 @app.post(
     "/webhook",
     dependencies=[Depends(RateLimiter(times=TIMES_TO_LIMIT, seconds=SECONDS_TO_LIMIT))]
 )
-async def send_message_to_rabbitmq(message: InputMessage):
+async def send_message_to_rabbitmq(
+        message: InputMessage,
+        idempotency_key: Annotated[str | None, Header(min_length=1, max_length=128)] = None,
+):
     """
     Обрабатывает входящее сообщение и отправляет его в очередь RabbitMQ.
     Ограничения на частоту запросов задаются через RateLimiter.
+    Повтор сообщения с тем же Idempotency-Key (или message_id) в пределах
+    IDEMPOTENCY_TTL не публикуется повторно: клиент получает 200 с заголовком
+    Idempotent-Replayed.
     """
     logger.info("📩 Получено новое сообщение")
-    logger.debug(f"📜 Содержимое сообщения: {message.model_dump_json()}")
-    response = await rabbitmq_service.send_message(message)
+    if idempotency_key is not None:
+        message = message.model_copy(update={"message_id": idempotency_key})
+    log_payload("📜 Содержимое сообщения", message)
+
+    if not await idempotency_store.claim(message):
+        logger.info(f"♻ Повтор сообщения {message.message_id}, повторно не публикуется")
+        return Response(status_code=200, content="✅ Сообщение уже принято", headers={"Idempotent-Replayed": "true"})
+    try:
+        response = await rabbitmq_service.send_message(message)
+    except Exception:
+        # Клиент повторит запрос — он не должен считаться дублем
+        await idempotency_store.release(message)
+        raise
     return response
 
 
-@app.get("/delete_dialog_data")
-async def delete_dialog_data(session=Depends(get_async_session)):
+@app.post("/webhook/batch")
+async def send_batch_to_rabbitmq(request: Request):
+    """
+    Принимает пакет сообщений (JSON-массив InputMessage или NDJSON), проверяет
+    их за один проход, списывает из лимита число сообщений одним запросом
+    к Redis и публикует валидные сообщения одним пакетом с подтверждениями.
+    Сообщения с уже принятым message_id получают статус duplicate и не публикуются.
+    Пакеты — фоновые загрузки, поэтому сообщения без явного priority
+    идут в полосе bulk и не обгоняют интерактивный трафик /webhook.
+    Возвращает статус по каждому сообщению.
+    """
+    items = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Не больше {BATCH_MAX_SIZE} сообщений в пакете")
+    logger.info(f"📩 Получен пакет из {len(items)} сообщений")
+
+    results: list[dict] = []
+    valid: list[tuple[int, InputMessage]] = []
+    for index, item in enumerate(items):
+        try:
+            if isinstance(item, dict):
+                item = {"priority": Priority.bulk, **item}
+            valid.append((index, InputMessage.model_validate(item)))
+            results.append({"index": index, "status": "queued"})
+        except ValidationError as exc:
+            errors = exc.errors(include_url=False, include_context=False)
+            results.append({"index": index, "status": "invalid", "errors": errors})
+
+    if valid:
+        claimed = await idempotency_store.claim_many([message for _, message in valid])
+        for (index, _), ok in zip(valid, claimed):
+            if not ok:
+                results[index]["status"] = "duplicate"
+        valid = [entry for entry, ok in zip(valid, claimed) if ok]
+
+    if valid:
+        try:
+            await charge_rate_limit(request, len(valid))
+        except HTTPException:
+            await idempotency_store.release(*(message for _, message in valid))
+            raise
+        published = await rabbitmq_service.send_messages([message for _, message in valid])
+        for (index, _), ok in zip(valid, published):
+            if not ok:
+                results[index]["status"] = "failed"
+        await idempotency_store.release(*(message for (_, message), ok in zip(valid, published) if not ok))
+
+    accepted = sum(result["status"] == "queued" for result in results)
+    return JSONResponse(status_code=200, content={"accepted": accepted, "results": results})
+
+
+@app.get("/metrics")
+async def metrics():
+    """Отдаёт метрики producer в текстовом формате Prometheus."""
+    return Response(content=registry.render(), media_type=registry.content_type)
+
+
+async def schedule_deletion(conversation_id: str | None) -> JSONResponse:
     """
-    Удаляет все сообщения (данные диалога) в базе данных.
+    Ставит задачу удаления в очередь (выполняет её сервис retention)
+    и отвечает 202 с адресом её статуса.
     """
-    logger.info("🗑 Удаление данных диалога")
     try:
-        await delete_all_messages(session)
-        message = "✅ Данные диалога удалены"
-        logger.info(message)
-        return JSONResponse(status_code=200, content={"message": message})
+        job_id = await deletion_jobs.start(conversation_id)
     except Exception as exc:
-        logger.exception("❌ Ошибка при удалении данных диалога:", exc_info=exc)
+        logger.exception("❌ Ошибка при постановке задачи удаления:", exc_info=exc)
         raise HTTPException(status_code=500, detail="Ошибка при удалении данных диалога")
+    logger.info(f"🗑 Запланировано удаление {conversation_id or 'всех диалогов'}: задача {job_id}")
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status_url": f"/deletions/{job_id}"},
+        headers={"Location": f"/deletions/{job_id}"},
+    )
+
+
+@app.delete("/dialogs/{conversation_id}")
+async def delete_dialog(conversation_id: str):
+    """
+    Удаляет сообщения диалога в сервисе retention, пачками с паузами между ними,
+    чтобы не держать долгих блокировок. Прогресс — в GET /deletions/{job_id}.
+    """
+    return await schedule_deletion(conversation_id)
+
+
+@app.delete("/dialogs")
+async def delete_all_dialogs():
+    """Очищает таблицу сообщений целиком (TRUNCATE) в сервисе retention."""
+    return await schedule_deletion(None)
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    """Непрозрачный курсор страницы из ключа (created_at, id) последней строки."""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{message_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Ключ (created_at, id) из курсора; некорректный курсор — HTTP 400."""
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+
+@app.get("/dialogs/{conversation_id}/messages", response_model=DialogMessagesPage)
+async def read_dialog_messages(
+        conversation_id: str,
+        limit: Annotated[int, Query(ge=1, le=HISTORY_PAGE_MAX_SIZE)] = HISTORY_PAGE_SIZE,
+        cursor: str | None = None,
+):
+    """
+    Страница истории диалога в порядке создания. Следующая страница
+    запрашивается с cursor=next_cursor, пока next_cursor не станет null.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    async with get_read_session(conversation_id) as session:
+        messages = await get_messages_page(session, conversation_id, limit, after)
+    next_cursor = encode_cursor(messages[-1].created_at, messages[-1].id) if len(messages) == limit else None
+    return DialogMessagesPage(
+        messages=[DialogMessage.model_validate(message) for message in messages],
+        next_cursor=next_cursor,
+    )
+
+
+@app.get("/dialogs/{conversation_id}/export")
+async def export_dialog(conversation_id: str):
+    """
+    Выгружает всю историю диалога в NDJSON (по реплике в строке) потоком:
+    строки читаются серверным курсором и сразу отправляются клиенту,
+    поэтому память не зависит от длины диалога.
+    """
+    async def lines():
+        async for message in stream_dialog_messages(conversation_id):
+            yield DialogMessage.model_validate(message).model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/deletions/{job_id}")
+async def deletion_status(job_id: str):
+    """
+    Статус задачи удаления: pending, running, done, failed или interrupted,
+    и сколько сообщений уже удалено.
+    """
+    job = await deletion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача удаления не найдена")
+    return job
 
 
 if __name__ == "__main__":
@@ -1,27 +1,63 @@
+import asyncio
+import time
+import uuid
+
 import aio_pika
+from aio_pika.pool import Pool
 from fastapi import HTTPException
 from starlette.responses import Response
 
-from src.config import RABBITMQ_URL, QUEUE_NAME, logger
+from src.config import (
+    RABBITMQ_URL,
+    QUEUE_NAME,
+    CONVERSATION_SHARDS,
+    RABBITMQ_CHANNEL_POOL_SIZE,
+    PUBLISH_BATCH_SIZE,
+    PUBLISH_BATCH_WINDOW,
+    logger,
+)
+from src.metrics import PUBLISHED_AT_HEADER, PUBLISHED_MESSAGES
 from src.models import InputMessage
+from src.ordering import conversation_queue_name, declare_conversation_queues, message_priority
 
 
 class RabbitMQService:
     """
     Класс-обёртка для работы с RabbitMQ, обеспечивающий ленивое подключение.
+    Публикация идёт через пул каналов в режиме publisher confirms:
+    сообщения от параллельных запросов копятся в пакет (до batch_size штук
+    или batch_window секунд), публикуются в одном канале без ожидания
+    каждого по отдельности, и подтверждения брокера ждутся вместе.
+    Сообщения диалога всегда уходят в одну и ту же из shards очередей-шардов.
     """
 
-    def __init__(self, url: str, queue_name: str):
+    def __init__(
+            self,
+            url: str,
+            queue_name: str,
+            pool_size: int = RABBITMQ_CHANNEL_POOL_SIZE,
+            batch_size: int = PUBLISH_BATCH_SIZE,
+            batch_window: float = PUBLISH_BATCH_WINDOW,
+            shards: int = CONVERSATION_SHARDS,
+    ):
         self.url = url
         self.queue_name = queue_name
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.shards = shards
         self._connection: aio_pika.RobustConnection | None = None
         self._channel: aio_pika.Channel | None = None
+        self._channel_pool: Pool | None = None
+        self._pending: list[tuple[aio_pika.Message, str, asyncio.Future]] = []
+        self._timer: asyncio.Task | None = None
+        self._publishes: set[asyncio.Task] = set()
 
     async def connect(self) -> aio_pika.Channel:
         """
         Создаёт и/или возвращает активный канал RabbitMQ.
         При необходимости (если соединение или канал закрыты) —
-        переподключается, заново открывает канал и декларирует очередь.
+        переподключается, заново открывает канал и декларирует очереди-шарды.
         """
         if not self._connection or self._connection.is_closed:
             logger.info("🔄 Подключение к RabbitMQ...")
@@ -31,35 +67,142 @@ class RabbitMQService:
         if not self._channel or self._channel.is_closed:
             logger.info("🔄 Создание канала RabbitMQ...")
             self._channel = await self._connection.channel()
-            await self._channel.declare_queue(self.queue_name, durable=True)
-            logger.info(f"✅ Очередь '{self.queue_name}' создана/существует.")
+            await declare_conversation_queues(self._channel, self.queue_name, self.shards)
+            logger.info(f"✅ Очереди '{self.queue_name}.0..{self.shards - 1}' созданы/существуют.")
 
         return self._channel
 
-    async def send_message(self, message: InputMessage) -> Response:
+    async def _create_publish_channel(self) -> aio_pika.abc.AbstractChannel:
+        """Открывает канал пула в режиме publisher confirms."""
+        await self.connect()
+        return await self._connection.channel(publisher_confirms=True)
+
+    def _get_channel_pool(self) -> Pool:
+        if self._channel_pool is None or self._channel_pool.is_closed:
+            self._channel_pool = Pool(self._create_publish_channel, max_size=self.pool_size)
+        return self._channel_pool
+
+    def routing_key(self, message: InputMessage) -> str:
+        """Очередь-шард диалога сообщения."""
+        return conversation_queue_name(self.queue_name, message.conversation_id, self.shards)
+
+    def build_message(self, message: InputMessage) -> aio_pika.Message:
         """
-        Публикует сообщение в очередь RabbitMQ, предварительно убеждаясь,
-        что соединение и канал готовы к работе.
+        Готовит AMQP-сообщение из входящего сообщения. Время публикации
+        кладётся в заголовок, чтобы consumer мог измерить ожидание в очереди,
+        приоритет зависит от полосы сообщения (interactive или bulk).
+        Каждое сообщение получает уникальный AMQP message_id: по нему consumer
+        узнаёт повторную доставку сообщения без клиентского идентификатора.
         """
-        try:
-            channel = await self.connect()
-            await channel.default_exchange.publish(
-                aio_pika.Message(
-                    body=message.model_dump_json().encode(),
-                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        return aio_pika.Message(
+            body=message.model_dump_json().encode(),
+            message_id=uuid.uuid4().hex,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            priority=message_priority(message.priority),
+            headers={PUBLISHED_AT_HEADER: time.time()},
+        )
+
+    async def publish_batch(self, messages: list[tuple[aio_pika.Message, str]]) -> list[BaseException | None]:
+        """
+        Публикует пары (сообщение, очередь) в одном канале пула и ждёт
+        подтверждений брокера для всех сразу. Возвращает для каждого
+        сообщения None (брокер принял) или исключение.
+        """
+        async with self._get_channel_pool().acquire() as channel:
+            results = await asyncio.gather(
+                *(
+                    channel.default_exchange.publish(message, routing_key=routing_key)
+                    for message, routing_key in messages
                 ),
-                routing_key=self.queue_name,
+                return_exceptions=True,
             )
+        return [result if isinstance(result, BaseException) else None for result in results]
+
+    async def publish(self, message: aio_pika.Message, routing_key: str | None = None) -> None:
+        """
+        Ставит сообщение в текущий пакет и ждёт подтверждения брокера.
+        Пакет уходит, как только набрано batch_size сообщений
+        или прошло batch_window секунд с первого из них.
+        Без routing_key сообщение публикуется в очередь queue_name.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((message, routing_key or self.queue_name, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        await future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_window)
+        self._timer = None
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._publish_pending(batch))
+            self._publishes.add(task)
+            task.add_done_callback(self._publishes.discard)
+
+    async def _publish_pending(self, batch: list[tuple[aio_pika.Message, str, asyncio.Future]]) -> None:
+        try:
+            results = await self.publish_batch([(message, routing_key) for message, routing_key, _ in batch])
+        except Exception as exc:
+            results = [exc] * len(batch)
+        for (_, _, future), error in zip(batch, results):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    async def send_message(self, message: InputMessage) -> Response:
+        """
+        Публикует сообщение в очередь RabbitMQ и отвечает только после того,
+        как брокер подтвердил его приём.
+        """
+        try:
+            await self.publish(self.build_message(message), self.routing_key(message))
+            PUBLISHED_MESSAGES.inc(result="ok")
             logger.info("📩 Сообщение отправлено в RabbitMQ.")
             return Response(status_code=200, content="✅ Сообщение отправлено")
         except Exception as e:
+            PUBLISHED_MESSAGES.inc(result="error")
             logger.exception("❌ Ошибка публикации сообщения в RabbitMQ:", exc_info=e)
             raise HTTPException(status_code=500, detail="Ошибка RabbitMQ")
 
+    async def send_messages(self, messages: list[InputMessage]) -> list[bool]:
+        """
+        Публикует пакет сообщений одним confirmed-пакетом.
+        Возвращает для каждого сообщения, принял ли его брокер.
+        """
+        try:
+            errors = await self.publish_batch([
+                (self.build_message(message), self.routing_key(message)) for message in messages
+            ])
+        except Exception as e:
+            logger.exception("❌ Ошибка пакетной публикации в RabbitMQ:", exc_info=e)
+            PUBLISHED_MESSAGES.inc(len(messages), result="error")
+            return [False] * len(messages)
+        for error in filter(None, errors):
+            logger.error(f"❌ Брокер не принял сообщение: {error}")
+        failed = sum(error is not None for error in errors)
+        PUBLISHED_MESSAGES.inc(len(errors) - failed, result="ok")
+        PUBLISHED_MESSAGES.inc(failed, result="error")
+        logger.info(f"📩 Пакет из {len(messages)} сообщений отправлен в RabbitMQ.")
+        return [error is None for error in errors]
+
     async def close_connection(self) -> None:
         """
-        Закрывает соединение с RabbitMQ, если оно активно.
+        Закрывает пул каналов и соединение с RabbitMQ, если оно активно.
         """
+        if self._channel_pool is not None and not self._channel_pool.is_closed:
+            await self._channel_pool.close()
         if self._connection and not self._connection.is_closed:
             logger.info("🔄 Закрытие соединения с RabbitMQ...")
             await self._connection.close()
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import defaultdict
+
+import httpx
+import redis.asyncio as redis
+
+from src.config import logger
+from src.metrics import LLM_RATE_WAIT
+from src.redis_client import RedisStore
+
+# Два ведра (запросы и токены) с непрерывным пополнением: capacity в минуту.
+# Списывает 1 запрос и ARGV[3] токенов, только если хватает обоих;
+# иначе ничего не списывает и возвращает, сколько миллисекунд ждать.
+# Лимит 0 означает, что ведро не ограничено.
+ACQUIRE_SCRIPT = """local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local limits = {tonumber(ARGV[1]), tonumber(ARGV[2])}
+local costs = {1, tonumber(ARGV[3])}
+local levels = {}
+local wait = 0
+for i = 1, 2 do
+    if limits[i] > 0 then
+        local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+        local level = tonumber(state[1]) or limits[i]
+        local ts = tonumber(state[2]) or now
+        level = math.min(limits[i], level + math.max(0, now - ts) * limits[i] / 60000)
+        local cost = math.min(costs[i], limits[i])
+        if level < cost then
+            wait = math.max(wait, (cost - level) * 60000 / limits[i])
+        end
+        levels[i] = level
+        costs[i] = cost
+    end
+end
+for i = 1, 2 do
+    if limits[i] > 0 then
+        local level = levels[i]
+        if wait == 0 then
+            level = level - costs[i]
+        end
+        redis.call('HSET', KEYS[i], 'level', level, 'ts', now)
+        redis.call('PEXPIRE', KEYS[i], 120000)
+    end
+end
+return math.ceil(wait)"""
+
+# Выставляет остаток ведра по данным провайдера (заголовки x-ratelimit-remaining-*)
+SYNC_SCRIPT = """local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+for i = 1, #KEYS do
+    redis.call('HSET', KEYS[i], 'level', ARGV[i], 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], 120000)
+end
+return 0"""
+
+# Заголовки провайдера с остатком лимита, в порядке вёдер (запросы, токены)
+REMAINING_HEADERS = ("x-ratelimit-remaining-requests", "x-ratelimit-remaining-tokens")
+
+
+class RateScheduler(RedisStore):
+    """
+    Общий для всех реплик consumer планировщик вызовов LLM по лимитам
+    запросов (RPM) и токенов (TPM) в минуту для каждого бэкенда.
+    Состояние ведёр хранится в Redis и меняется атомарным Lua-скриптом.
+    Если бюджета не хватает, запрос ждёт в локальной очереди бэкенда
+    (опрашивает Redis только её голова), а не завершается ошибкой.
+    При недоступности Redis запросы пропускаются без ограничения.
+    """
+
+    key_prefix = "llm:rate:"
+
+    def __init__(self, client: redis.Redis | None = None):
+        super().__init__(client)
+        self._queues: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def keys(self, name: str) -> tuple[str, str]:
+        return f"{self.key_prefix}{name}:requests", f"{self.key_prefix}{name}:tokens"
+
+    async def acquire(self, name: str, rpm: int, tpm: int, tokens: int) -> None:
+        """
+        Ждёт, пока в вёдрах бэкенда name хватит одного запроса и tokens токенов,
+        и списывает их. Без лимитов возвращается сразу.
+        """
+        if rpm <= 0 and tpm <= 0:
+            return
+        started = time.perf_counter()
+        try:
+            async with self._queues[name]:
+                while True:
+                    try:
+                        wait_ms = await self.connect().eval(ACQUIRE_SCRIPT, 2, *self.keys(name), rpm, tpm, tokens)
+                    except Exception as exc:
+                        logger.warning(f"⚠ Планировщик лимитов LLM недоступен, запрос без ограничения: {exc}")
+                        return
+                    if not wait_ms:
+                        return
+                    logger.info(f"⏳ Лимит LLM для {name}: ожидание {wait_ms} мс")
+                    await asyncio.sleep(int(wait_ms) / 1000)
+        finally:
+            LLM_RATE_WAIT.observe(time.perf_counter() - started, backend=name)
+
+    async def sync(self, name: str, headers: httpx.Headers) -> None:
+        """Приводит остаток вёдер бэкенда к значениям из заголовков ответа провайдера."""
+        keys, levels = [], []
+        for key, header in zip(self.keys(name), REMAINING_HEADERS):
+            remaining = headers.get(header)
+            if remaining is not None and remaining.isdigit():
+                keys.append(key)
+                levels.append(int(remaining))
+        if not keys:
+            return
+        try:
+            await self.connect().eval(SYNC_SCRIPT, len(keys), *keys, *levels)
+        except Exception as exc:
+            logger.warning(f"⚠ Не удалось обновить лимиты LLM из заголовков: {exc}")
+
+    def response_hook(self, name: str, rpm: int, tpm: int):
+        """Хук httpx, синхронизирующий вёдра бэкенда по каждому ответу провайдера."""
+        async def hook(response: httpx.Response) -> None:
+            if rpm > 0 or tpm > 0:
+                await self.sync(name, response.headers)
+        return hook
+
+
+rate_scheduler = RateScheduler()
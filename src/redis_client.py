@@ -0,0 +1,34 @@
+import redis.asyncio as redis
+
+from src.config import REDIS_URL
+
+_client: redis.Redis | None = None
+
+
+def get_redis() -> redis.Redis:
+    """Создаёт (лениво) и возвращает общий для процесса клиент Redis с одним пулом соединений."""
+    global _client
+    if _client is None:
+        _client = redis.from_url(REDIS_URL, encoding="utf8", decode_responses=True)
+    return _client
+
+
+async def close_redis() -> None:
+    """Закрывает общий клиент Redis; следующий get_redis() создаст новый."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class RedisStore:
+    """
+    Основа хранилищ в Redis (кэши, блокировки, очереди задач): все они
+    работают через общий клиент get_redis(), если клиент не передан явно.
+    """
+
+    def __init__(self, client: redis.Redis | None = None):
+        self._redis = client
+
+    def connect(self) -> redis.Redis:
+        return self._redis if self._redis is not None else get_redis()
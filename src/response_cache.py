@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Awaitable, Callable
+
+import redis.asyncio as redis
+
+from src.config import LLM_CACHE_ENABLED, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES, logger
+from src.metrics import LLM_CACHE_HITS, LLM_CACHE_MISSES, LLM_CACHE_COALESCED
+from src.redis_client import RedisStore
+
+
+class ResponseCache(RedisStore):
+    """
+    Кэш ответов LLM в Redis по точному совпадению запроса
+    (модель, сообщения, параметры) с TTL и ограничением числа записей.
+    Одинаковые запросы, пришедшие одновременно, объединяются:
+    в модель уходит только первый, остальные ждут его результат.
+    Попадания, промахи и объединённые запросы выгружаются в /metrics
+    (onai_llm_cache_*_total).
+    """
+
+    key_prefix = "llm:answer:"
+    index_key = "llm:index"
+
+    def __init__(self, ttl: int, max_entries: int, enabled: bool, client: redis.Redis | None = None):
+        super().__init__(client)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def make_key(model: str, messages: list[dict], params: dict) -> str:
+        """Хэш запроса; порядок ключей в словарях на него не влияет."""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def stats(self) -> dict[str, int]:
+        """Счётчики попаданий, промахов и объединённых запросов."""
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+    async def _get(self, key: str) -> str | None:
+        try:
+            return await self.connect().get(f"{self.key_prefix}{key}")
+        except Exception as exc:
+            logger.warning(f"⚠ Кэш ответов недоступен: {exc}")
+            return None
+
+    async def _set(self, key: str, answer: str) -> None:
+        """
+        Сохраняет ответ и вытесняет самые старые записи сверх max_entries.
+        Индекс (sorted set по времени записи) заодно очищается от истёкших ключей.
+        """
+        try:
+            client = self.connect()
+            now = time.time()
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.set(f"{self.key_prefix}{key}", answer, ex=self.ttl)
+                pipe.zadd(self.index_key, {key: now})
+                pipe.zremrangebyscore(self.index_key, "-inf", now - self.ttl)
+                pipe.zcard(self.index_key)
+                *_, size = await pipe.execute()
+
+            if size > self.max_entries:
+                evicted = await client.zpopmin(self.index_key, size - self.max_entries)
+                if evicted:
+                    await client.delete(*(f"{self.key_prefix}{member}" for member, _ in evicted))
+        except Exception as exc:
+            logger.warning(f"⚠ Не удалось сохранить ответ в кэш: {exc}")
+
+    async def get_or_create(
+            self,
+            model: str,
+            messages: list[dict],
+            params: dict,
+            create: Callable[[], Awaitable[str]],
+    ) -> str:
+        """
+        Возвращает ответ из кэша, ответ уже идущего такого же запроса
+        или результат create(), который затем кладётся в кэш.
+        Исключения create() не кэшируются и передаются всем ожидающим.
+        """
+        if not self.enabled:
+            return await create()
+
+        key = self.make_key(model, messages, params)
+        if key in self._in_flight:
+            self.coalesced += 1
+            LLM_CACHE_COALESCED.inc()
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        # Исключение считается полученным, даже если ожидающих не было
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        try:
+            answer = await self._get(key)
+            if answer is not None:
+                self.hits += 1
+                LLM_CACHE_HITS.inc()
+                logger.info("✅ Ответ взят из кэша")
+            else:
+                self.misses += 1
+                LLM_CACHE_MISSES.inc()
+                answer = await create()
+                await self._set(key, answer)
+            future.set_result(answer)
+            return answer
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            del self._in_flight[key]
+
+
+response_cache = ResponseCache(LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_ENABLED)
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from src.config import (
+    logger,
+    MESSAGE_RETENTION_DAYS,
+    MESSAGE_RETENTION_OVERRIDES,
+    RETENTION_INTERVAL,
+    RETENTION_ARCHIVE_SCHEMA,
+)
+from src.database import (
+    DBMessage,
+    create_tables,
+    delete_in_batches,
+    engine,
+    ensure_partitions,
+    list_partitions,
+)
+from src.deletion import deletion_jobs
+from src.history_cache import history_cache
+from src.redis_client import close_redis
+
+
+async def expire_partitions(cutoff: datetime, archive_schema: str = RETENTION_ARCHIVE_SCHEMA) -> list[str]:
+    """
+    Отсоединяет партиции messages, целиком лежащие раньше cutoff
+    (DETACH ... CONCURRENTLY не блокирует запись в таблицу), и удаляет их
+    или переносит в схему archive_schema. Возвращает имена обработанных партиций.
+    """
+    async with engine.connect() as conn:
+        expired = [name for name, upper in await list_partitions(conn) if upper is not None and upper <= cutoff]
+    if not expired:
+        return []
+
+    async with engine.connect() as conn:
+        # DETACH CONCURRENTLY нельзя выполнять внутри транзакции
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if archive_schema:
+            await conn.exec_driver_sql(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}")
+        for name in expired:
+            await conn.exec_driver_sql(f"ALTER TABLE messages DETACH PARTITION {name} CONCURRENTLY")
+            if archive_schema:
+                await conn.exec_driver_sql(f"ALTER TABLE {name} SET SCHEMA {archive_schema}")
+                logger.info(f"📦 Партиция {name} перенесена в схему {archive_schema}")
+            else:
+                await conn.exec_driver_sql(f"DROP TABLE {name}")
+                logger.info(f"🗑 Партиция {name} удалена")
+    return expired
+
+
+async def prune_messages(
+        now: datetime | None = None,
+        retention_days: int = MESSAGE_RETENTION_DAYS,
+        overrides: dict[str, int] = MESSAGE_RETENTION_OVERRIDES,
+) -> int:
+    """
+    Применяет политику хранения: сообщения старше retention_days дней
+    (для диалогов из overrides — старше их собственного срока; 0 — бессрочно).
+    Партиции, в которых все строки старше самого долгого из сроков,
+    убираются целиком, остальные устаревшие строки удаляются пачками.
+    Возвращает число удалённых пачками строк.
+    """
+    now = now or datetime.now()
+    periods = [retention_days, *overrides.values()]
+    if all(periods) and await expire_partitions(now - timedelta(days=max(periods))):
+        await history_cache.invalidate()
+
+    deleted = 0
+    if retention_days:
+        criteria = [DBMessage.created_at < now - timedelta(days=retention_days)]
+        if overrides:
+            criteria.append(DBMessage.conversation_id.not_in(list(overrides)))
+        removed = await delete_in_batches(*criteria)
+        if removed:
+            await history_cache.invalidate()
+        deleted += removed
+    for conversation_id, days in overrides.items():
+        if not days:
+            continue
+        removed = await delete_in_batches(
+            DBMessage.conversation_id == conversation_id,
+            DBMessage.created_at < now - timedelta(days=days),
+        )
+        if removed:
+            await history_cache.invalidate(conversation_id)
+        deleted += removed
+
+    if deleted:
+        logger.info(f"🗑 По сроку хранения удалено {deleted} сообщений")
+    return deleted
+
+
+async def run_retention(interval: float = RETENTION_INTERVAL) -> None:
+    """
+    Фоновое обслуживание messages раз в interval секунд: партиции наперёд
+    и очистка по сроку хранения. Ошибка одного прохода не останавливает цикл.
+    """
+    while True:
+        try:
+            async with engine.begin() as conn:
+                await ensure_partitions(conn)
+            await prune_messages()
+        except Exception as exc:
+            logger.exception("❌ Ошибка обслуживания таблицы сообщений:", exc_info=exc)
+        await asyncio.sleep(interval)
+
+
+async def main() -> None:
+    """
+    Точка входа фонового процесса очистки: python -m src.retention.
+    Здесь же выполняются задачи удаления диалогов, принятые producer.
+    """
+    await create_tables()
+    logger.info("🔄 Запущена фоновая очистка сообщений")
+    try:
+        await asyncio.gather(run_retention(), deletion_jobs.serve())
+    finally:
+        await close_redis()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
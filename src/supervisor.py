@@ -0,0 +1,90 @@
+import multiprocessing
+import signal
+import time
+from typing import Callable
+
+from src.config import logger, WORKER_RESTART_MAX_BACKOFF
+
+# Воркер, проработавший дольше этого (в секундах), считается стабильным,
+# и задержка перед его следующим перезапуском сбрасывается
+STABLE_UPTIME = 60
+
+
+class Supervisor:
+    """
+    Запускает workers процессов target(index) и следит за ними: упавший
+    или завершившийся воркер перезапускается с растущей задержкой
+    (до WORKER_RESTART_MAX_BACKOFF секунд). По SIGTERM/SIGINT супервизор
+    пересылает SIGTERM воркерам, ждёт, пока они завершат текущую работу,
+    и выходит.
+
+    Процессы создаются через spawn: каждый воркер заново импортирует модули
+    и получает собственные соединения с RabbitMQ, пул БД и поток логирования.
+    """
+
+    def __init__(self, target: Callable[[int], None], workers: int, name: str):
+        self.target = target
+        self.workers = workers
+        self.name = name
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: dict[int, multiprocessing.Process] = {}
+        self._started_at: dict[int, float] = {}
+        self._backoff: dict[int, float] = {}
+        self._restart_at: dict[int, float] = {}
+        self._stopping = False
+
+    def _start(self, index: int) -> None:
+        process = self._context.Process(target=self.target, args=(index,), name=f"{self.name}-{index}")
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"🚀 Запущен воркер {process.name} (pid {process.pid})")
+
+    def _stop(self, signum, _frame) -> None:
+        if self._stopping:
+            return
+        self._stopping = True
+        logger.info(f"🛑 Сигнал {signal.Signals(signum).name}: останавливаем воркеры {self.name}")
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def _reap(self) -> None:
+        """Забирает завершившиеся процессы и планирует их перезапуск."""
+        now = time.monotonic()
+        for index, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del self._processes[index]
+            if self._stopping:
+                logger.info(f"✅ Воркер {process.name} остановлен (код {process.exitcode})")
+                continue
+
+            if now - self._started_at[index] >= STABLE_UPTIME:
+                self._backoff[index] = 0
+            backoff = self._backoff.get(index, 0)
+            self._backoff[index] = min(WORKER_RESTART_MAX_BACKOFF, max(1.0, backoff * 2))
+            self._restart_at[index] = now + backoff
+            logger.error(
+                f"❌ Воркер {process.name} завершился с кодом {process.exitcode}, перезапуск через {backoff:.0f} с"
+            )
+
+    def run(self) -> None:
+        """Запускает воркеры и блокируется, пока все они не остановятся."""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for index in range(self.workers):
+            self._start(index)
+
+        while self._processes or (self._restart_at and not self._stopping):
+            self._reap()
+            now = time.monotonic()
+            for index, restart_at in list(self._restart_at.items()):
+                if self._stopping:
+                    self._restart_at.clear()
+                elif restart_at <= now:
+                    del self._restart_at[index]
+                    self._start(index)
+            time.sleep(0.2)
+        logger.info(f"✅ Все воркеры {self.name} остановлены")
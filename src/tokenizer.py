@@ -0,0 +1,41 @@
+from functools import lru_cache
+
+from src.config import MODEL, logger
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken может быть не установлен
+    tiktoken = None
+
+# Служебные токены, которые OpenAI добавляет к каждому сообщению чата
+MESSAGE_OVERHEAD_TOKENS = 4
+# Грубая оценка для случая, когда токенайзер недоступен
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    """Возвращает токенайзер для модели или None, если его не удалось загрузить."""
+    if tiktoken is None:
+        logger.warning("⚠ tiktoken не установлен, токены оцениваются по длине текста")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as exc:
+        logger.warning(f"⚠ Токенайзер недоступен, используется оценка по длине: {exc}")
+        return None
+
+
+def count_tokens(content: str, model: str = MODEL) -> int:
+    """
+    Считает количество токенов, которое сообщение займёт в контексте модели,
+    с учётом служебных токенов сообщения.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        tokens = (len(content) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    else:
+        tokens = len(encoding.encode(content))
+    return tokens + MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_benchmark_smoke_run_delivers_all_messages():
+    """
+    Дымовой прогон benchmarks.run: заглушки брокера и OpenAI должны
+    соответствовать тому, что ждут producer и consumer, иначе сообщения
+    не доставляются (ошибки consumer, TIMED OUT).
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        output = Path(workdir) / "result.json"
+        subprocess.run(
+            [
+                sys.executable, "-m", "benchmarks.run",
+                "--messages", "10", "--concurrency", "5", "--conversations", "5",
+                "--llm-latency", "0", "--token-rate", "10000", "--timeout", "20",
+                "--output", str(output),
+            ],
+            cwd=ROOT, capture_output=True, check=True, timeout=60,
+        )
+        totals = json.loads(output.read_text())["totals"]
+
+    assert totals["consumer_errors"] == 0
+    assert totals["delivery_errors"] == 0
+    assert totals["delivered"] == totals["sent"] == 10
+    assert not totals["timed_out"]
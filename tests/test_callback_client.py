@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from unittest.mock import patch, AsyncMock
+from httpx import Response
+
+from src.callback_client import CallbackClient
+
+
+def make_client(max_per_host: int = 10) -> CallbackClient:
+    return CallbackClient(
+        http2=False,
+        timeout=5,
+        connect_timeout=1,
+        max_connections=10,
+        max_keepalive=5,
+        keepalive_expiry=30,
+        max_per_host=max_per_host,
+    )
+
+
+@pytest.mark.asyncio
+async def test_client_is_reused_and_closed():
+    """
+    Проверяем, что httpx-клиент создаётся один раз, а после close() закрыт.
+    """
+    client = make_client()
+    first = client.start()
+    assert client.start() is first
+    assert first.timeout.connect == 1
+
+    await client.close()
+    assert first.is_closed
+    assert client.start() is not first
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_post_limits_requests_per_host():
+    """
+    Проверяем, что к одному хосту одновременно идёт не больше max_per_host запросов.
+    """
+    client = make_client(max_per_host=2)
+    active = 0
+    max_active = 0
+
+    async def slow_post(*args, **kwargs):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return Response(status_code=200)
+
+    with patch("httpx.AsyncClient.post", new=AsyncMock(side_effect=slow_post)):
+        await asyncio.gather(*(client.post("http://example.com/cb", json={}) for _ in range(6)))
+
+    assert max_active == 2
+    await client.close()
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, call, patch
+
+from src.concurrency import AdaptiveLimiter
+from src.consumer import adjust_prefetch
+
+
+def make_limiter(initial: int = 4) -> AdaptiveLimiter:
+    return AdaptiveLimiter(min_limit=1, max_limit=8, initial_limit=initial, target_latency=1.0, backoff=0.5)
+
+
+def test_limit_grows_additively_and_respects_max():
+    """
+    Проверяем аддитивный рост лимита на быстрых сообщениях и верхнюю границу.
+    """
+    limiter = make_limiter(initial=4)
+    for _ in range(5):
+        limiter.on_success(0.1)
+    assert limiter.limit == 5
+
+    for _ in range(1000):
+        limiter.on_success(0.1)
+    assert limiter.limit == 8
+
+
+def test_limit_decreases_on_overload_once_per_window():
+    """
+    Проверяем мультипликативное снижение при перегрузке и защиту от
+    повторного снижения в пределах одного окна.
+    """
+    limiter = make_limiter(initial=8)
+    limiter.on_overload()
+    assert limiter.limit == 4
+    limiter.on_overload()
+    limiter.on_success(5.0)
+    assert limiter.limit == 4
+
+
+@pytest.mark.asyncio
+async def test_slot_bounds_in_flight():
+    """
+    Проверяем, что одновременно занято не больше limit слотов.
+    """
+    limiter = make_limiter(initial=2)
+    max_seen = 0
+
+    async def work():
+        nonlocal max_seen
+        async with limiter.slot():
+            max_seen = max(max_seen, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(work() for _ in range(6)))
+
+    assert max_seen <= 2
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_adjust_prefetch_sets_channel_wide_qos():
+    """
+    Проверяем, что prefetch выставляется для всего канала (global) сразу
+    и меняется вслед за лимитом, действуя на уже подписанных потребителей.
+    """
+    limiter = make_limiter(initial=4)
+    channel = AsyncMock()
+    with patch("src.consumer.consumer_limiter", limiter), \
+            patch("src.consumer.CONCURRENCY_ADJUST_INTERVAL", 0.01):
+        task = asyncio.create_task(adjust_prefetch(channel))
+        await asyncio.sleep(0.005)
+        limiter.on_overload()
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert channel.set_qos.await_args_list == [
+        call(prefetch_count=4, global_=True),
+        call(prefetch_count=2, global_=True),
+    ]
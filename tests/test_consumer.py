@@ -1,22 +1,34 @@
-import httpx
 import pytest
 import asyncio
+import json
+import os
+import signal
+from contextlib import asynccontextmanager
 from unittest.mock import patch, AsyncMock, MagicMock
-from httpx import Response
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
-from src.config import RABBITMQ_URL, QUEUE_NAME
+from src.config import RABBITMQ_URL, QUEUE_NAME, CONVERSATION_SHARDS, HISTORY_TOKENS_BUDGET, QUEUE_MAX_PRIORITY
 from src.consumer import (
     get_messages_list_as_json,
+    get_history,
+    save_turn,
+    stream_to_callback,
+    compact_dialog,
     process_message,
-    send_answer,
     callback,
     consume,
+    in_flight_callbacks,
+    stream_senders,
+    register_gauges,
+    needs_compaction,
     Role,
 )
-from src.models import InputMessage
+from src.metrics import DB_POOL_CHECKED_OUT
+from src.models import InputMessage, AnswerMessage
 from src.database import DBMessage
+from src.tokenizer import count_tokens
 
 
 @pytest.mark.asyncio
@@ -38,73 +50,318 @@ async def test_get_messages_list_as_json():
 async def test_process_message_success():
     """
     Проверяет, что process_message:
-    1) сохраняет входящее сообщение (user) в БД,
-    2) запрашивает всю историю,
-    3) вызывает get_answer,
-    4) сохраняет ответ (assistant) в БД,
-    5) возвращает ответ.
+    1) запрашивает окно истории своего диалога в пределах бюджета токенов,
+       оставляя место под входящее сообщение,
+    2) вызывает get_answer с историей и входящим сообщением,
+    3) сохраняет входящее сообщение (user) и ответ (assistant) одной вставкой,
+    4) возвращает ответ.
     """
-    input_msg = InputMessage(message="Hi there!", callback_url="http://example.com/")
-
-    mock_insert_message = AsyncMock()
-    mock_get_all_messages = AsyncMock()
-    mock_get_all_messages.return_value = [
+    input_msg = InputMessage(
+        message="Hi there!",
+        callback_url="http://example.com/",
+        conversation_id="dialog-1",
+    )
+
+    mock_insert_messages = AsyncMock()
+    mock_get_history_window = AsyncMock()
+    mock_get_history_window.return_value = [
         DBMessage(id=1, content="Hello", role=Role.user),
         DBMessage(id=2, content="...", role=Role.assistant),
     ]
 
     mock_get_answer = AsyncMock(return_value="Mocked AI reply")
 
-    with patch("src.consumer.insert_message", mock_insert_message), \
-            patch("src.consumer.get_all_messages", mock_get_all_messages), \
+    with patch("src.consumer.insert_messages", mock_insert_messages), \
+            patch("src.consumer.get_history_window", mock_get_history_window), \
+            patch("src.consumer.history_cache.get_window", AsyncMock(return_value=None)), \
+            patch("src.consumer.history_cache.generation", AsyncMock(return_value=None)), \
+            patch("src.consumer.history_cache.rebuild", AsyncMock()), \
+            patch("src.consumer.get_dialog_summary", AsyncMock(return_value=None)), \
+            patch("src.consumer.schedule_compaction") as mock_schedule, \
             patch("src.consumer.get_answer", mock_get_answer):
         mock_session = AsyncMock(spec=AsyncSession)
 
         result = await process_message(mock_session, input_msg)
 
-        mock_insert_message.assert_any_call(
+        mock_get_history_window.assert_awaited_once_with(
             mock_session,
-            input_msg.message,
-            Role.user
+            "dialog-1",
+            HISTORY_TOKENS_BUDGET - count_tokens(input_msg.message),
         )
-        mock_get_all_messages.assert_awaited_once_with(mock_session)
 
-        mock_get_answer.assert_awaited_once()
-        mock_insert_message.assert_any_call(mock_session, "Mocked AI reply", Role.assistant)
+        mock_get_answer.assert_awaited_once_with([
+            {"role": Role.user, "content": "Hello"},
+            {"role": Role.assistant, "content": "..."},
+            {"role": Role.user, "content": "Hi there!"},
+        ])
+        mock_insert_messages.assert_awaited_once_with(mock_session, "dialog-1", [
+            (Role.user, input_msg.message),
+            (Role.assistant, "Mocked AI reply"),
+        ])
+        # Короткий диалог не сжимается: фоновая задача даже не запускается
+        mock_schedule.assert_not_called()
 
-        assert result == "Mocked AI reply"
+        assert result.message == "Mocked AI reply"
+        assert result.conversation_id == "dialog-1"
+        assert result.seq is None
 
 
 @pytest.mark.asyncio
-async def test_send_answer_success():
+async def test_get_history_cache_hit_skips_db():
     """
-    Проверяем успешную отправку ответа через httpx.
+    Проверяет, что при попадании в кэш история не читается из БД.
     """
-    with patch("httpx.AsyncClient.post", new_callable=AsyncMock) as mock_post:
-        mock_post.return_value = Response(status_code=200, json={"ok": True})
+    cached = [{"role": "user", "content": "Hello"}]
+    with patch("src.consumer.history_cache.get_window", AsyncMock(return_value=cached)), \
+            patch("src.consumer.get_history_window", new_callable=AsyncMock) as mock_window:
+        result = await get_history(AsyncMock(spec=AsyncSession), "dialog-1")
 
-        callback_url = "http://example.com/callback"
-        answer_text = "Hello from AI"
-        await send_answer(callback_url, answer_text)
+    assert result == cached
+    mock_window.assert_not_awaited()
 
-        mock_post.assert_awaited_once_with(
-            callback_url,
-            json={"message": answer_text}
-        )
+
+@pytest.mark.asyncio
+async def test_get_history_cache_miss_rebuilds_cache():
+    """
+    Проверяет, что при промахе окно читается из БД и кэш пересобирается.
+    """
+    db_messages = [DBMessage(id=1, content="Hello", role=Role.user, tokens=5)]
+    mock_session = AsyncMock(spec=AsyncSession)
+    summary = DBMessage(id=2, content="Summary", role=Role.system, tokens=7)
+    with patch("src.consumer.history_cache.get_window", AsyncMock(return_value=None)), \
+            patch("src.consumer.history_cache.generation", AsyncMock(return_value="4")), \
+            patch("src.consumer.history_cache.rebuild", new_callable=AsyncMock) as mock_rebuild, \
+            patch("src.consumer.get_dialog_summary", AsyncMock(return_value=summary)), \
+            patch("src.consumer.get_history_window", AsyncMock(return_value=db_messages)) as mock_window:
+        result = await get_history(mock_session, "dialog-1")
+
+    assert result == [{"role": "system", "content": "Summary"}, {"role": "user", "content": "Hello"}]
+    mock_window.assert_awaited_once_with(mock_session, "dialog-1", HISTORY_TOKENS_BUDGET - 7)
+    mock_rebuild.assert_awaited_once_with("dialog-1", db_messages, summary, "4")
+
+
+@pytest.mark.asyncio
+async def test_get_history_from_replica_does_not_rebuild_cache():
+    """
+    Проверяет, что история, прочитанная с реплики, не попадает в кэш:
+    реплика может ещё не содержать последний ход диалога.
+    """
+    replica_session = AsyncMock(spec=AsyncSession)
+    db_messages = [DBMessage(id=1, content="Hello", role=Role.user, tokens=5)]
+
+    @asynccontextmanager
+    async def read_from_replica(conversation_id, primary=None):
+        yield replica_session
+
+    with patch("src.consumer.history_cache.get_window", AsyncMock(return_value=None)), \
+            patch("src.consumer.history_cache.generation", AsyncMock(return_value="4")), \
+            patch("src.consumer.history_cache.rebuild", new_callable=AsyncMock) as mock_rebuild, \
+            patch("src.consumer.get_read_session", read_from_replica), \
+            patch("src.consumer.get_dialog_summary", AsyncMock(return_value=None)), \
+            patch("src.consumer.get_history_window", AsyncMock(return_value=db_messages)) as mock_window:
+        result = await get_history(AsyncMock(spec=AsyncSession), "dialog-1")
+
+    assert result == [{"role": "user", "content": "Hello"}]
+    mock_window.assert_awaited_once_with(replica_session, "dialog-1", HISTORY_TOKENS_BUDGET)
+    mock_rebuild.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_save_turn_uses_batch_writer_when_enabled():
+    """
+    Проверяет, что при WRITE_BATCH_ENABLED ход записывается через пакетный writer.
+    """
+    turn = [(Role.user, "Hi"), (Role.assistant, "Hello")]
+    with patch("src.consumer.WRITE_BATCH_ENABLED", True), \
+            patch("src.consumer.message_writer.write", new_callable=AsyncMock) as mock_write, \
+            patch("src.consumer.insert_messages", new_callable=AsyncMock) as mock_insert:
+        await save_turn(AsyncMock(spec=AsyncSession), "dialog-1", turn)
+
+    mock_write.assert_awaited_once_with("dialog-1", turn)
+    mock_insert.assert_not_awaited()
 
 
 @pytest.mark.asyncio
-async def test_send_answer_failure():
+async def test_stream_to_callback_sends_numbered_frames():
     """
-    Проверяем, что при ошибке в httpx внутри send_answer
-    ошибку логируем, но исключение наружу не пробрасываем.
+    Проверяет, что потоковый ответ уходит кадрами с возрастающим seq,
+    а собранный ответ и номер финального кадра возвращаются для доставки.
     """
-    with patch("httpx.AsyncClient.post", side_effect=httpx.HTTPError("Network error")) as mock_post:
-        callback_url = "http://example.com/callback"
-        answer_text = "Hello from AI"
+    async def fake_stream(_):
+        for delta in ["Hel", "lo", ", wor", "ld"]:
+            yield delta
+
+    input_msg = InputMessage(message="Hi", callback_url="http://example.com/", stream=True)
+    with patch("src.consumer.stream_answer", fake_stream), \
+            patch("src.consumer.STREAM_CHUNK_CHARS", 5), \
+            patch("src.consumer.callback_client.post", new_callable=AsyncMock) as mock_post:
+        answer, final_seq = await stream_to_callback(input_msg, [])
+        await asyncio.gather(*stream_senders)
+
+    assert answer == "Hello, world"
+    assert final_seq == 3
+    assert [c.kwargs["json"] for c in mock_post.await_args_list] == [
+        {"message": "Hello", "seq": 0, "done": False},
+        {"message": ", wor", "seq": 1, "done": False},
+        {"message": "ld", "seq": 2, "done": False},
+    ]
 
-        await send_answer(callback_url, answer_text)
-        mock_post.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_stream_to_callback_does_not_wait_for_slow_callback():
+    """
+    Проверяет, что медленный получатель не задерживает генерацию:
+    пока кадры ждут отправки, текст копится и уходит одним кадром.
+    """
+    async def fake_stream(_):
+        for delta in ["aa", "bb", "cc", "dd", "ee"]:
+            yield delta
+
+    release = asyncio.Event()
+
+    async def slow_post(*_, **__):
+        await release.wait()
+
+    input_msg = InputMessage(message="Hi", callback_url="http://example.com/", stream=True)
+    with patch("src.consumer.stream_answer", fake_stream), \
+            patch("src.consumer.STREAM_CHUNK_CHARS", 2), \
+            patch("src.consumer.STREAM_FRAME_BACKLOG", 1), \
+            patch("src.consumer.callback_client.post", AsyncMock(side_effect=slow_post)) as mock_post:
+        answer, final_seq = await asyncio.wait_for(stream_to_callback(input_msg, []), timeout=1)
+        release.set()
+        await asyncio.gather(*stream_senders)
+
+    assert answer == "aabbccddee"
+    frames = [c.kwargs["json"] for c in mock_post.await_args_list]
+    assert [frame["seq"] for frame in frames] == list(range(final_seq))
+    assert "".join(frame["message"] for frame in frames) == "aabbccddee"
+
+
+@pytest.mark.asyncio
+async def test_stream_to_callback_sends_error_frame_on_failure():
+    """
+    Проверяет, что при ошибке модели посреди потока получатель
+    получает завершающий кадр с ошибкой после уже отправленных кадров.
+    """
+    async def failing_stream(_):
+        yield "Hello"
+        raise RuntimeError("stream broken")
+
+    input_msg = InputMessage(message="Hi", callback_url="http://example.com/", stream=True)
+    with patch("src.consumer.stream_answer", failing_stream), \
+            patch("src.consumer.STREAM_CHUNK_CHARS", 5), \
+            patch("src.consumer.callback_client.post", new_callable=AsyncMock) as mock_post:
+        with pytest.raises(RuntimeError):
+            await stream_to_callback(input_msg, [])
+        await asyncio.gather(*stream_senders)
+
+    assert [c.kwargs["json"] for c in mock_post.await_args_list] == [
+        {"message": "Hello", "seq": 0, "done": False},
+        {"message": "", "seq": 1, "done": True, "error": "Ошибка генерации ответа"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_broken_by_router_is_not_saved_as_full_answer():
+    """
+    Проверяет сквозь настоящий stream_answer, что обрыв потока бэкенда после
+    первого фрагмента не выдаётся за конец ответа: ошибка доходит до
+    stream_to_callback, и получатель получает кадр с ошибкой.
+    """
+    async def failing_stream(_):
+        yield "Hello"
+        raise RuntimeError("stream broken")
+
+    input_msg = InputMessage(message="Hi", callback_url="http://example.com/", stream=True)
+    with patch("src.openai_service.router.stream", failing_stream), \
+            patch("src.consumer.STREAM_CHUNK_CHARS", 5), \
+            patch("src.consumer.callback_client.post", new_callable=AsyncMock) as mock_post:
+        with pytest.raises(RuntimeError):
+            await stream_to_callback(input_msg, [])
+        await asyncio.gather(*stream_senders)
+
+    assert [c.kwargs["json"] for c in mock_post.await_args_list] == [
+        {"message": "Hello", "seq": 0, "done": False},
+        {"message": "", "seq": 1, "done": True, "error": "Ошибка генерации ответа"},
+    ]
+
+
+def mock_session_factory():
+    """Мок get_async_session, отдающий одну и ту же сессию."""
+    session = AsyncMock(spec=AsyncSession)
+    factory = MagicMock()
+    factory.return_value.__aenter__.return_value = session
+    factory.return_value.__aexit__ = AsyncMock(return_value=None)
+    return factory, session
+
+
+def mock_leases(acquired: bool) -> MagicMock:
+    """Блокировки сжатия, которые отдают acquired без обращения к Redis."""
+    leases = MagicMock()
+    leases.hold.return_value.__aenter__ = AsyncMock(return_value=acquired)
+    leases.hold.return_value.__aexit__ = AsyncMock(return_value=None)
+    return leases
+
+
+@pytest.mark.asyncio
+async def test_compact_dialog_below_threshold_does_nothing():
+    """
+    Проверяет, что короткий диалог не сжимается и модель не вызывается.
+    """
+    factory, _ = mock_session_factory()
+    with patch("src.consumer.get_async_session", factory), \
+            patch("src.consumer.compaction_leases", mock_leases(acquired=True)), \
+            patch("src.consumer.count_uncompacted_messages", AsyncMock(return_value=1)), \
+            patch("src.consumer.get_summary", new_callable=AsyncMock) as mock_summary:
+        await compact_dialog("dialog-1")
+
+    mock_summary.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_compact_dialog_folds_new_turns_into_summary():
+    """
+    Проверяет, что в модель уходят предыдущее краткое содержание и новые реплики,
+    а свёрнутые реплики сохраняются вместе с новым содержанием.
+    """
+    factory, session = mock_session_factory()
+    candidates = [
+        DBMessage(id=3, content="Old question", role=Role.user),
+        DBMessage(id=4, content="Old answer", role=Role.assistant),
+    ]
+    previous = DBMessage(id=1, content="Earlier summary", role=Role.system)
+    with patch("src.consumer.get_async_session", factory), \
+            patch("src.consumer.compaction_leases", mock_leases(acquired=True)), \
+            patch("src.consumer.count_uncompacted_messages", AsyncMock(return_value=1000)), \
+            patch("src.consumer.get_compaction_candidates", AsyncMock(return_value=candidates)), \
+            patch("src.consumer.get_dialog_summary", AsyncMock(return_value=previous)), \
+            patch("src.consumer.get_summary", AsyncMock(return_value="New summary")) as mock_summary, \
+            patch("src.consumer.save_dialog_summary", new_callable=AsyncMock) as mock_save:
+        await compact_dialog("dialog-1")
+
+    mock_summary.assert_awaited_once_with("Earlier summary", [
+        {"role": "user", "content": "Old question"},
+        {"role": "assistant", "content": "Old answer"},
+    ])
+    mock_save.assert_awaited_once_with(session, "dialog-1", "New summary", [3, 4])
+
+
+@pytest.mark.asyncio
+async def test_compact_dialog_skips_dialog_locked_by_another_process():
+    """
+    Проверяет, что диалог, который уже сжимает другой процесс, не читается и не сжимается.
+    """
+    factory, _ = mock_session_factory()
+    leases = mock_leases(acquired=False)
+    with patch("src.consumer.get_async_session", factory), \
+            patch("src.consumer.compaction_leases", leases), \
+            patch("src.consumer.count_uncompacted_messages", new_callable=AsyncMock) as mock_count, \
+            patch("src.consumer.get_summary", new_callable=AsyncMock) as mock_summary:
+        await compact_dialog("dialog-1")
+
+    leases.hold.assert_called_once_with("dialog-1")
+    mock_count.assert_not_awaited()
+    mock_summary.assert_not_awaited()
 
 
 @pytest.mark.asyncio
@@ -112,12 +369,13 @@ async def test_callback_handles_process_message_failure():
     json_in = '{"message": "Hi from user", "callback_url": "http://callback.test/"}'
     mock_incoming = MagicMock()
     mock_incoming.body = json_in.encode("utf-8")
+    mock_incoming.message_id = None
 
     mock_incoming.process.return_value.__aenter__.return_value = mock_incoming
     mock_incoming.process.return_value.__aexit__ = AsyncMock()
 
     with patch("src.consumer.process_message", new_callable=AsyncMock) as mock_proc_msg, \
-            patch("src.consumer.send_answer", new_callable=AsyncMock) as mock_snd_ans, \
+            patch("src.consumer.delivery_publisher.publish", new_callable=AsyncMock) as mock_publish, \
             patch("src.consumer.get_async_session", new_callable=MagicMock) as mock_get_session:
         mock_proc_msg.side_effect = Exception("Processing error")
         mock_get_session.return_value.__aenter__.return_value = mock_get_session
@@ -126,7 +384,88 @@ async def test_callback_handles_process_message_failure():
         await callback(mock_incoming)
 
         mock_proc_msg.assert_awaited_once()
-        mock_snd_ans.assert_not_awaited()
+        mock_publish.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_callback_publishes_answer_for_delivery():
+    """
+    Проверяем, что ответ не отправляется на callback_url напрямую,
+    а публикуется в очередь доставки.
+    """
+    json_in = '{"message": "Hi", "callback_url": "http://callback.test/", "conversation_id": "dialog-1"}'
+    mock_incoming = MagicMock()
+    mock_incoming.body = json_in.encode("utf-8")
+    mock_incoming.message_id = None
+    mock_incoming.process.return_value.__aenter__.return_value = mock_incoming
+    mock_incoming.process.return_value.__aexit__ = AsyncMock(return_value=None)
+
+    answer = AnswerMessage(message="AI reply", callback_url="http://callback.test/", conversation_id="dialog-1")
+    with patch("src.consumer.process_message", AsyncMock(return_value=answer)), \
+            patch("src.consumer.delivery_publisher.publish", new_callable=AsyncMock) as mock_publish, \
+            patch("src.consumer.get_async_session", new_callable=MagicMock) as mock_get_session:
+        mock_get_session.return_value.__aenter__.return_value = mock_get_session
+        mock_get_session.return_value.__aexit__ = AsyncMock(return_value=None)
+
+        await callback(mock_incoming)
+
+    mock_publish.assert_awaited_once_with(answer)
+
+
+@pytest.mark.asyncio
+async def test_callback_replays_stored_answer_on_redelivery():
+    """
+    Проверяем, что на повторно доставленное сообщение с message_id
+    публикуется сохранённый ответ, а модель и БД не вызываются.
+    """
+    json_in = json.dumps(
+        {"message": "Hi", "callback_url": "http://callback.test/", "conversation_id": "dialog-1", "message_id": "m1"}
+    )
+    mock_incoming = MagicMock()
+    mock_incoming.body = json_in.encode("utf-8")
+    mock_incoming.message_id = None
+    mock_incoming.process.return_value.__aenter__.return_value = mock_incoming
+    mock_incoming.process.return_value.__aexit__ = AsyncMock(return_value=None)
+
+    answer = AnswerMessage(message="AI reply", callback_url="http://callback.test/", conversation_id="dialog-1")
+    with patch("src.consumer.idempotency_store.get_answer", AsyncMock(return_value=answer)) as mock_get_answer, \
+            patch("src.consumer.process_message", new_callable=AsyncMock) as mock_proc_msg, \
+            patch("src.consumer.delivery_publisher.publish", new_callable=AsyncMock) as mock_publish, \
+            patch("src.consumer.get_async_session", new_callable=MagicMock) as mock_get_session:
+        await callback(mock_incoming)
+
+    assert mock_get_answer.await_args.args[0].message_id == "m1"
+    mock_proc_msg.assert_not_awaited()
+    mock_get_session.assert_not_called()
+    mock_publish.assert_awaited_once_with(answer)
+
+
+@pytest.mark.asyncio
+async def test_callback_keys_redelivery_on_amqp_message_id():
+    """
+    Проверяем, что сообщение без клиентского message_id узнаётся при повторной
+    доставке по AMQP message_id, а клиентский идентификатор важнее AMQP.
+    """
+    answer = AnswerMessage(message="AI reply", callback_url="http://callback.test/", conversation_id="dialog-1")
+    keys = []
+    for client_id in (None, "m1"):
+        fields = {"message": "Hi", "callback_url": "http://callback.test/", "conversation_id": "dialog-1"}
+        mock_incoming = MagicMock()
+        mock_incoming.body = json.dumps({**fields, "message_id": client_id}).encode("utf-8")
+        mock_incoming.message_id = "amqp-1"
+        mock_incoming.process.return_value.__aenter__.return_value = mock_incoming
+        mock_incoming.process.return_value.__aexit__ = AsyncMock(return_value=None)
+
+        with patch("src.consumer.idempotency_store.get_answer", AsyncMock(return_value=answer)) as mock_get_answer, \
+                patch("src.consumer.process_message", new_callable=AsyncMock) as mock_proc_msg, \
+                patch("src.consumer.delivery_publisher.publish", new_callable=AsyncMock) as mock_publish:
+            await callback(mock_incoming)
+
+        keys.append(mock_get_answer.await_args.args[0].message_id)
+        mock_proc_msg.assert_not_awaited()
+        mock_publish.assert_awaited_once_with(answer)
+
+    assert keys == ["amqp-1", "m1"]
 
 
 @pytest.mark.asyncio
@@ -141,6 +480,7 @@ async def test_consume_partial():
     mock_queue = AsyncMock()
 
     with patch("src.consumer.create_tables", new_callable=AsyncMock) as mock_tables, \
+            patch("src.consumer.delivery_publisher.setup", new_callable=AsyncMock) as mock_setup, \
             patch("aio_pika.connect_robust", return_value=mock_connection) as mock_connect:
         mock_connection.channel.return_value = mock_channel
         mock_channel.declare_queue.return_value = mock_queue
@@ -151,5 +491,116 @@ async def test_consume_partial():
         mock_tables.assert_awaited_once()
 
         mock_connect.assert_awaited_once_with(RABBITMQ_URL)
-        mock_channel.declare_queue.assert_called_once_with(QUEUE_NAME, durable=True)
-        mock_queue.consume.assert_awaited_once()
+        mock_setup.assert_awaited_once_with(mock_connection)
+        mock_channel.declare_queue.assert_any_call(QUEUE_NAME, durable=True)
+        mock_channel.declare_queue.assert_any_call(
+            f"{QUEUE_NAME}.0",
+            durable=True,
+            arguments={"x-single-active-consumer": True, "x-max-priority": QUEUE_MAX_PRIORITY},
+        )
+        assert mock_queue.consume.await_count == CONVERSATION_SHARDS + 1
+
+
+@pytest.mark.asyncio
+async def test_consume_reads_only_worker_shards():
+    """
+    Проверка: воркер читает только свои шарды (index % workers == worker)
+    и общую очередь QUEUE_NAME.
+    """
+    mock_connection = AsyncMock()
+    mock_channel = AsyncMock()
+    queues = {}
+
+    async def declare_queue(name, **_):
+        return queues.setdefault(name, AsyncMock(name=name))
+
+    with patch("src.consumer.create_tables", new_callable=AsyncMock), \
+            patch("src.consumer.delivery_publisher.setup", new_callable=AsyncMock), \
+            patch("src.consumer.CONVERSATION_SHARDS", 4), \
+            patch("aio_pika.connect_robust", return_value=mock_connection):
+        mock_connection.channel.return_value = mock_channel
+        mock_channel.declare_queue.side_effect = declare_queue
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(consume(metrics_port=0, worker=1, workers=2), timeout=0.1)
+
+    consumed = sorted(name for name, queue in queues.items() if queue.consume.await_count)
+    assert consumed == sorted([QUEUE_NAME, f"{QUEUE_NAME}.1", f"{QUEUE_NAME}.3"])
+    assert len(queues) == 5
+
+
+@pytest.mark.asyncio
+async def test_consume_drains_on_sigterm():
+    """
+    Проверка: по SIGTERM consume отменяет подписки на очереди,
+    дожидается сообщений в обработке и завершается.
+    """
+    mock_connection = AsyncMock()
+    mock_channel = AsyncMock()
+    mock_queue = AsyncMock()
+    mock_queue.consume.return_value = "ctag"
+    finished = []
+
+    async def in_flight():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+
+    with patch("src.consumer.create_tables", new_callable=AsyncMock), \
+            patch("src.consumer.delivery_publisher.setup", new_callable=AsyncMock), \
+            patch("aio_pika.connect_robust", return_value=mock_connection):
+        mock_connection.channel.return_value = mock_channel
+        mock_channel.declare_queue.return_value = mock_queue
+
+        task = asyncio.create_task(consume(metrics_port=0))
+        while mock_queue.consume.await_count < CONVERSATION_SHARDS + 1:
+            await asyncio.sleep(0.01)
+        processing = asyncio.create_task(in_flight())
+        in_flight_callbacks.add(processing)
+        processing.add_done_callback(in_flight_callbacks.discard)
+
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(task, timeout=1)
+
+    assert finished == [True]
+    assert mock_queue.cancel.await_count == CONVERSATION_SHARDS + 1
+    mock_queue.cancel.assert_awaited_with("ctag")
+
+
+@pytest.mark.asyncio
+async def test_register_gauges_with_null_pool():
+    """
+    Проверяет, что с NullPool (DB_POOL_SIZE=0) consumer стартует без метрики
+    занятых соединений, а с обычным пулом метрика считается при чтении.
+    """
+    null_engine = create_async_engine("sqlite+aiosqlite://", poolclass=NullPool)
+    pooled_engine = create_async_engine("sqlite+aiosqlite://", poolclass=AsyncAdaptedQueuePool)
+    try:
+        with patch("src.consumer.engine", null_engine), \
+                patch.object(DB_POOL_CHECKED_OUT, "set_function") as mock_set:
+            register_gauges()
+        mock_set.assert_not_called()
+
+        with patch("src.consumer.engine", pooled_engine), \
+                patch.object(DB_POOL_CHECKED_OUT, "set_function") as mock_set:
+            register_gauges()
+            assert mock_set.call_args.args[0]() == 0
+    finally:
+        await null_engine.dispose()
+        await pooled_engine.dispose()
+
+
+def test_needs_compaction_only_for_long_windows():
+    """
+    Проверяет, что сжатие планируется, только когда окно истории длиннее
+    COMPACTION_THRESHOLD реплик или почти заняло бюджет токенов.
+    """
+    short = [{"role": Role.system, "content": "Summary"}, {"role": Role.user, "content": "Hi"}]
+    many = [{"role": Role.user, "content": "Hi"}] * 5
+    with patch("src.consumer.COMPACTION_THRESHOLD", 5), \
+            patch("src.consumer.HISTORY_TOKENS_BUDGET", 1000), \
+            patch("src.consumer.count_tokens", len):
+        assert not needs_compaction(short)
+        assert needs_compaction(many)
+        # 600 токенов + реплика среднего размера (300) ещё помещаются в 1000, 900 + 300 — уже нет
+        assert not needs_compaction([{"role": Role.user, "content": "x" * 300}] * 2)
+        assert needs_compaction([{"role": Role.user, "content": "x" * 300}] * 3)
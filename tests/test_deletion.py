@@ -0,0 +1,144 @@
+import asyncio
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.database import Base, Role, insert_messages, get_all_messages
+from src.deletion import DeletionJobs
+
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+
+
+def make_jobs(**kwargs) -> tuple[DeletionJobs, dict]:
+    """DeletionJobs с Redis в словаре: ключ -> поля задачи или список."""
+    store: dict[str, dict | list] = {}
+
+    async def hset(key, mapping):
+        store.setdefault(key, {}).update(mapping)
+
+    async def hgetall(key):
+        return dict(store.get(key, {}))
+
+    async def rpush(key, value):
+        store.setdefault(key, []).append(value)
+
+    async def lmove(source, destination, src_side, dest_side):
+        if not store.get(source):
+            return None
+        value = store[source].pop(-1 if src_side == "RIGHT" else 0)
+        destination_list = store.setdefault(destination, [])
+        destination_list.insert(0 if dest_side == "LEFT" else len(destination_list), value)
+        return value
+
+    async def blmove(source, destination, timeout, src_side, dest_side):
+        return await lmove(source, destination, src_side, dest_side)
+
+    async def lrem(key, count, value):
+        store[key].remove(value)
+
+    jobs = DeletionJobs(**kwargs)
+    jobs._redis = MagicMock()
+    jobs._redis.hset = AsyncMock(side_effect=hset)
+    jobs._redis.hgetall = AsyncMock(side_effect=hgetall)
+    jobs._redis.expire = AsyncMock()
+    jobs._redis.rpush = AsyncMock(side_effect=rpush)
+    jobs._redis.lmove = AsyncMock(side_effect=lmove)
+    jobs._redis.blmove = AsyncMock(side_effect=blmove)
+    jobs._redis.lrem = AsyncMock(side_effect=lrem)
+    return jobs, store
+
+
+@pytest.mark.asyncio
+async def test_dialog_deletion_runs_in_batches_and_reports_progress():
+    """
+    Проверяем, что задача удаляет только сообщения диалога пачками,
+    отмечает прогресс после каждой пачки и завершается статусом done.
+    """
+    engine = create_async_engine(TEST_DATABASE_URL, echo=False)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+        @asynccontextmanager
+        async def get_session():
+            async with SessionLocal() as session:
+                yield session
+
+        async with get_session() as session:
+            await insert_messages(session, "a", [(Role.user, str(i)) for i in range(5)])
+            await insert_messages(session, "b", [(Role.user, "keep")])
+
+        jobs, store = make_jobs(batch_size=2, pause=0)
+        progress = []
+        original_update = jobs._update
+
+        async def track(job_id, **fields):
+            if "deleted" in fields:
+                progress.append(fields["deleted"])
+            await original_update(job_id, **fields)
+
+        with patch("src.database.get_async_session", get_session), \
+                patch("src.deletion.history_cache", MagicMock(invalidate=AsyncMock())) as mock_cache, \
+                patch.object(jobs, "_update", side_effect=track):
+            job_id = await jobs.start("a")
+            assert (await jobs.get(job_id))["status"] == "pending"
+            assert await jobs.run_next() is True
+            job = await jobs.get(job_id)
+
+        assert store[jobs.queue_key] == [] and store[jobs.processing_key] == []
+        assert job["status"] == "done"
+        assert job["deleted"] == 5
+        assert job["conversation_id"] == "a"
+        assert progress == [0, 2, 4, 5]
+        mock_cache.invalidate.assert_awaited_once_with("a")
+        async with get_session() as session:
+            assert [m.conversation_id for m in await get_all_messages(session)] == ["b"]
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_failed_deletion_is_reported():
+    """
+    Проверяем, что ошибка очистки таблицы отражается в статусе задачи.
+    """
+    jobs, store = make_jobs()
+    with patch("src.deletion.get_async_session", MagicMock()), \
+            patch("src.deletion.delete_all_messages", new=AsyncMock(side_effect=Exception("DB Error"))):
+        await jobs.run("job-1", None)
+
+    assert store[jobs.key("job-1")]["status"] == "failed"
+    assert store[jobs.key("job-1")]["error"] == "DB Error"
+    assert await jobs.get("unknown") is None
+
+
+@pytest.mark.asyncio
+async def test_serve_resumes_interrupted_jobs():
+    """
+    Проверяем, что задачи, прерванные остановкой сервиса (оставшиеся
+    в processing), при запуске serve() возвращаются в очередь раньше новых
+    и выполняются, а задача без сохранённого статуса пропускается.
+    """
+    jobs, store = make_jobs()
+    store[jobs.processing_key] = ["interrupted"]
+    store[jobs.key("interrupted")] = {"conversation_id": "a", "status": "interrupted"}
+    store[jobs.queue_key] = ["expired"]
+    new_job = await jobs.start(None)
+    runs = []
+
+    async def run(job_id, conversation_id):
+        runs.append((job_id, conversation_id))
+        if len(runs) == 2:
+            raise asyncio.CancelledError
+
+    with patch.object(jobs, "run", side_effect=run):
+        with pytest.raises(asyncio.CancelledError):
+            await jobs.serve()
+
+    assert runs == [("interrupted", "a"), (new_job, None)]
+    # Прерванная задача остаётся в processing до следующего запуска
+    assert store[jobs.processing_key] == [new_job]
+    assert store[jobs.queue_key] == []
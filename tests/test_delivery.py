@@ -0,0 +1,137 @@
+import httpx
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from httpx import Response
+
+from src.config import DELIVERY_QUEUE_NAME, DELIVERY_RETRY_DELAYS
+from src.delivery import (
+    send_answer,
+    deliver,
+    declare_delivery_queues,
+    retry_queue_name,
+    DEAD_QUEUE_NAME,
+    ATTEMPT_HEADER,
+)
+
+
+@pytest.mark.asyncio
+async def test_send_answer_success():
+    """
+    Проверяем успешную отправку ответа через httpx.
+    """
+    with patch("httpx.AsyncClient.post", new_callable=AsyncMock) as mock_post:
+        mock_post.return_value = Response(status_code=200, json={"ok": True})
+
+        callback_url = "http://example.com/callback"
+        answer_text = "Hello from AI"
+        assert await send_answer(callback_url, answer_text) is True
+
+        mock_post.assert_awaited_once_with(
+            callback_url,
+            json={"message": answer_text}
+        )
+
+
+@pytest.mark.asyncio
+async def test_send_answer_failure():
+    """
+    Проверяем, что при ошибке в httpx внутри send_answer
+    ошибку логируем, но исключение наружу не пробрасываем.
+    """
+    with patch("httpx.AsyncClient.post", side_effect=httpx.HTTPError("Network error")) as mock_post:
+        callback_url = "http://example.com/callback"
+        answer_text = "Hello from AI"
+
+        assert await send_answer(callback_url, answer_text) is False
+        mock_post.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_send_answer_stream_final_frame():
+    """
+    Проверяем, что финальный кадр потокового ответа несёт seq и done.
+    """
+    with patch("httpx.AsyncClient.post", new_callable=AsyncMock) as mock_post:
+        mock_post.return_value = Response(status_code=200)
+        await send_answer("http://example.com/callback", "Full answer", seq=3)
+
+    mock_post.assert_awaited_once_with(
+        "http://example.com/callback",
+        json={"message": "Full answer", "seq": 3, "done": True},
+    )
+
+
+@pytest.mark.asyncio
+async def test_declare_delivery_queues():
+    """
+    Проверяем, что очереди задержки возвращают сообщения в очередь доставки по TTL.
+    """
+    channel = AsyncMock()
+    await declare_delivery_queues(channel)
+
+    channel.declare_queue.assert_any_call(DELIVERY_QUEUE_NAME, durable=True)
+    channel.declare_queue.assert_any_call(DEAD_QUEUE_NAME, durable=True)
+    channel.declare_queue.assert_any_call(
+        retry_queue_name(1),
+        durable=True,
+        arguments={
+            "x-message-ttl": DELIVERY_RETRY_DELAYS[0] * 1000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": DELIVERY_QUEUE_NAME,
+        },
+    )
+
+
+def make_incoming(attempt: int) -> MagicMock:
+    """Мок входящего сообщения очереди доставки."""
+    incoming = MagicMock()
+    incoming.body = b'{"message": "Hi", "callback_url": "http://callback.test/", "conversation_id": "d"}'
+    incoming.headers = {ATTEMPT_HEADER: attempt}
+    incoming.process.return_value.__aenter__.return_value = incoming
+    incoming.process.return_value.__aexit__ = AsyncMock(return_value=None)
+    return incoming
+
+
+@pytest.mark.asyncio
+async def test_deliver_success_does_not_republish():
+    with patch("src.delivery.send_answer", AsyncMock(return_value=True)), \
+            patch("src.delivery.delivery_publisher.publish", new_callable=AsyncMock) as mock_publish:
+        await deliver(make_incoming(0))
+
+    mock_publish.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_deliver_failure_goes_to_retry_then_dead_queue():
+    """
+    Проверяем, что неудачная доставка уходит в очередь задержки следующей попытки,
+    а после исчерпания попыток — в очередь недоставленных.
+    """
+    with patch("src.delivery.send_answer", AsyncMock(return_value=False)), \
+            patch("src.delivery.delivery_publisher.publish", new_callable=AsyncMock) as mock_publish:
+        await deliver(make_incoming(0))
+        answer, attempt, queue_name = mock_publish.await_args.args
+        assert (attempt, queue_name) == (1, retry_queue_name(1))
+        assert answer.message == "Hi"
+
+        last_attempt = len(DELIVERY_RETRY_DELAYS)
+        await deliver(make_incoming(last_attempt))
+        _, attempt, queue_name = mock_publish.await_args.args
+        assert (attempt, queue_name) == (last_attempt, DEAD_QUEUE_NAME)
+
+
+@pytest.mark.asyncio
+async def test_deliver_moves_malformed_message_to_dead_queue():
+    """
+    Проверяем, что некорректное сообщение не отправляется и не возвращается
+    в очередь доставки, а переносится как есть в очередь недоставленных.
+    """
+    incoming = make_incoming(0)
+    incoming.body = b'{"message": "Hi"}'
+    with patch("src.delivery.send_answer", new_callable=AsyncMock) as mock_send, \
+            patch("src.delivery.delivery_publisher.publish_body", new_callable=AsyncMock) as mock_publish:
+        await deliver(incoming)
+
+    mock_send.assert_not_awaited()
+    mock_publish.assert_awaited_once_with(b'{"message": "Hi"}', 0, DEAD_QUEUE_NAME)
+    incoming.process.assert_called_once_with(requeue=True)
@@ -0,0 +1,142 @@
+import json
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.database import DBMessage, Role
+from src.history_cache import HistoryCache
+
+
+def make_cache(execute_result=None, execute_error=None) -> tuple[HistoryCache, MagicMock]:
+    """Создаёт кэш с замоканным pipeline Redis."""
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=execute_result, side_effect=execute_error)
+    pipe.watch = AsyncMock()
+    client = MagicMock()
+    client.pipeline.return_value.__aenter__.return_value = pipe
+    client.pipeline.return_value.__aexit__ = AsyncMock(return_value=None)
+
+    cache = HistoryCache(size=3, ttl=60)
+    cache._redis = client
+    return cache, pipe
+
+
+def entry(role: str, content: str, tokens: int) -> str:
+    return json.dumps({"role": role, "content": content, "tokens": tokens})
+
+
+@pytest.mark.asyncio
+async def test_get_window_respects_budget():
+    """
+    Проверяет, что из кэша берутся только свежие сообщения в пределах бюджета.
+    """
+    entries = [entry("user", "first", 10), entry("assistant", "second", 10), entry("user", "third", 10)]
+    cache, pipe = make_cache(execute_result=[entries, None, True, True])
+
+    window = await cache.get_window("dialog-1", token_budget=20)
+
+    assert window == [
+        {"role": "assistant", "content": "second"},
+        {"role": "user", "content": "third"},
+    ]
+    pipe.expire.assert_any_call("history:dialog-1", 60)
+
+
+@pytest.mark.asyncio
+async def test_get_window_prepends_summary():
+    """
+    Проверяет, что краткое содержание идёт первым и занимает часть бюджета.
+    """
+    entries = [entry("user", "first", 10), entry("assistant", "second", 10), entry("user", "third", 10)]
+    summary = entry("system", "summary", 10)
+    cache, _ = make_cache(execute_result=[entries, summary, True, True])
+
+    window = await cache.get_window("dialog-1", token_budget=30)
+
+    assert window == [
+        {"role": "system", "content": "summary"},
+        {"role": "assistant", "content": "second"},
+        {"role": "user", "content": "third"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_window_miss_and_failure_return_none():
+    """
+    Проверяет, что пустой ключ и ошибка Redis считаются промахом.
+    """
+    cache, _ = make_cache(execute_result=[[], None, False, False])
+    assert await cache.get_window("dialog-1", token_budget=100) is None
+
+    cache, _ = make_cache(execute_error=ConnectionError("redis down"))
+    assert await cache.get_window("dialog-1", token_budget=100) is None
+
+
+@pytest.mark.asyncio
+async def test_append_only_extends_cached_dialog():
+    """
+    Проверяет, что append использует RPUSHX и обрезает список до размера кэша.
+    """
+    cache, pipe = make_cache(execute_result=[1, True, True])
+
+    await cache.append("dialog-1", [
+        DBMessage(content="Hello", role=Role.user, tokens=5),
+        DBMessage(content="Hi", role=Role.assistant, tokens=3),
+    ])
+
+    pipe.rpushx.assert_called_once_with(
+        "history:dialog-1",
+        entry("user", "Hello", 5),
+        entry("assistant", "Hi", 3),
+    )
+    pipe.ltrim.assert_called_once_with("history:dialog-1", -3, -1)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_keeps_last_messages():
+    """
+    Проверяет, что при пересборке в кэш попадают только последние size сообщений.
+    """
+    cache, pipe = make_cache(execute_result=[1, 3, True])
+    pipe.get = AsyncMock(return_value=None)
+    messages = [DBMessage(content=f"m{i}", role=Role.user, tokens=1) for i in range(5)]
+
+    await cache.rebuild("dialog-1", messages)
+
+    pipe.delete.assert_called_once_with("history:dialog-1", "history:dialog-1:summary")
+    pipe.set.assert_not_called()
+    pushed = pipe.rpush.call_args.args[1:]
+    assert [json.loads(item)["content"] for item in pushed] == ["m2", "m3", "m4"]
+
+
+@pytest.mark.asyncio
+async def test_rebuild_skips_when_dialog_changed_since_snapshot():
+    """
+    Проверяет, что пересборка из устаревшего снимка БД не затирает
+    запись, сделанную после чтения поколения.
+    """
+    cache, pipe = make_cache()
+    pipe.get = AsyncMock(return_value="5")
+    messages = [DBMessage(content="m0", role=Role.user, tokens=1)]
+
+    await cache.rebuild("dialog-1", messages, generation="4")
+
+    pipe.watch.assert_awaited_once_with("history:dialog-1:generation")
+    pipe.multi.assert_not_called()
+    pipe.delete.assert_not_called()
+    pipe.execute.assert_not_awaited()
+
+    await cache.rebuild("dialog-1", messages, generation="5")
+    pipe.multi.assert_called_once()
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_append_and_invalidate_bump_generation():
+    cache, pipe = make_cache(execute_result=[1, True, True, 2, True])
+
+    await cache.append("dialog-1", [DBMessage(content="Hello", role=Role.user, tokens=5)])
+    await cache.invalidate("dialog-1")
+
+    assert pipe.incr.call_count == 2
+    pipe.incr.assert_called_with("history:dialog-1:generation")
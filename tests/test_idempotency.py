@@ -0,0 +1,97 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src.idempotency import IdempotencyStore
+from src.models import InputMessage, AnswerMessage
+
+
+def make_store() -> tuple[IdempotencyStore, dict]:
+    """IdempotencyStore с Redis в словаре: ключ -> значение."""
+    data: dict[str, str] = {}
+    queued: list = []
+
+    async def set_(key, value, nx=False, ex=None):
+        if nx and key in data:
+            return None
+        data[key] = str(value)
+        return True
+
+    async def get(key):
+        return data.get(key)
+
+    async def delete(*keys):
+        for key in keys:
+            data.pop(key, None)
+
+    async def execute():
+        results = [await set_(*args, **kwargs) for args, kwargs in queued]
+        queued.clear()
+        return results
+
+    pipe = MagicMock()
+    pipe.set = lambda *args, **kwargs: queued.append((args, kwargs))
+    pipe.execute = AsyncMock(side_effect=execute)
+
+    store = IdempotencyStore(ttl=60)
+    store._redis = MagicMock()
+    store._redis.pipeline.return_value.__aenter__ = AsyncMock(return_value=pipe)
+    store._redis.pipeline.return_value.__aexit__ = AsyncMock(return_value=None)
+    store._redis.set = AsyncMock(side_effect=set_)
+    store._redis.get = AsyncMock(side_effect=get)
+    store._redis.delete = AsyncMock(side_effect=delete)
+    return store, data
+
+
+def make_message(message_id: str | None, conversation_id: str = "dialog") -> InputMessage:
+    return InputMessage(
+        message="Hi",
+        callback_url="http://callback.test/",
+        conversation_id=conversation_id,
+        message_id=message_id,
+    )
+
+
+@pytest.mark.asyncio
+async def test_claim_rejects_repeated_message_ids():
+    """
+    Проверяем, что идентификатор занимается один раз (в том числе внутри
+    пакета), действует в пределах диалога, а сообщения без него всегда новые.
+    """
+    store, _ = make_store()
+
+    assert await store.claim(make_message("m1"))
+    assert not await store.claim(make_message("m1"))
+    assert await store.claim(make_message("m1", conversation_id="other"))
+    assert await store.claim_many([
+        make_message("m2"), make_message(None), make_message("m2"), make_message("m1"),
+    ]) == [True, True, False, False]
+
+    await store.release(make_message("m1"))
+    assert await store.claim(make_message("m1"))
+
+
+@pytest.mark.asyncio
+async def test_claim_fails_open_when_redis_is_down():
+    store = IdempotencyStore()
+    store._redis = MagicMock()
+    store._redis.pipeline.side_effect = ConnectionError("down")
+    store._redis.get = AsyncMock(side_effect=ConnectionError("down"))
+
+    assert await store.claim_many([make_message("m1"), make_message(None)]) == [True, True]
+    assert await store.get_answer(make_message("m1")) is None
+
+
+@pytest.mark.asyncio
+async def test_saved_answer_is_returned_for_the_same_message():
+    store, data = make_store()
+    message = make_message("m1")
+    answer = AnswerMessage(message="AI reply", callback_url="http://callback.test/", conversation_id="dialog", seq=3)
+
+    assert await store.get_answer(message) is None
+    await store.save_answer(message, answer)
+    await store.save_answer(make_message(None), answer)
+
+    assert await store.get_answer(message) == answer
+    assert await store.get_answer(make_message("m2")) is None
+    assert list(data) == [store.answer_key(message)]
@@ -0,0 +1,68 @@
+import json
+import logging
+import logging.handlers
+import sys
+
+from unittest.mock import patch
+
+import src.config as config
+from src.config import JsonFormatter, log_payload, logger
+
+
+def test_json_formatter_outputs_one_json_object_per_record():
+    """
+    Проверяем, что JSON-формат содержит уровень, сообщение, поля extra и исключение.
+    """
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logger.makeRecord(
+            "onAI", logging.ERROR, __file__, 1, "Диалог %s", ("dialog-1",), sys.exc_info(),
+            extra={"conversation_id": "dialog-1"},
+        )
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "ERROR"
+    assert entry["message"] == "Диалог dialog-1"
+    assert entry["conversation_id"] == "dialog-1"
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_log_payload_is_lazy_truncated_and_sampled():
+    """
+    Проверяем, что дамп не сериализуется без DEBUG, обрезается до
+    LOG_PAYLOAD_MAX_CHARS и пропускается при нулевой доле выборки.
+    """
+    payload = [{"role": "user", "content": "x" * 100}]
+
+    with patch.object(logger, "isEnabledFor", return_value=False), \
+            patch("src.config.json.dumps") as mock_dumps, \
+            patch.object(logger, "debug") as mock_debug:
+        log_payload("История", payload)
+    mock_dumps.assert_not_called()
+    mock_debug.assert_not_called()
+
+    with patch.object(logger, "isEnabledFor", return_value=True), \
+            patch.object(config, "LOG_PAYLOAD_MAX_CHARS", 10), \
+            patch.object(logger, "debug") as mock_debug:
+        log_payload("История", payload)
+    _, title, text = mock_debug.call_args.args
+    assert title == "История"
+    assert text.startswith('[{"role": ')
+    assert len(text.split("…")[0]) == 10
+
+    with patch.object(logger, "isEnabledFor", return_value=True), \
+            patch.object(config, "LOG_PAYLOAD_SAMPLE_RATE", 0), \
+            patch.object(logger, "debug") as mock_debug:
+        log_payload("История", payload)
+    mock_debug.assert_not_called()
+
+
+def test_logger_writes_through_queue_handler():
+    """
+    Проверяем, что записи уходят через QueueHandler, а не пишутся на диск в вызывающем потоке.
+    """
+    assert any(isinstance(handler, logging.handlers.QueueHandler) for handler in logging.getLogger().handlers)
+    assert not any(type(handler) is logging.FileHandler for handler in logging.getLogger().handlers)
+    assert not logger.handlers
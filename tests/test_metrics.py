@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from src.metrics import Counter, Gauge, Histogram, Registry, registry, start_metrics_server
+from src.producer import app
+
+
+def test_registry_renders_prometheus_text():
+    """
+    Проверяем текстовый формат: HELP/TYPE, метки, кумулятивные корзины,
+    сумму и количество наблюдений гистограммы, вычисляемый gauge.
+    """
+    test_registry = Registry()
+    counter = test_registry.register(Counter("test_total", "Счётчик", ("kind",)))
+    histogram = test_registry.register(Histogram("test_seconds", "Задержка", buckets=(0.1, 1)))
+    gauge = test_registry.register(Gauge("test_in_flight", "В обработке"))
+
+    counter.inc(kind="a")
+    counter.inc(2, kind="a")
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    gauge.set_function(lambda: 7)
+
+    text = test_registry.render()
+    assert "# TYPE test_total counter" in text
+    assert 'test_total{kind="a"} 3.0' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1.0"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 2' in text
+    assert "test_seconds_sum 0.55" in text
+    assert "test_seconds_count 2" in text
+    assert "test_in_flight 7.0" in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_server_serves_registry():
+    """
+    Проверяем, что HTTP-сервер consumer отдаёт метрики по GET /metrics
+    и 404 на другие пути.
+    """
+    probe = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+    port = probe.sockets[0].getsockname()[1]
+    probe.close()
+    await probe.wait_closed()
+
+    server = await start_metrics_server("127.0.0.1", port)
+    try:
+        async with AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            response = await client.get("/metrics")
+            missing = await client.get("/other")
+    finally:
+        server.close()
+
+    assert response.status_code == 200
+    assert "# TYPE onai_queue_wait_seconds histogram" in response.text
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_producer_metrics_endpoint():
+    """
+    Проверяем /metrics у producer и учёт времени HTTP-запросов по шаблону пути.
+    """
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await client.get("/metrics")
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'onai_http_request_seconds_count{path="/metrics",status="200"}' in response.text
+    assert registry.render().startswith("# HELP")
+
+
+def test_histogram_quantile_interpolates_buckets():
+    """
+    Проверяем оценку квантиля по корзинам с фильтром по меткам.
+    """
+    histogram = Histogram("test_quantile_seconds", "Задержка", ("operation",), buckets=(1, 2))
+    for value in (0.5, 1.5, 1.5, 1.5):
+        histogram.observe(value, operation="read")
+    histogram.observe(10, operation="write")
+
+    assert histogram.count(operation="read") == 4
+    assert histogram.quantile(0.25, operation="read") == 1.0
+    assert histogram.quantile(0.5, operation="read") == pytest.approx(1 + 1 / 3)
+    assert histogram.quantile(0.5, operation="write") == 2.0
+    assert histogram.quantile(0.5, operation="delete") is None
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.model_router import Backend, ModelRouter
+
+
+def make_backend(name: str, create) -> Backend:
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(side_effect=create)
+    return Backend(name, client, f"model-{name}")
+
+
+def response(content: str) -> MagicMock:
+    result = MagicMock()
+    result.choices[0].message.content = content
+    return result
+
+
+@pytest.mark.asyncio
+async def test_router_prefers_fastest_healthy_backend():
+    """
+    Проверяем, что запрос уходит бэкенду с меньшей EWMA задержки,
+    а бэкенд с частыми ошибками пропускается до истечения cooldown.
+    """
+    slow = make_backend("slow", lambda **_: response("slow"))
+    fast = make_backend("fast", lambda **_: response("fast"))
+    broken = make_backend("broken", lambda **_: response("broken"))
+    slow.record_success(2.0)
+    fast.record_success(0.5)
+    broken.record_success(0.1)
+    for _ in range(5):
+        broken.record_failure()
+    router = ModelRouter([slow, fast, broken], error_threshold=0.5, cooldown=60, hedge=False)
+
+    assert [backend.name for backend in router.ranked()] == ["fast", "slow", "broken"]
+    result = await router.complete([{"role": "user", "content": "Hi"}])
+
+    assert result.choices[0].message.content == "fast"
+    assert fast.client.chat.completions.create.await_args.kwargs["model"] == "model-fast"
+    slow.client.chat.completions.create.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_router_fails_over_to_next_backend():
+    """
+    Проверяем, что ошибка бэкенда переводит запрос на следующий
+    и увеличивает долю ошибок упавшего.
+    """
+    def fail(**_):
+        raise RuntimeError("upstream error")
+
+    first = make_backend("first", fail)
+    second = make_backend("second", lambda **_: response("second"))
+    errors = []
+    router = ModelRouter([first, second], hedge=False, on_error=errors.append)
+
+    result = await router.complete([{"role": "user", "content": "Hi"}])
+
+    assert result.choices[0].message.content == "second"
+    assert first.error_ewma > 0
+    assert second.latency_ewma is not None
+    # Ошибка попытки видна, даже если запрос в итоге обслужил другой бэкенд
+    assert [str(error) for error in errors] == ["upstream error"]
+    assert router.models == "model-first,model-second"
+
+
+@pytest.mark.asyncio
+async def test_router_hedges_slow_request_and_cancels_loser():
+    """
+    Проверяем, что при задержке дольше p95 отправляется хедж-запрос
+    к следующему бэкенду, а проигравший запрос отменяется.
+    """
+    cancelled = asyncio.Event()
+
+    async def hang(**_):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    primary = make_backend("primary", hang)
+    secondary = make_backend("secondary", lambda **_: response("hedge"))
+    for _ in range(3):
+        primary.record_success(0.01)
+    secondary.record_success(1.0)
+    router = ModelRouter([primary, secondary], hedge=True, hedge_min_delay=0.01, hedge_min_samples=3)
+
+    result = await asyncio.wait_for(router.complete([{"role": "user", "content": "Hi"}]), timeout=1)
+
+    assert result.choices[0].message.content == "hedge"
+    assert cancelled.is_set()
+    # Отменённый проигравший не получает ни ложной задержки, ни «успеха»
+    assert list(primary.latencies) == [0.01] * 3
+    assert primary.error_ewma == 0
+
+
+@pytest.mark.asyncio
+async def test_router_stream_fails_over_before_first_chunk():
+    """
+    Проверяем, что поток, упавший до первого фрагмента, переходит на другой бэкенд.
+    """
+    def chunk(content):
+        item = MagicMock()
+        item.usage = None
+        item.choices[0].delta.content = content
+        return item
+
+    async def fake_stream():
+        for content in ["При", "вет"]:
+            yield chunk(content)
+
+    def fail(**_):
+        raise RuntimeError("upstream error")
+
+    first = make_backend("first", fail)
+    second = make_backend("second", lambda **_: fake_stream())
+    router = ModelRouter([first, second], hedge=False)
+
+    deltas = [delta async for delta in router.stream([{"role": "user", "content": "Hi"}])]
+
+    assert deltas == ["При", "вет"]
+    assert second.client.chat.completions.create.await_args.kwargs["stream"] is True
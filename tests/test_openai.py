@@ -1,7 +1,9 @@
+import httpx
 import pytest
-from unittest.mock import patch, AsyncMock
-from src.openai_service import get_answer
-from src.config import MODEL  # Опционально, если нужно сверять точное имя модели
+from openai import RateLimitError
+from unittest.mock import patch, AsyncMock, MagicMock
+from src.openai_service import get_answer, get_summary, stream_answer
+from src.config import MODEL, SUMMARY_MODEL  # Опционально, если нужно сверять точное имя модели
 
 
 @pytest.mark.asyncio
@@ -36,3 +38,107 @@ async def test_get_answer_error():
 
         # Должен вернуться текст "Ошибка при обработке запроса к OpenAI."
         assert result == "Ошибка при обработке запроса к OpenAI."
+
+
+@pytest.mark.asyncio
+async def test_get_answer_rate_limited_signals_overload():
+    """
+    Тест проверяет, что 429 от OpenAI снижает лимит параллельности consumer.
+    """
+    error = RateLimitError(
+        "Rate limit",
+        response=httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com")),
+        body=None,
+    )
+    with patch("src.openai_service.client.chat.completions.create", side_effect=error), \
+            patch("src.openai_service.consumer_limiter.on_overload") as mock_overload:
+        result = await get_answer([{"role": "user", "content": "Привет"}])
+
+    assert result == "Ошибка при обработке запроса к OpenAI."
+    mock_overload.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_answer_caches_by_backend_models():
+    """
+    Тест проверяет, что ключ кэша ответов строится по моделям всех бэкендов
+    маршрутизатора, а не только по MODEL.
+    """
+    with patch("src.openai_service.response_cache.get_or_create", AsyncMock(return_value="cached")) as mock_cache, \
+            patch("src.openai_service.router.backends", [MagicMock(model="b-model"), MagicMock(model="a-model")]):
+        assert await get_answer([{"role": "user", "content": "Привет"}]) == "cached"
+
+    assert mock_cache.await_args.args[0] == "a-model,b-model"
+
+
+@pytest.mark.asyncio
+async def test_stream_answer_yields_deltas():
+    """
+    Тест проверяет, что stream_answer отдаёт непустые фрагменты потока.
+    """
+    def chunk(content):
+        item = MagicMock()
+        item.choices[0].delta.content = content
+        return item
+
+    async def fake_stream():
+        for content in ["При", None, "вет"]:
+            yield chunk(content)
+
+    with patch("src.openai_service.client.chat.completions.create", new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = fake_stream()
+        deltas = [delta async for delta in stream_answer([{"role": "user", "content": "Hi"}])]
+
+    assert deltas == ["При", "вет"]
+    assert mock_create.await_args.kwargs["stream"] is True
+
+
+@pytest.mark.asyncio
+async def test_stream_answer_error_text_only_before_first_delta():
+    """
+    Тест проверяет, что текст ошибки отдаётся, только если поток не начался,
+    а обрыв после первого фрагмента пробрасывается.
+    """
+    async def failing_stream(_, fail_after):
+        for delta in ["Hello"][:fail_after]:
+            yield delta
+        raise RuntimeError("stream broken")
+
+    with patch("src.openai_service.router.stream", lambda messages: failing_stream(messages, 0)):
+        deltas = [delta async for delta in stream_answer([{"role": "user", "content": "Hi"}])]
+    assert deltas == ["Ошибка при обработке запроса к OpenAI."]
+
+    deltas = []
+    with patch("src.openai_service.router.stream", lambda messages: failing_stream(messages, 1)):
+        with pytest.raises(RuntimeError):
+            async for delta in stream_answer([{"role": "user", "content": "Hi"}]):
+                deltas.append(delta)
+    assert deltas == ["Hello"]
+
+
+@pytest.mark.asyncio
+async def test_get_summary_uses_summary_model():
+    """
+    Тест проверяет, что краткое содержание запрашивается у SUMMARY_MODEL
+    и включает предыдущее содержание и новые реплики.
+    """
+    mock_response = AsyncMock()
+    mock_response.choices[0].message.content = "Краткое содержание"
+    with patch("src.openai_service.client.chat.completions.create", new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = mock_response
+        result = await get_summary("Раньше", [{"role": "user", "content": "Новое"}])
+
+    assert result == "Краткое содержание"
+    kwargs = mock_create.await_args.kwargs
+    assert kwargs["model"] == SUMMARY_MODEL
+    assert "Раньше" in kwargs["messages"][-1]["content"]
+    assert "user: Новое" in kwargs["messages"][-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_get_summary_error():
+    """
+    Тест проверяет, что при ошибке OpenAI краткое содержание не возвращается.
+    """
+    with patch("src.openai_service.client.chat.completions.create", side_effect=Exception("OpenAI Error")):
+        assert await get_summary(None, [{"role": "user", "content": "Новое"}]) is None
@@ -0,0 +1,171 @@
+import asyncio
+import json
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.consumer import callback
+from src.models import AnswerMessage, InputMessage, Priority
+from src.ordering import (
+    ConversationLocks,
+    DialogLeases,
+    conversation_queue_name,
+    declare_conversation_queues,
+    message_priority,
+    worker_shards,
+)
+
+
+def test_conversation_always_maps_to_same_shard():
+    """
+    Проверяем, что диалог всегда попадает в один шард, а диалоги распределяются по шардам.
+    """
+    names = {conversation_queue_name("q", f"dialog-{i}", 4) for i in range(100)}
+    assert names == {"q.0", "q.1", "q.2", "q.3"}
+    assert conversation_queue_name("q", "dialog-7", 4) == conversation_queue_name("q", "dialog-7", 4)
+
+
+def test_worker_shards_spread_shards_across_workers():
+    """
+    Проверяем, что каждый шард достаётся ровно одному воркеру и все воркеры заняты.
+    """
+    assignment = [worker_shards(8, 3, worker) for worker in range(3)]
+
+    assert assignment == [[0, 3, 6], [1, 4, 7], [2, 5]]
+    assert sorted(index for shards in assignment for index in shards) == list(range(8))
+    assert worker_shards(8, 1, 0) == list(range(8))
+
+
+@pytest.mark.asyncio
+async def test_shard_queues_have_single_active_consumer():
+    """
+    Проверяем, что очереди-шарды объявляются с x-single-active-consumer
+    и x-max-priority, а без приоритетов — только с x-single-active-consumer.
+    """
+    channel = AsyncMock()
+    queues = await declare_conversation_queues(channel, "q", 3, max_priority=2)
+
+    assert len(queues) == 3
+    for index, call in enumerate(channel.declare_queue.await_args_list):
+        assert call.args == (f"q.{index}",)
+        assert call.kwargs["arguments"] == {"x-single-active-consumer": True, "x-max-priority": 2}
+
+    channel = AsyncMock()
+    await declare_conversation_queues(channel, "q", 1, max_priority=0)
+    assert channel.declare_queue.await_args.kwargs["arguments"] == {"x-single-active-consumer": True}
+
+
+def test_interactive_messages_get_higher_priority():
+    """
+    Проверяем, что interactive-сообщения получают максимальный приоритет,
+    а bulk — нулевой, и что по умолчанию сообщение interactive.
+    """
+    message = InputMessage(message="hi", callback_url="http://callback.test/")
+    assert message.priority is Priority.interactive
+    assert message_priority(Priority.interactive, 2) == 2
+    assert message_priority(Priority.bulk, 2) == 0
+
+
+@pytest.mark.asyncio
+async def test_locks_serialize_same_conversation_and_clean_up():
+    """
+    Проверяем, что один диалог обрабатывается по одному в порядке входа,
+    разные — параллельно, а отпущенные блокировки удаляются.
+    """
+    locks = ConversationLocks()
+    events = []
+
+    async def work(conversation_id: str, name: str):
+        async with locks.hold(conversation_id):
+            events.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            events.append(f"end {name}")
+
+    await asyncio.gather(work("a", "a1"), work("a", "a2"), work("b", "b1"))
+
+    assert events.index("end a1") < events.index("start a2")
+    assert events.index("start b1") < events.index("end a1")
+    assert len(locks) == 0
+
+
+@pytest.mark.asyncio
+async def test_callback_processes_dialog_messages_in_order():
+    """
+    Проверяем, что параллельно полученные сообщения одного диалога
+    не обрабатываются одновременно и идут в порядке получения.
+    """
+    active = 0
+    max_active = 0
+    order = []
+
+    async def process(_, input_message):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        order.append(input_message.message)
+        active -= 1
+        return AnswerMessage(message="ok", callback_url="http://callback.test/", conversation_id="dialog-1")
+
+    def incoming(text: str) -> MagicMock:
+        message = MagicMock()
+        message.headers = {}
+        message.message_id = None
+        message.body = json.dumps(
+            {"message": text, "callback_url": "http://callback.test/", "conversation_id": "dialog-1"}
+        ).encode()
+        message.process.return_value.__aenter__ = AsyncMock(return_value=message)
+        message.process.return_value.__aexit__ = AsyncMock(return_value=None)
+        return message
+
+    with patch("src.consumer.process_message", side_effect=process), \
+            patch("src.consumer.delivery_publisher.publish", new_callable=AsyncMock), \
+            patch("src.consumer.get_async_session", new_callable=MagicMock) as mock_get_session:
+        mock_get_session.return_value.__aenter__ = AsyncMock(return_value=MagicMock())
+        mock_get_session.return_value.__aexit__ = AsyncMock(return_value=None)
+
+        await asyncio.gather(*(callback(incoming(text)) for text in ["1", "2", "3"]))
+
+    assert max_active == 1
+    assert order == ["1", "2", "3"]
+
+
+@pytest.mark.asyncio
+async def test_dialog_leases_admit_one_holder():
+    """
+    Проверяем, что блокировку диалога получает один держатель, она снимается
+    после работы, а при недоступном Redis работа выполняется без блокировки.
+    """
+    held: set[str] = set()
+
+    def make_lock(name, timeout, blocking):
+        lock = MagicMock()
+
+        async def acquire():
+            if name in held:
+                return False
+            held.add(name)
+            return True
+
+        async def release():
+            held.discard(name)
+
+        lock.acquire = AsyncMock(side_effect=acquire)
+        lock.release = AsyncMock(side_effect=release)
+        return lock
+
+    leases = DialogLeases("lock:", 60)
+    leases._redis = MagicMock()
+    leases._redis.lock.side_effect = make_lock
+
+    async with leases.hold("d") as first:
+        async with leases.hold("d") as second:
+            assert (first, second) == (True, False)
+        assert held == {"lock:d"}
+    assert held == set()
+    assert leases._redis.lock.call_args.kwargs == {"timeout": 60, "blocking": False}
+
+    leases._redis.lock.side_effect = None
+    leases._redis.lock.return_value.acquire = AsyncMock(side_effect=ConnectionError("down"))
+    async with leases.hold("d") as acquired:
+        assert acquired
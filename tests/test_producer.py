@@ -1,3 +1,6 @@
+import json
+from datetime import datetime
+
 from fastapi import HTTPException
 
 import pytest
@@ -8,6 +11,8 @@ from fastapi import status
 from redis import Redis
 
 import src.config as config
+from src.database import DBMessage, Role
+from src.models import Priority
 from src.producer import app, lifespan
 
 
@@ -54,36 +59,182 @@ async def test_send_message_to_rabbitmq_failure():
 
 
 @pytest.mark.asyncio
-async def test_delete_dialog_data_success():
+async def test_delete_dialog_schedules_background_job():
     """
-    Тестируем эндпоинт /delete_dialog_data. Проверяем, что возвращается статус 200,
-    а также что фактически вызывается delete_all_messages.
+    Тестируем DELETE /dialogs/{id}: удаление ставится в фон, ответ 202 с адресом статуса,
+    а DELETE /dialogs ставит очистку всей таблицы.
     """
-    mock_session = MagicMock()
-    mock_session.return_value.__aenter__.return_value = mock_session
-    mock_session.return_value.__aexit__.return_value = None
-    with patch("src.producer.delete_all_messages", new_callable=AsyncMock) as mock_delete_all, \
-            patch("src.database.get_async_session", new_callable=mock_session):
-        mock_delete_all.return_value = None
+    with patch("src.producer.deletion_jobs.start", new_callable=AsyncMock) as mock_start:
+        mock_start.return_value = "job-1"
 
         async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
-            response = await client.get("/delete_dialog_data")
+            response = await client.delete("/dialogs/dialog-1")
+            wipe = await client.delete("/dialogs")
 
-        assert response.status_code == status.HTTP_200_OK
-        assert response.json() == {"message": "✅ Данные диалога удалены"}
-        mock_delete_all.assert_awaited_once()
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json() == {"job_id": "job-1", "status_url": "/deletions/job-1"}
+        assert response.headers["location"] == "/deletions/job-1"
+        assert wipe.status_code == status.HTTP_202_ACCEPTED
+        assert [call.args for call in mock_start.await_args_list] == [("dialog-1",), (None,)]
 
 
 @pytest.mark.asyncio
-async def test_delete_dialog_data_failure():
+async def test_delete_dialog_failure():
     """
-    Тестируем, что при ошибке в delete_all_messages эндпоинт вернёт HTTP 500.
+    Тестируем, что при ошибке постановки задачи эндпоинт вернёт HTTP 500.
     """
-    with patch("src.producer.delete_all_messages", new_callable=AsyncMock) as mock_delete_all:
-        mock_delete_all.side_effect = Exception("DB Error")
+    with patch("src.producer.deletion_jobs.start", new_callable=AsyncMock) as mock_start:
+        mock_start.side_effect = Exception("Redis Error")
 
         async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
-            response = await client.get("/delete_dialog_data")
+            response = await client.delete("/dialogs/dialog-1")
 
         assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
         assert response.json()["detail"] == "Ошибка при удалении данных диалога"
+
+
+@pytest.mark.asyncio
+async def test_deletion_status():
+    """
+    Тестируем GET /deletions/{job_id}: статус найденной задачи и 404 для неизвестной.
+    """
+    job = {"job_id": "job-1", "status": "running", "deleted": 2000, "conversation_id": "dialog-1"}
+    with patch("src.producer.deletion_jobs.get", new_callable=AsyncMock) as mock_get:
+        mock_get.side_effect = [job, None]
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            found = await client.get("/deletions/job-1")
+            missing = await client.get("/deletions/unknown")
+
+        assert found.status_code == status.HTTP_200_OK
+        assert found.json() == job
+        assert missing.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_read_dialog_messages_paginates_with_cursor():
+    """
+    Тестируем GET /dialogs/{id}/messages: полная страница отдаёт next_cursor,
+    курсор передаётся в запрос следующей страницы, неполная — последняя.
+    """
+    created_at = datetime(2026, 10, 16, 12, 0)
+    page = [DBMessage(id=i, created_at=created_at, role=Role.user, content=str(i)) for i in (1, 2)]
+    with patch("src.producer.get_messages_page", new_callable=AsyncMock) as mock_page, \
+            patch("src.producer.get_read_session", new_callable=MagicMock) as mock_get_session:
+        mock_get_session.return_value.__aenter__ = AsyncMock(return_value=MagicMock())
+        mock_get_session.return_value.__aexit__ = AsyncMock(return_value=None)
+        mock_page.side_effect = [page, page[:1]]
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            first = await client.get("/dialogs/dialog-1/messages", params={"limit": 2})
+            cursor = first.json()["next_cursor"]
+            last = await client.get("/dialogs/dialog-1/messages", params={"limit": 2, "cursor": cursor})
+            invalid = await client.get("/dialogs/dialog-1/messages", params={"cursor": "???"})
+
+    assert [m["content"] for m in first.json()["messages"]] == ["1", "2"]
+    assert mock_page.await_args_list[1].args[1:] == ("dialog-1", 2, (created_at, 2))
+    assert last.json()["next_cursor"] is None
+    assert invalid.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_export_dialog_streams_ndjson():
+    """
+    Тестируем GET /dialogs/{id}/export: по реплике в строке NDJSON.
+    """
+    async def stream(_):
+        for i in (1, 2):
+            yield DBMessage(id=i, created_at=datetime(2026, 10, 16), role=Role.assistant, content=str(i))
+
+    with patch("src.producer.stream_dialog_messages", stream):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/dialogs/dialog-1/export")
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["id"], line["role"], line["content"]) for line in lines] == [
+        (1, "assistant", "1"),
+        (2, "assistant", "2"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_send_batch_reports_per_item_status():
+    """
+    Проверяем пакетный эндпоинт: невалидные сообщения помечаются invalid,
+    непринятые брокером — failed, лимит списывается один раз на весь пакет.
+    """
+    batch = [
+        {"message": "One", "callback_url": "http://test2"},
+        {"message": "Bad"},
+        {"message": "Three", "callback_url": "http://test2", "conversation_id": "d", "priority": "interactive"},
+    ]
+    with patch("src.producer.charge_rate_limit", new_callable=AsyncMock) as mock_charge, \
+            patch("src.producer.rabbitmq_service.send_messages", new_callable=AsyncMock) as mock_send:
+        mock_send.return_value = [True, False]
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/webhook/batch", json=batch)
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body["accepted"] == 1
+    assert [item["status"] for item in body["results"]] == ["queued", "invalid", "failed"]
+    mock_charge.assert_awaited_once()
+    assert mock_charge.await_args.args[1] == 2
+    assert [m.message for m in mock_send.await_args.args[0]] == ["One", "Three"]
+    # Без явного priority сообщения пакета идут в фоновой полосе
+    assert [m.priority for m in mock_send.await_args.args[0]] == [Priority.bulk, Priority.interactive]
+
+
+@pytest.mark.asyncio
+async def test_send_batch_skips_duplicate_message_ids():
+    """
+    Проверяем, что сообщения с уже принятым message_id не публикуются
+    и не списываются из лимита, а неопубликованные освобождают свой идентификатор.
+    """
+    batch = [
+        {"message": "One", "callback_url": "http://test2", "message_id": "m1"},
+        {"message": "Two", "callback_url": "http://test2", "message_id": "m2"},
+        {"message": "Three", "callback_url": "http://test2", "message_id": "m3"},
+    ]
+    with patch("src.producer.idempotency_store.claim_many", AsyncMock(return_value=[True, False, True])), \
+            patch("src.producer.idempotency_store.release", new_callable=AsyncMock) as mock_release, \
+            patch("src.producer.charge_rate_limit", new_callable=AsyncMock) as mock_charge, \
+            patch("src.producer.rabbitmq_service.send_messages", new_callable=AsyncMock) as mock_send:
+        mock_send.return_value = [True, False]
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/webhook/batch", json=batch)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["status"] for item in response.json()["results"]] == ["queued", "duplicate", "failed"]
+    assert mock_charge.await_args.args[1] == 2
+    assert [m.message_id for m in mock_send.await_args.args[0]] == ["m1", "m3"]
+    assert [m.message_id for m in mock_release.await_args.args] == ["m3"]
+
+
+@pytest.mark.asyncio
+async def test_send_batch_accepts_ndjson():
+    """
+    Проверяем приём пакета в формате NDJSON.
+    """
+    body = '{"message": "One", "callback_url": "http://test2"}\n\n{"message": "Two", "callback_url": "http://test2"}\n'
+    with patch("src.producer.charge_rate_limit", new_callable=AsyncMock), \
+            patch("src.producer.rabbitmq_service.send_messages", new_callable=AsyncMock) as mock_send:
+        mock_send.return_value = [True, True]
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/webhook/batch",
+                content=body,
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["accepted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_send_batch_rejects_non_array():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/webhook/batch", json={"message": "One"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi import HTTPException
@@ -5,6 +7,8 @@ from starlette.responses import Response
 
 import aio_pika
 
+from src.config import QUEUE_MAX_PRIORITY
+from src.ordering import conversation_queue_name
 from src.rabbit import RabbitMQService
 from src.models import InputMessage
 
@@ -20,12 +24,12 @@ async def test_connect_creates_new_connection_and_channel():
         mock_connect_robust.return_value = mock_connection
         mock_connection.channel = AsyncMock(return_value=mock_channel)
 
-        service = RabbitMQService("amqp://fake-url", "fake-queue")
+        service = RabbitMQService("amqp://fake-url", "fake-queue", shards=2)
         channel = await service.connect()
 
         mock_connect_robust.assert_called_once_with("amqp://fake-url")
         mock_connection.channel.assert_awaited_once()
-        mock_channel.declare_queue.assert_awaited_once_with("fake-queue", durable=True)
+        assert [call.args[0] for call in mock_channel.declare_queue.await_args_list] == ["fake-queue.0", "fake-queue.1"]
         assert channel == mock_channel
 
 
@@ -55,41 +59,72 @@ async def test_connect_reuses_open_connection_and_channel():
     assert channel == mock_channel
 
 
+def make_service_with_channel(publish: AsyncMock, **kwargs) -> tuple[RabbitMQService, AsyncMock]:
+    """Создаёт сервис, у которого каналы пула — мок с заданным publish."""
+    service = RabbitMQService("amqp://fake-url", "fake-queue", **kwargs)
+    mock_channel = AsyncMock(spec=aio_pika.Channel)
+    mock_channel.is_closed = False
+    mock_channel.default_exchange = AsyncMock()
+    mock_channel.default_exchange.publish = publish
+    service._create_publish_channel = AsyncMock(return_value=mock_channel)
+    return service, mock_channel
+
+
 @pytest.mark.asyncio
 async def test_send_message_success():
     """
     Проверяем отправку сообщения в случае успеха.
     """
-    service = RabbitMQService("amqp://fake-url", "fake-queue")
-    mock_channel = AsyncMock(spec=aio_pika.Channel)
-    mock_channel.default_exchange = AsyncMock
-
-    service.connect = AsyncMock(return_value=mock_channel)
     mock_publish = AsyncMock()
-    mock_channel.default_exchange.publish = mock_publish
+    service, _ = make_service_with_channel(mock_publish)
 
     test_message = InputMessage(message="Hello RabbitMQ!", callback_url="http://fake-callback")
     response = await service.send_message(test_message)
 
-    service.connect.assert_awaited_once()
+    service._create_publish_channel.assert_awaited_once()
     mock_publish.assert_awaited_once()
+    assert mock_publish.await_args.kwargs["routing_key"] == conversation_queue_name(
+        "fake-queue", test_message.conversation_id, service.shards
+    )
     assert isinstance(response, Response)
     assert response.status_code == 200
     assert "Сообщение отправлено" in response.body.decode("utf-8")
 
 
+def test_build_message_sets_priority():
+    """
+    Проверяем, что interactive-сообщение публикуется с приоритетом выше bulk.
+    """
+    service = RabbitMQService("amqp://fake", "fake-queue")
+    interactive = service.build_message(InputMessage(message="hi", callback_url="http://fake-callback"))
+    bulk = service.build_message(InputMessage(message="hi", callback_url="http://fake-callback", priority="bulk"))
+
+    assert interactive.priority == QUEUE_MAX_PRIORITY
+    assert bulk.priority == 0
+
+
+def test_build_message_sets_unique_message_id():
+    """
+    Проверяем, что каждое AMQP-сообщение получает свой message_id,
+    даже если клиентский идентификатор не задан.
+    """
+    service = RabbitMQService("amqp://fake", "fake-queue")
+    message = InputMessage(message="hi", callback_url="http://fake-callback")
+
+    first, second = service.build_message(message), service.build_message(message)
+
+    assert first.message_id and second.message_id
+    assert first.message_id != second.message_id
+
+
 @pytest.mark.asyncio
 async def test_send_message_failure():
     """
     Проверяем, что при ошибке в процессе публикации вызывается HTTPException (500).
     """
-    service = RabbitMQService("amqp://fake-url", "fake-queue")
-    mock_channel = AsyncMock(spec=aio_pika.Channel)
-    mock_channel.default_exchange = AsyncMock
-    mock_channel.default_exchange.publish = AsyncMock()
-    mock_channel.default_exchange.publish.side_effect = RuntimeError("publish error")
+    mock_publish = AsyncMock(side_effect=RuntimeError("publish error"))
+    service, _ = make_service_with_channel(mock_publish)
 
-    service.connect = AsyncMock(return_value=mock_channel)
     test_message = InputMessage(message="Broken RabbitMQ!", callback_url="http://fake-callback")
     with pytest.raises(HTTPException) as exc_info:
         await service.send_message(test_message)
@@ -97,6 +132,30 @@ async def test_send_message_failure():
     assert "Ошибка RabbitMQ" in str(exc_info.value.detail)
 
 
+@pytest.mark.asyncio
+async def test_concurrent_messages_are_published_as_one_batch():
+    """
+    Проверяем, что параллельные публикации уходят одним пакетом через один канал,
+    а ошибка подтверждения одного сообщения не влияет на остальные.
+    """
+    async def publish(message, routing_key):
+        if message.body == b"bad":
+            raise aio_pika.exceptions.DeliveryError(None, None)
+
+    mock_publish = AsyncMock(side_effect=publish)
+    service, _ = make_service_with_channel(mock_publish, batch_size=10, batch_window=0.01)
+
+    results = await asyncio.gather(
+        *(service.publish(aio_pika.Message(body=body)) for body in [b"1", b"bad", b"3"]),
+        return_exceptions=True,
+    )
+
+    service._create_publish_channel.assert_awaited_once()
+    assert mock_publish.await_count == 3
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], aio_pika.exceptions.DeliveryError)
+
+
 @pytest.mark.asyncio
 async def test_close_connection():
     """
@@ -122,3 +181,19 @@ async def test_close_connection():
     await service.close_connection()
     # Повторно close() уже не вызовется (так как is_closed станет True).
     assert mock_connection.close.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_send_messages_reports_each_confirm():
+    """
+    Проверяем, что пакетная отправка возвращает статус подтверждения по каждому сообщению.
+    """
+    service = RabbitMQService("amqp://fake-url", "fake-queue")
+    service.publish_batch = AsyncMock(return_value=[None, RuntimeError("nack")])
+    messages = [
+        InputMessage(message="One", callback_url="http://fake-callback"),
+        InputMessage(message="Two", callback_url="http://fake-callback"),
+    ]
+
+    assert await service.send_messages(messages) == [True, False]
+    assert len(service.publish_batch.await_args.args[0]) == 2
@@ -0,0 +1,84 @@
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.model_router import Backend, ModelRouter
+from src.rate_scheduler import RateScheduler, ACQUIRE_SCRIPT, SYNC_SCRIPT
+
+
+def make_scheduler(eval_result=None, eval_error=None) -> tuple[RateScheduler, MagicMock]:
+    """Создаёт планировщик с замоканным клиентом Redis."""
+    client = MagicMock()
+    client.eval = AsyncMock(side_effect=eval_error) if eval_error else AsyncMock(side_effect=eval_result)
+    scheduler = RateScheduler()
+    scheduler._redis = client
+    return scheduler, client
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_until_budget_is_available():
+    """
+    Проверяем, что при нехватке бюджета запрос ждёт указанное скриптом время
+    и повторяет попытку, а не падает.
+    """
+    scheduler, client = make_scheduler(eval_result=[5, 0])
+
+    with patch("src.rate_scheduler.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+        await scheduler.acquire("default", rpm=60, tpm=1000, tokens=300)
+
+    assert client.eval.await_count == 2
+    mock_sleep.assert_awaited_once_with(0.005)
+    assert client.eval.await_args.args == (
+        ACQUIRE_SCRIPT, 2, "llm:rate:default:requests", "llm:rate:default:tokens", 60, 1000, 300,
+    )
+
+
+@pytest.mark.asyncio
+async def test_acquire_without_limits_or_redis_does_not_block():
+    """
+    Проверяем, что без лимитов Redis не используется,
+    а при недоступном Redis запрос пропускается.
+    """
+    scheduler, client = make_scheduler(eval_error=ConnectionError("redis down"))
+
+    await scheduler.acquire("default", rpm=0, tpm=0, tokens=100)
+    client.eval.assert_not_awaited()
+
+    await scheduler.acquire("default", rpm=60, tpm=0, tokens=100)
+    client.eval.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_sync_uses_provider_remaining_headers():
+    """
+    Проверяем, что остатки из заголовков x-ratelimit-remaining-* записываются в вёдра.
+    """
+    scheduler, client = make_scheduler(eval_result=[0])
+    headers = httpx.Headers({
+        "x-ratelimit-remaining-requests": "42",
+        "x-ratelimit-remaining-tokens": "9000",
+    })
+
+    await scheduler.response_hook("default", rpm=60, tpm=10000)(httpx.Response(200, headers=headers))
+
+    client.eval.assert_awaited_once_with(
+        SYNC_SCRIPT, 2, "llm:rate:default:requests", "llm:rate:default:tokens", 42, 9000,
+    )
+
+
+@pytest.mark.asyncio
+async def test_router_acquires_budget_before_request():
+    """
+    Проверяем, что маршрутизатор списывает бюджет бэкенда до вызова модели.
+    """
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(return_value=MagicMock())
+    backend = Backend("limited", client, "model-x", rpm=10, tpm=5000)
+
+    with patch("src.model_router.rate_scheduler.acquire", new_callable=AsyncMock) as mock_acquire:
+        await ModelRouter([backend], hedge=False).complete([{"role": "user", "content": "Hi"}])
+
+    mock_acquire.assert_awaited_once()
+    name, rpm, tpm, tokens = mock_acquire.await_args.args
+    assert (name, rpm, tpm) == ("limited", 10, 5000)
+    assert tokens > 0
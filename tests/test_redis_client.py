@@ -0,0 +1,33 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from src import redis_client
+from src.history_cache import HistoryCache
+from src.idempotency import IdempotencyStore
+
+
+@pytest.mark.asyncio
+async def test_stores_share_one_client_until_closed():
+    """
+    Проверяем, что хранилища без явного клиента работают через один общий
+    клиент Redis, а close_redis() закрывает его и следующий вызов создаёт новый.
+    """
+    await redis_client.close_redis()
+    first, second = MagicMock(aclose=AsyncMock()), MagicMock(aclose=AsyncMock())
+    with patch("src.redis_client.redis.from_url", side_effect=[first, second]) as mock_from_url:
+        assert HistoryCache(size=3, ttl=60).connect() is first
+        assert IdempotencyStore().connect() is first
+        await redis_client.close_redis()
+        assert redis_client.get_redis() is second
+        await redis_client.close_redis()
+
+    assert mock_from_url.call_count == 2
+    first.aclose.assert_awaited_once()
+    second.aclose.assert_awaited_once()
+
+
+def test_store_uses_explicit_client():
+    """Проверяем, что явно переданный клиент важнее общего."""
+    client = MagicMock()
+    assert IdempotencyStore(client=client).connect() is client
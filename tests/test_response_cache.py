@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.metrics import registry
+from src.response_cache import ResponseCache
+
+
+def make_cache(enabled: bool = True) -> ResponseCache:
+    return ResponseCache(ttl=60, max_entries=2, enabled=enabled)
+
+
+def test_make_key_ignores_dict_order():
+    """
+    Проверяем, что ключ зависит от содержимого запроса, а не от порядка ключей.
+    """
+    first = ResponseCache.make_key("m", [{"role": "user", "content": "hi"}], {"t": 1})
+    second = ResponseCache.make_key("m", [{"content": "hi", "role": "user"}], {"t": 1})
+    other = ResponseCache.make_key("m", [{"role": "user", "content": "bye"}], {"t": 1})
+    assert first == second
+    assert first != other
+
+
+@pytest.mark.asyncio
+async def test_disabled_cache_calls_model_directly():
+    cache = make_cache(enabled=False)
+    create = AsyncMock(return_value="answer")
+
+    assert await cache.get_or_create("m", [], {}, create) == "answer"
+    create.assert_awaited_once()
+    assert cache.stats() == {"hits": 0, "misses": 0, "coalesced": 0}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_share_one_call():
+    """
+    Проверяем, что одновременные одинаковые запросы выполняются один раз.
+    """
+    cache = make_cache()
+    calls = 0
+
+    async def create():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    messages = [{"role": "user", "content": "hi"}]
+    with patch.object(cache, "_get", AsyncMock(return_value=None)), \
+            patch.object(cache, "_set", new_callable=AsyncMock) as mock_set:
+        results = await asyncio.gather(*(cache.get_or_create("m", messages, {}, create) for _ in range(5)))
+
+    assert results == ["answer"] * 5
+    assert calls == 1
+    mock_set.assert_awaited_once()
+    assert cache.stats() == {"hits": 0, "misses": 1, "coalesced": 4}
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_and_errors_are_not_cached():
+    cache = make_cache()
+    with patch.object(cache, "_get", AsyncMock(return_value="cached")):
+        create = AsyncMock()
+        assert await cache.get_or_create("m", [], {}, create) == "cached"
+        create.assert_not_awaited()
+
+    with patch.object(cache, "_get", AsyncMock(return_value=None)), \
+            patch.object(cache, "_set", new_callable=AsyncMock) as mock_set:
+        with pytest.raises(RuntimeError):
+            await cache.get_or_create("m", [], {}, AsyncMock(side_effect=RuntimeError("boom")))
+        mock_set.assert_not_awaited()
+
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_set_evicts_oldest_entries():
+    """
+    Проверяем, что при превышении max_entries удаляются самые старые записи.
+    """
+    cache = make_cache()
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[True, 1, 0, 3])
+    client = MagicMock()
+    client.pipeline.return_value.__aenter__.return_value = pipe
+    client.pipeline.return_value.__aexit__ = AsyncMock(return_value=None)
+    client.zpopmin = AsyncMock(return_value=[("old", 1.0)])
+    client.delete = AsyncMock()
+    cache._redis = client
+
+    await cache._set("new", "answer")
+
+    client.zpopmin.assert_awaited_once_with("llm:index", 1)
+    client.delete.assert_awaited_once_with("llm:answer:old")
+
+
+@pytest.mark.asyncio
+async def test_cache_counters_are_exported_to_metrics():
+    """
+    Проверяем, что попадания, промахи и объединённые запросы видны в /metrics.
+    """
+    cache = make_cache()
+
+    async def create():
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    with patch.object(cache, "_get", AsyncMock(side_effect=[None, "cached"])), \
+            patch.object(cache, "_set", new_callable=AsyncMock):
+        await asyncio.gather(*(cache.get_or_create("m", [], {}, create) for _ in range(2)))
+        await cache.get_or_create("m", [], {}, create)
+
+    lines = registry.render().splitlines()
+    for name in ("hits", "misses", "coalesced"):
+        assert any(line.startswith(f"onai_llm_cache_{name}_total ") for line in lines)
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 1}
@@ -0,0 +1,138 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.database import (
+    Base,
+    DBMessage,
+    Role,
+    insert_messages,
+    get_all_messages,
+    ensure_partitions,
+    month_start,
+    partition_name,
+    partition_upper_bound,
+)
+from src.retention import delete_in_batches, prune_messages
+
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+NOW = datetime(2026, 10, 16, 12, 0)
+
+
+def test_partition_helpers():
+    """
+    Проверяем границы месяцев, имена партиций и разбор границ из pg_get_expr.
+    """
+    assert month_start(NOW) == datetime(2026, 10, 1)
+    assert month_start(NOW, 3) == datetime(2027, 1, 1)
+    assert month_start(NOW, -10) == datetime(2025, 12, 1)
+    assert partition_name(datetime(2027, 1, 1)) == "messages_p202701"
+    assert partition_upper_bound(
+        "FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00')"
+    ) == datetime(2026, 11, 1)
+    assert partition_upper_bound("DEFAULT") is None
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions_continues_after_last_partition():
+    """
+    Проверяем, что партиции создаются от конца последней существующей
+    до нужного числа месяцев вперёд, а без партиционирования — не создаются.
+    """
+    conn = AsyncMock()
+    partitions = [("messages_legacy", datetime(2026, 11, 1)), ("messages_p202611", datetime(2026, 12, 1))]
+    with patch("src.database.list_partitions", new=AsyncMock(return_value=partitions)):
+        created = await ensure_partitions(conn, months_ahead=2, now=NOW)
+    assert created == ["messages_p202612"]
+    assert "FROM ('2026-12-01T00:00:00') TO ('2027-01-01T00:00:00')" in str(conn.execute.await_args.args[0])
+
+    with patch("src.database.list_partitions", new=AsyncMock(return_value=[])):
+        assert await ensure_partitions(conn, months_ahead=2, now=NOW) == []
+
+
+@asynccontextmanager
+async def sqlite_sessions():
+    """
+    База в памяти (SQLite) с таблицами; отдаёт фабрику сессий,
+    которую использует и src.retention.
+    """
+    engine = create_async_engine(TEST_DATABASE_URL, echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def get_session():
+        async with SessionLocal() as session:
+            yield session
+
+    try:
+        with patch("src.database.get_async_session", get_session):
+            yield get_session
+    finally:
+        await engine.dispose()
+
+
+async def age(session, conversation_id: str, days: int) -> None:
+    await session.execute(
+        update(DBMessage)
+        .where(DBMessage.conversation_id == conversation_id)
+        .values(created_at=NOW - timedelta(days=days))
+    )
+    await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_delete_in_batches_pauses_between_batches():
+    """
+    Проверяем, что удаление идёт пачками заданного размера с паузой между ними.
+    """
+    async with sqlite_sessions() as session_factory:
+        async with session_factory() as session:
+            await insert_messages(session, "a", [(Role.user, str(i)) for i in range(5)])
+
+        with patch("src.database.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+            deleted = await delete_in_batches(DBMessage.conversation_id == "a", batch_size=2, pause=0.5)
+
+    assert deleted == 5
+    assert mock_sleep.await_count == 2
+    mock_sleep.assert_awaited_with(0.5)
+
+
+@pytest.mark.asyncio
+async def test_prune_messages_applies_default_and_per_dialog_retention():
+    """
+    Проверяем политику хранения: общий срок, более короткий и бессрочный
+    сроки отдельных диалогов.
+    """
+    async with sqlite_sessions() as session_factory:
+        async with session_factory() as session:
+            for conversation_id, days in [("old", 40), ("fresh", 5), ("short", 10), ("forever", 400)]:
+                await insert_messages(session, conversation_id, [(Role.user, conversation_id)])
+                await age(session, conversation_id, days)
+
+        with patch("src.retention.expire_partitions", new_callable=AsyncMock) as mock_expire, \
+                patch("src.retention.history_cache", MagicMock(invalidate=AsyncMock())) as mock_cache:
+            deleted = await prune_messages(NOW, retention_days=30, overrides={"short": 7, "forever": 0})
+
+        assert deleted == 2
+        # Бессрочный диалог запрещает удалять партиции целиком
+        mock_expire.assert_not_awaited()
+        mock_cache.invalidate.assert_any_await("short")
+        async with session_factory() as session:
+            assert sorted(m.conversation_id for m in await get_all_messages(session)) == ["forever", "fresh"]
+
+
+@pytest.mark.asyncio
+async def test_prune_messages_expires_partitions_by_longest_period():
+    """
+    Проверяем, что целиком удаляются только партиции старше самого долгого срока.
+    """
+    async with sqlite_sessions():
+        with patch("src.retention.expire_partitions", new=AsyncMock(return_value=[])) as mock_expire:
+            assert await prune_messages(NOW, retention_days=30, overrides={"long": 90}) == 0
+    mock_expire.assert_awaited_once_with(NOW - timedelta(days=90))
@@ -0,0 +1,52 @@
+import signal
+
+from unittest.mock import MagicMock, patch
+
+from src.supervisor import Supervisor
+
+
+def fake_process(alive: bool, exitcode: int | None = None) -> MagicMock:
+    process = MagicMock()
+    process.is_alive.return_value = alive
+    process.exitcode = exitcode
+    return process
+
+
+def test_crashed_worker_is_restarted_with_growing_backoff():
+    """
+    Проверяем, что упавший воркер перезапускается: первый раз сразу,
+    следующие — с удваивающейся задержкой.
+    """
+    supervisor = Supervisor(print, 2, "test")
+    supervisor._processes = {0: fake_process(alive=False, exitcode=1), 1: fake_process(alive=True)}
+    supervisor._started_at = {0: 0.0, 1: 0.0}
+
+    with patch("src.supervisor.time.monotonic", return_value=10.0):
+        supervisor._reap()
+    assert list(supervisor._processes) == [1]
+    assert supervisor._restart_at == {0: 10.0}
+
+    supervisor._processes[0] = fake_process(alive=False, exitcode=1)
+    with patch("src.supervisor.time.monotonic", return_value=11.0):
+        supervisor._reap()
+    assert supervisor._restart_at == {0: 12.0}
+    assert supervisor._backoff[0] == 2.0
+
+
+def test_stop_terminates_workers_without_restart():
+    """
+    Проверяем, что по сигналу супервизор отправляет воркерам SIGTERM
+    и не перезапускает остановившиеся процессы.
+    """
+    worker = fake_process(alive=True)
+    supervisor = Supervisor(print, 1, "test")
+    supervisor._processes = {0: worker}
+    supervisor._started_at = {0: 0.0}
+
+    supervisor._stop(signal.SIGTERM, None)
+    worker.terminate.assert_called_once()
+
+    worker.is_alive.return_value = False
+    supervisor._reap()
+    assert supervisor._processes == {}
+    assert supervisor._restart_at == {}
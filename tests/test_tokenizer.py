@@ -0,0 +1,20 @@
+from unittest.mock import patch
+
+from src.tokenizer import count_tokens, MESSAGE_OVERHEAD_TOKENS
+
+
+def test_count_tokens_grows_with_content():
+    """
+    Проверяет, что длинное сообщение занимает больше токенов, чем короткое,
+    а пустое — только служебные токены.
+    """
+    assert count_tokens("") == MESSAGE_OVERHEAD_TOKENS
+    assert count_tokens("Привет") < count_tokens("Привет, как дела? " * 10)
+
+
+def test_count_tokens_without_tokenizer():
+    """
+    Проверяет оценку по длине текста, если токенайзер недоступен.
+    """
+    with patch("src.tokenizer._get_encoding", return_value=None):
+        assert count_tokens("a" * 8) == 2 + MESSAGE_OVERHEAD_TOKENS